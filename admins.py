@@ -0,0 +1,78 @@
+import logging
+import time
+from typing import Callable, FrozenSet, Iterable, List
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять версию списка администраторов (изменения из других процессов)
+ADMINS_REFRESH_SECONDS = 5.0
+
+class AdminRegistry:
+    """Список администраторов из базы данных с кэшем в виде frozenset."""
+    def __init__(self, db: Database, seed: Iterable[int] = (), refresh_interval: float = ADMINS_REFRESH_SECONDS):
+        """Инициализация реестра: перенос администраторов из конфигурации и первая загрузка."""
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self._admins: FrozenSet[int] = frozenset()
+        self._version = -1
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[FrozenSet[int]], None]] = []
+        db.seed_admins(list(seed))
+        self.reload()
+
+    @property
+    def admins(self) -> FrozenSet[int]:
+        """Текущий набор администраторов."""
+        self._maybe_refresh()
+        return self._admins
+
+    def is_admin(self, user_id: int) -> bool:
+        """Проверяет, является ли пользователь администратором."""
+        self._maybe_refresh()
+        return user_id in self._admins
+
+    def subscribe(self, callback: Callable[[FrozenSet[int]], None]):
+        """Подписка на изменения списка администраторов."""
+        self._listeners.append(callback)
+
+    def add(self, user_id: int) -> bool:
+        """Добавляет администратора и обновляет кэш."""
+        added = self.db.add_admin(user_id)
+        self.reload()
+        return added
+
+    def remove(self, user_id: int) -> bool:
+        """Удаляет администратора и обновляет кэш."""
+        removed = self.db.remove_admin(user_id)
+        self.reload()
+        return removed
+
+    def _maybe_refresh(self):
+        """Раз в refresh_interval сверяет версию списка с базой."""
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            if self.db.get_settings_version("admins_version") != self._version:
+                self.reload()
+        except Exception as e:
+            logger.error(f"Ошибка при проверке версии списка администраторов: {e}")
+
+    def reload(self):
+        """Перечитывает список администраторов и уведомляет подписчиков об изменениях."""
+        version, user_ids = self.db.get_admins()
+        self._checked_at = time.monotonic()
+        admins = frozenset(user_ids)
+        self._version = version
+        if admins == self._admins:
+            return
+        self._admins = admins
+        logger.info(f"Список администраторов обновлён (версия {version}): {sorted(admins)}")
+        for callback in self._listeners:
+            try:
+                callback(admins)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике на изменения администраторов: {e}")
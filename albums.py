@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать остальные сообщения альбома после последнего полученного
+ALBUM_WAIT_SECONDS = 0.6
+# Telegram допускает не больше 10 элементов в media group
+MAX_ALBUM_PHOTOS = 10
+# Миниатюра — самый крупный размер, у которого большая сторона не больше этого значения
+THUMB_MAX_SIDE = 320
+
+def photo_sizes(sizes: List[types.PhotoSize]) -> Dict[str, dict]:
+    """Выбирает из размеров фото миниатюру и полный размер для сохранения."""
+    ordered = sorted(sizes, key=lambda s: s.width * s.height)
+    full = ordered[-1]
+    small = [s for s in ordered if max(s.width, s.height) <= THUMB_MAX_SIDE]
+    thumb = small[-1] if small else ordered[0]
+    return {
+        size: {
+            "file_id": item.file_id,
+            "file_unique_id": item.file_unique_id,
+            "width": item.width,
+            "height": item.height,
+        }
+        for size, item in (("thumb", thumb), ("full", full))
+    }
+
+class AlbumCollector:
+    """Собирает сообщения одного альбома (media group) в один список."""
+    def __init__(self, wait: float = ALBUM_WAIT_SECONDS):
+        self.wait = wait
+        self._albums: Dict[str, List[types.Message]] = {}
+
+    async def collect(self, message: types.Message) -> Optional[List[types.Message]]:
+        """Возвращает весь альбом для последнего его сообщения и None для остальных."""
+        group_id = message.media_group_id
+        if not group_id:
+            return [message]
+        album = self._albums.setdefault(group_id, [])
+        album.append(message)
+        await asyncio.sleep(self.wait)
+        if album[-1] is not message:
+            # Пришло более позднее сообщение альбома — оно и завершит сборку
+            return None
+        self._albums.pop(group_id, None)
+        album.sort(key=lambda m: m.message_id)
+        if len(album) > MAX_ALBUM_PHOTOS:
+            logger.info(f"Альбом {group_id} обрезан до {MAX_ALBUM_PHOTOS} фото")
+        return album[:MAX_ALBUM_PHOTOS]
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, Optional, Set
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from database import Database
+from telegram_api import api_priority, BULK
+from users import USER_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Сегменты аудитории для рассылок: имя -> описание
+SEGMENTS = {
+    "all": "все достижимые пользователи",
+    "active30": "активные за 30 дней",
+    "active7": "активные за 7 дней",
+    "buyers": "покупали",
+    "sellers": "продавали",
+    "service_sellers": "продавцы услуг",
+}
+# Окно активности для сегментов activeN, в днях
+ACTIVITY_SEGMENTS = {"active30": 30, "active7": 7}
+# Как часто обновлять сегменты и как часто пересобирать событийные сегменты целиком
+SEGMENT_REFRESH_SECONDS = 600
+SEGMENT_REBUILD_SECONDS = 24 * 3600
+# Запас на отметки активности, которые UserWriter записывает с задержкой (в том числе после неудачной записи)
+ACTIVITY_FLUSH_LAG_SECONDS = int(USER_FLUSH_SECONDS * 12)
+
+def is_undeliverable_error(error: Exception) -> bool:
+    """Ошибка отправки означает, что пользователю писать больше нельзя."""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+class Audiences:
+    """Предвычисленные сегменты аудитории и учёт недостижимых пользователей."""
+    def __init__(self, db: Database, refresh_interval: float = SEGMENT_REFRESH_SECONDS):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self._undeliverable: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self):
+        """Обновляет все сегменты: активность — инкрементально, остальные — пересборкой раз в сутки."""
+        now = int(time.time())
+        for segment, days in ACTIVITY_SEGMENTS.items():
+            cutoff = now - days * 86400
+            state = self.db.get_segment_state(segment)
+            if not state or state[1] is None:
+                self.db.rebuild_segment(segment, now, cutoff=cutoff)
+            else:
+                self.db.refresh_activity_segment(
+                    segment, now, cutoff, prev_refreshed_at=state[0], prev_cutoff=state[1],
+                    flush_lag=ACTIVITY_FLUSH_LAG_SECONDS
+                )
+        for segment in ("buyers", "sellers", "service_sellers"):
+            state = self.db.get_segment_state(segment)
+            if not state or now - state[0] >= SEGMENT_REBUILD_SECONDS:
+                self.db.rebuild_segment(segment, now)
+
+    def on_order_completed(self, seller_id: int, buyer_id: int, item_type: Optional[str]):
+        """Добавляет участников завершённой сделки в сегменты сразу, не дожидаясь пересборки."""
+        try:
+            self.db.add_segment_members("buyers", [buyer_id])
+            self.db.add_segment_members("sellers", [seller_id])
+        except Exception as e:
+            logger.error(f"Ошибка обновления сегментов для сделки {seller_id}->{buyer_id}: {e}")
+
+    def on_product_approved(self, seller_id: int, item_type: str):
+        """Добавляет продавца услуги в сегмент при одобрении объявления."""
+        if item_type != "service":
+            return
+        try:
+            self.db.add_segment_members("service_sellers", [seller_id])
+        except Exception as e:
+            logger.error(f"Ошибка обновления сегмента service_sellers для seller_id={seller_id}: {e}")
+
+    def user_ids(self, segment: str) -> Iterable[int]:
+        """Достижимые пользователи сегмента."""
+        return self.db.iter_segment_users(None if segment == "all" else segment)
+
+    def count(self, segment: str) -> int:
+        """Количество достижимых пользователей сегмента."""
+        return self.db.count_segment_users(None if segment == "all" else segment)
+
+    def mark_undeliverable(self, user_id: int):
+        """Откладывает пометку пользователя недостижимым до ближайшего сброса."""
+        self._undeliverable.add(user_id)
+
+    def flush(self):
+        """Записывает накопленных недостижимых пользователей в базу."""
+        if not self._undeliverable:
+            return
+        pending, self._undeliverable = self._undeliverable, set()
+        try:
+            self.db.mark_undeliverable(list(pending))
+            logger.info(f"Помечено недостижимыми: {len(pending)} пользователей")
+        except Exception as e:
+            logger.error(f"Ошибка при пометке недостижимых пользователей: {e}")
+            self._undeliverable |= pending
+
+    async def deliver(self, segment: str, send: Callable[[int], Awaitable[object]]) -> int:
+        """Отправляет сообщение пользователям сегмента, возвращает количество доставленных."""
+        sent = 0
+        try:
+            with api_priority(BULK):
+                for user_id in self.user_ids(segment):
+                    try:
+                        await send(user_id)
+                        sent += 1
+                    except Exception as e:
+                        if is_undeliverable_error(e):
+                            self.mark_undeliverable(user_id)
+                        logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+        except asyncio.CancelledError:
+            logger.warning(f"Рассылка по сегменту {segment} прервана остановкой бота, доставлено {sent}")
+            raise
+        finally:
+            self.flush()
+        return sent
+
+    async def _run(self):
+        """Периодическое обновление сегментов."""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Ошибка обновления сегментов аудитории: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Запускает фоновое обновление сегментов."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает обновление сегментов и записывает недостижимых пользователей."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
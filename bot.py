@@ -1,20 +1,47 @@
 import asyncio
 import logging
 from typing import Optional, Tuple, List
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram import F
 import os
+import tempfile
+import time
+from datetime import datetime
 
 from config import Config
 from database import Database
 from keyboards import Keyboards
 from states import SellProduct, Chatting, LogsState
 from utils import escape_html, log_user_message
+from export import export_table, EXPORT_FORMATS, EXPORT_TABLES
+from albums import AlbumCollector, photo_sizes
+from storage import SQLiteStorage
+from sharding import WORKERS, run_sharded, is_primary_shard
+from admins import AdminRegistry
+from middlewares import AdminMiddleware, SellPermissionMiddleware, ActivityMiddleware, ThrottleMiddleware
+from throttling import Throttler
+from moderation import AutoModerator, APPROVE, REJECT
+from models import Product
+from review import ReviewDispatcher, review_caption, review_keyboard, REVIEW_REASSIGN_INTERVAL
+from users import UserWriter, PermissionCache
+from audiences import Audiences, SEGMENTS
+from reservations import ReservationSweeper, extend_hold, HOLD_TTL_SECONDS, OFFER_TTL_SECONDS, SWEEP_INTERVAL_SECONDS
+from scheduler import Scheduler
+from maintenance import (
+    Maintenance, EXPIRE_ORDERS_INTERVAL, EXPIRE_LISTINGS_INTERVAL, ARCHIVE_INTERVAL, COMPACT_INTERVAL
+)
+from channel_sync import ChannelSync, CHANNEL_SYNC_INTERVAL, CHANNEL_RECONCILE_INTERVAL
+from campaigns import Campaigns, CAMPAIGN_TICK_SECONDS, parse_campaign_options
+from telegram_api import create_bot, api_priority, NOTIFY
+from lifecycle import Lifecycle, InFlightMiddleware, DRAIN_TIMEOUT_SECONDS
+
 
+# Момент начала загрузки модуля — для отчёта о времени запуска
+_process_started = time.perf_counter()
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,15 +51,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=Config.TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-db = Database("db.sqlite3")
-keyboards = Keyboards()
+# Хендлеры регистрируются на роутере при импорте, а бот, база и подсистемы создаются в create_app()
+router = Router()
+bot: Optional[Bot] = None
+dp: Optional[Dispatcher] = None
+db: Optional[Database] = None
+keyboards: Optional[Keyboards] = None
+admin_registry: Optional[AdminRegistry] = None
+user_writer: Optional[UserWriter] = None
+permissions: Optional[PermissionCache] = None
+audiences: Optional[Audiences] = None
+albums: Optional[AlbumCollector] = None
+reservations: Optional[ReservationSweeper] = None
+maintenance: Optional[Maintenance] = None
+channel_sync: Optional[ChannelSync] = None
+campaigns: Optional[Campaigns] = None
+scheduler: Optional[Scheduler] = None
+lifecycle: Optional[Lifecycle] = None
+moderator: Optional[AutoModerator] = None
+reviews: Optional[ReviewDispatcher] = None
+_startup_timings: List[Tuple[str, float]] = []
 
 # Обработчик команды /start
-@dp.message(Command(commands=["start"]))
+@router.message(Command(commands=["start"]))
 async def start(message: types.Message):
     """Обработка команды /start для запуска бота и отображения главного меню."""
     args = message.text.split()
@@ -50,7 +91,7 @@ async def start(message: types.Message):
     )
 
 # Обработчик команды /help
-@dp.message(Command(commands=["help"]))
+@router.message(Command(commands=["help"]))
 async def cmd_help(message: types.Message):
     """Отображение списка доступных команд для пользователей."""
     await message.answer(
@@ -59,19 +100,16 @@ async def cmd_help(message: types.Message):
     )
 
 # Обработчик команды /help_admin
-@dp.message(Command(commands=["help_admin"]))
+@router.message(Command(commands=["help_admin"]), flags={"admin": True})
 async def cmd_help_admin(message: types.Message):
     """Отображение списка админских команд."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /help_admin от user_id={message.from_user.id}")
-        return
     help_text = (
         "🛠 <b>Список админских команд:</b>\n"
         "/pending – товары и услуги на модерации\n"
         "/approved – активные товары и услуги\n"
         "/reject – отклонённые товары и услуги\n"
-        "/delete <code>&lt;adv/post&gt;</code> <code>&lt;id&gt;</code> – удалить товар/услугу или рекламу\n"
-        "/broadcast <code>&lt;текст&gt;</code> – рассылка\n"
+        "/delete <code>&lt;adv/post&gt;</code> <code>&lt;id&gt;</code> – удалить товар/услугу (можно несколько id) или рекламу\n"
+        "/broadcast <code>[сегмент]</code> <code>&lt;текст&gt;</code> – рассылка (сегменты: /segments)\n"
         "/orders – активные сделки\n"
         "/close_order <code>&lt;id&gt;</code> – закрыть сделку\n"
         "/cancel_order <code>&lt;id&gt;</code> – отменить сделку\n"
@@ -79,15 +117,20 @@ async def cmd_help_admin(message: types.Message):
         "/user <code>&lt;user_id&gt;</code> – инфо о пользователе\n"
         "/logs – лог-файлы\n"
         "/db_backup – бэкап базы\n"
-        "/ban <code>&lt;user_id&gt;</code> – запретить продажу\n"
+        "/export <code>&lt;products/orders/users&gt;</code> <code>[csv/jsonl]</code> <code>[gz]</code> – выгрузка таблицы\n"
+        "/ban <code>&lt;user_id&gt;</code> … – запретить продажу (можно несколько id)\n"
         "/unban <code>&lt;user_id&gt;</code> – снять запрет\n"
+        "/segments – сегменты аудитории\n"
         "/sellers – топ продавцов\n"
         "/buyers – топ покупателей\n"
         "/send_user <code>&lt;user_id&gt;</code> <code>&lt;текст&gt;</code> – ЛС пользователю\n"
         "/pin <code>&lt;id&gt;</code> – закрепить товар или услугу\n"
         "/unpin – открепить всё\n"
         "/adv <code>&lt;текст&gt;</code> – создать рекламный пост\n"
-        "/send_adv <code>&lt;id_поста&gt;</code> <code>&lt;all/channel&gt;</code> – отправить рекламный пост\n"
+        "/send_adv <code>&lt;id_поста&gt;</code> <code>&lt;channel/сегмент&gt;</code> – отправить рекламный пост\n"
+        "/campaign <code>&lt;id_поста&gt;</code> <code>&lt;channel/сегмент&gt;</code> <code>[at=+1h] [repeat=3] [every=1d] [spread=2h] [pin=12h]</code> – рекламная кампания\n"
+        "/campaigns – рекламные кампании\n"
+        "/cancel_campaign <code>&lt;id&gt;</code> – отменить кампанию\n"
         "/admins – список админов\n"
         "/add_admin <code>&lt;user_id&gt;</code> – добавить админа\n"
         "/remove_admin <code>&lt;user_id&gt;</code> – убрать админа"
@@ -95,7 +138,7 @@ async def cmd_help_admin(message: types.Message):
     await message.answer(help_text, parse_mode="HTML")
 
 # Обработчик выбора типа для покупки
-@dp.callback_query(lambda c: c.data == "buy_select_type")
+@router.callback_query(lambda c: c.data == "buy_select_type")
 async def buy_select_type(callback: types.CallbackQuery):
     """Отображение меню выбора типа покупки (товары/услуги)."""
     await callback.message.edit_text(
@@ -105,7 +148,7 @@ async def buy_select_type(callback: types.CallbackQuery):
     await callback.answer()
 
 # Обработчик показа списка товаров/услуг
-@dp.callback_query(lambda c: c.data in ["buy_type_product", "buy_type_service"])
+@router.callback_query(lambda c: c.data in ["buy_type_product", "buy_type_service"])
 async def show_items_list(callback: types.CallbackQuery):
     """Отображение списка товаров или услуг с пагинацией."""
     item_type = "product" if callback.data == "buy_type_product" else "service"
@@ -116,7 +159,7 @@ async def show_items_list(callback: types.CallbackQuery):
     await callback.answer()
 
 # Обработчик пагинации товаров
-@dp.callback_query(lambda c: c.data.startswith("page_"))
+@router.callback_query(lambda c: c.data.startswith("page_"))
 async def paginate(callback: types.CallbackQuery):
     """Обработка пагинации списка товаров/услуг."""
     try:
@@ -132,10 +175,10 @@ async def paginate(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка при переключении страницы.", show_alert=True)
 
 # Обработчик начала процесса продажи
-@dp.callback_query(lambda c: c.data == "sell")
-async def start_sell(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(lambda c: c.data == "sell", flags={"sell": True})
+async def start_sell(callback: types.CallbackQuery, state: FSMContext, can_sell: bool):
     """Начало процесса добавления товара или услуги на продажу."""
-    if not db.can_user_sell(callback.from_user.id):
+    if not can_sell:
         await callback.message.edit_text(
             "🚫 Вам запрещено продавать. Обратитесь к администрации.",
             reply_markup=keyboards.get_main_menu()
@@ -149,7 +192,7 @@ async def start_sell(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработчик выбора типа для продажи
-@dp.callback_query(lambda c: c.data in ["sell_type_product", "sell_type_service"])
+@router.callback_query(lambda c: c.data in ["sell_type_product", "sell_type_service"], flags={"throttle": "sell"})
 async def select_sell_type(callback: types.CallbackQuery, state: FSMContext):
     """Обработка выбора типа продаваемого объекта (товар/услуга)."""
     item_type = "product" if callback.data == "sell_type_product" else "service"
@@ -162,59 +205,63 @@ async def select_sell_type(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработчики для пошагового ввода данных о товаре/услуге
-@dp.message(SellProduct.name)
-async def process_name(message: types.Message, state: FSMContext):
+@router.message(SellProduct.name, flags={"sell": True})
+async def process_name(message: types.Message, state: FSMContext, can_sell: bool):
     """Сохранение названия товара/услуги."""
-    if not db.can_user_sell(message.from_user.id):
+    if not can_sell:
         await message.answer("🚫 Вам запрещено продавать.", reply_markup=keyboards.get_main_menu())
         return
     await state.update_data(name=message.text)
     await state.set_state(SellProduct.description)
     await message.answer("✏️ Введи описание:", reply_markup=keyboards.get_back_to_main_menu())
 
-@dp.message(SellProduct.description)
-async def process_description(message: types.Message, state: FSMContext):
+@router.message(SellProduct.description, flags={"sell": True})
+async def process_description(message: types.Message, state: FSMContext, can_sell: bool):
     """Сохранение описания товара/услуги."""
-    if not db.can_user_sell(message.from_user.id):
+    if not can_sell:
         await message.answer("🚫 Вам запрещено продавать.", reply_markup=keyboards.get_main_menu())
         return
     await state.update_data(description=message.text)
     await state.set_state(SellProduct.price)
     await message.answer("💸 Введи цену:", reply_markup=keyboards.get_back_to_main_menu())
 
-@dp.message(SellProduct.price)
-async def process_price(message: types.Message, state: FSMContext):
+@router.message(SellProduct.price, flags={"sell": True})
+async def process_price(message: types.Message, state: FSMContext, can_sell: bool):
     """Сохранение цены товара/услуги."""
-    if not db.can_user_sell(message.from_user.id):
+    if not can_sell:
         await message.answer("🚫 Вам запрещено продавать.", reply_markup=keyboards.get_main_menu())
         return
     await state.update_data(price=message.text)
     await state.set_state(SellProduct.contact)
     await message.answer("📱 Введи контакт для связи:", reply_markup=keyboards.get_back_to_main_menu())
 
-@dp.message(SellProduct.contact)
-async def process_contact(message: types.Message, state: FSMContext):
+@router.message(SellProduct.contact, flags={"sell": True})
+async def process_contact(message: types.Message, state: FSMContext, can_sell: bool):
     """Сохранение контактной информации."""
-    if not db.can_user_sell(message.from_user.id):
+    if not can_sell:
         await message.answer("🚫 Вам запрещено продавать.", reply_markup=keyboards.get_main_menu())
         return
     await state.update_data(contact=message.text)
     await state.set_state(SellProduct.photo)
-    await message.answer("📷 Отправь фото или напиши 'пропустить':", reply_markup=keyboards.get_back_to_main_menu())
+    await message.answer("📷 Отправь фото (можно альбом до 10 штук) или напиши 'пропустить':", reply_markup=keyboards.get_back_to_main_menu())
 
-@dp.message(SellProduct.photo)
-async def process_photo(message: types.Message, state: FSMContext):
+@router.message(SellProduct.photo, flags={"sell": True})
+async def process_photo(message: types.Message, state: FSMContext, can_sell: bool):
     """Сохранение фото и завершение создания объявления."""
-    if not db.can_user_sell(message.from_user.id):
+    if not can_sell:
         await message.answer("🚫 Вам запрещено продавать.", reply_markup=keyboards.get_main_menu())
         return
-    photo_id = None
     if message.text and message.text.lower() == 'пропустить':
-        await state.update_data(photo=None)
+        await state.update_data(photo=None, photos=[])
     elif message.photo:
-        photo_id = message.photo[-1].file_id
-        await state.update_data(photo=photo_id)
-        log_user_message(message.from_user.id, "user", "->bot", photo_id=photo_id)
+        album = await albums.collect(message)
+        if album is None:
+            # Остальные фото альбома обработает его последнее сообщение
+            return
+        photos = [photo_sizes(m.photo) for m in album if m.photo]
+        await state.update_data(photo=photos[0]["full"]["file_id"], photos=photos)
+        for item in photos:
+            log_user_message(message.from_user.id, "user", "->bot", photo_id=item["full"]["file_id"])
     else:
         await message.answer("❌ Отправь фото или напиши 'пропустить'.", reply_markup=keyboards.get_back_to_main_menu())
         return
@@ -222,19 +269,75 @@ async def process_photo(message: types.Message, state: FSMContext):
     data = await state.get_data()
     seller_id = message.from_user.id
     try:
+        duplicate = db.find_duplicate(seller_id, data)
+        if duplicate and duplicate[2] == "content":
+            # Тот же текст и цена у того же продавца: новое объявление не создаём
+            dup_id, dup_status, _ = duplicate
+            if dup_status == "pending" and db.merge_pending_product(dup_id, data):
+                text = f"🔁 Такое объявление (№{dup_id}) уже на модерации — контакт и фото обновлены."
+            else:
+                text = f"🔁 Такое объявление (№{dup_id}) уже опубликовано."
+            logger.info(f"Повторная подача объявления №{dup_id} от user_id={seller_id} объединена")
+            await message.answer(text, reply_markup=keyboards.get_main_menu())
+            await state.clear()
+            return
+        verdict = moderator.check(seller_id, data, duplicate)
         product_id = db.add_product(seller_id, data)
+        await state.clear()
+        if verdict.action == REJECT:
+            db.update_product_status(product_id, 'rejected')
+            logger.info(f"Объявление №{product_id} от user_id={seller_id} отклонено автоматически: {'; '.join(verdict.reasons)}")
+            await message.answer(
+                f"❌ Объявление отклонено: {escape_html('; '.join(verdict.reasons))}.",
+                reply_markup=keyboards.get_main_menu()
+            )
+            return
+        if verdict.action == APPROVE:
+            try:
+                await publish_product(db.get_product_any_status(product_id))
+                logger.info(f"Объявление №{product_id} от user_id={seller_id} одобрено автоматически")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка автопубликации product_id={product_id}, передано модераторам: {e}")
         await message.answer(
             "✅ Товар или услуга отправлены на модерацию!",
             reply_markup=keyboards.get_main_menu()
         )
-        await notify_admins(product_id, data, seller_id)
-        await state.clear()
+        await notify_admins(product_id, data, seller_id, verdict.reasons)
     except Exception as e:
         logger.error(f"Ошибка при сохранении объявления для user_id={seller_id}: {e}")
         await message.answer("❌ Ошибка при сохранении объявления.")
 
+async def publish_product(product: Product):
+    """Публикует объявление в канале, помечает одобренным и сообщает продавцу."""
+    product_id, seller_id, item_type = product.id, product.seller_id, product.type
+    name, price, description, photo = product.name, product.price, product.description, product.photo
+    type_label = "Товар" if item_type == "product" else "Услуга"
+    caption = (
+        f"🆔 {type_label} №{product_id}\n\n"
+        f"{'📦' if item_type == 'product' else '🛠'} <b>{escape_html(name)}</b>\n"
+        f"✏️ {escape_html(description)}\n"
+        f"💸 Цена: {escape_html(price)}₽\n\n"
+        f"<i>Бот для продажи и покупки товаров и услуг @SeIIStuff_bot</i>\n\n"
+        f"<u>Чтобы купить, нажмите кнопку ниже. Или перейдите в бота @SeIIStuff_bot</u>"
+    )
+    kb_buy = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💰 Купить", url=f"https://t.me/SeIIStuff_bot?start=product_{product_id}")]
+    ])
+    if photo:
+        sent = await bot.send_photo(chat_id=Config.CHANNEL_ID, photo=photo, caption=caption, parse_mode="HTML", reply_markup=kb_buy)
+    else:
+        sent = await bot.send_message(chat_id=Config.CHANNEL_ID, text=caption, parse_mode="HTML", reply_markup=kb_buy)
+    db.update_product_status(product_id, 'approved', channel_message_id=sent.message_id)
+    audiences.on_product_approved(seller_id, item_type)
+    await bot.send_message(
+        seller_id,
+        f"✅ Ваш {type_label.lower()} одобрен и опубликован в канале!",
+        reply_markup=keyboards.get_main_menu()
+    )
+
 # Обработчик показа карточки товара
-@dp.callback_query(lambda c: c.data.startswith("product_"))
+@router.callback_query(lambda c: c.data.startswith("product_"))
 async def show_product(callback: types.CallbackQuery):
     """Отображение карточки товара или услуги."""
     try:
@@ -244,17 +347,15 @@ async def show_product(callback: types.CallbackQuery):
             logger.warning(f"Товар или услуга с ID {product_id} не найдены или не одобрены.")
             await callback.answer("❌ Товар или услуга не найдены.", show_alert=True)
             return
-        name, price, description, photo, item_type = product
-        type_label = "Товар" if item_type == "product" else "Услуга"
+        type_label = "Товар" if product.type == "product" else "Услуга"
         caption = (
-            f"{'📦' if item_type == 'product' else '🛠'} <b>{type_label}: {escape_html(name)}</b>\n"
-            f"💸 Цена: {escape_html(price)}\n"
-            f"✏️ {escape_html(description)}"
+            f"{'📦' if product.type == 'product' else '🛠'} <b>{type_label}: {escape_html(product.name)}</b>\n"
+            f"💸 Цена: {escape_html(product.price)}\n"
+            f"✏️ {escape_html(product.description)}"
         )
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💰 Купить", callback_data=f"buy_{product_id}")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data=f"buy_type_{item_type}")]
-        ])
+        thumb, photos_count = db.get_product_preview(product_id)
+        photo = thumb or product.photo
+        kb = keyboards.get_product_card_kb(product_id, product.type, photos_count)
         try:
             if photo:
                 await callback.message.edit_media(
@@ -271,14 +372,38 @@ async def show_product(callback: types.CallbackQuery):
         logger.error(f"Ошибка при разборе product_id в callback_data={callback.data}: {e}")
         await callback.answer("❌ Неверный формат ID товара.", show_alert=True)
 
+# Обработчик просмотра фотографий в полном размере
+@router.callback_query(lambda c: c.data.startswith("photos_"))
+async def show_full_photos(callback: types.CallbackQuery):
+    """Отправка всех фотографий объявления в полном размере альбомом."""
+    try:
+        product_id = int(callback.data.split("_")[1])
+        if not db.get_product(product_id) and not admin_registry.is_admin(callback.from_user.id):
+            await callback.answer("❌ Товар или услуга не найдены.", show_alert=True)
+            return
+        photos = db.get_product_photos(product_id, "full")
+        if not photos:
+            await callback.answer("📷 У объявления нет фотографий.", show_alert=True)
+            return
+        if len(photos) == 1:
+            await bot.send_photo(callback.from_user.id, photos[0])
+        else:
+            await bot.send_media_group(
+                callback.from_user.id,
+                media=[types.InputMediaPhoto(media=file_id) for file_id in photos]
+            )
+        await callback.answer()
+    except ValueError as e:
+        logger.error(f"Ошибка при разборе product_id в callback_data={callback.data}: {e}")
+        await callback.answer("❌ Неверный формат ID товара.", show_alert=True)
+    except Exception as e:
+        logger.error(f"Ошибка в show_full_photos для callback_data={callback.data}: {e}")
+        await callback.answer("❌ Ошибка при отправке фотографий.", show_alert=True)
+
 # Обработчик одобрения товара
-@dp.callback_query(lambda c: c.data.startswith("approve_"))
+@router.callback_query(lambda c: c.data.startswith("approve_"), flags={"admin": True})
 async def approve_product(callback: types.CallbackQuery):
     """Обработка одобрения товара/услуги администратором."""
-    if callback.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к approve_product от user_id={callback.from_user.id}")
-        await callback.answer("🚫 У вас нет прав для этого действия.", show_alert=True)
-        return
     try:
         product_id = int(callback.data.split("_")[1])
         product = db.get_product_any_status(product_id)
@@ -286,45 +411,24 @@ async def approve_product(callback: types.CallbackQuery):
             logger.warning(f"Товар или услуга с ID {product_id} не найдены в базе данных.")
             await callback.answer("❌ Товар или услуга не найдены.", show_alert=True)
             return
-        name, price, description, photo, item_type = product
-        seller_id = db.get_seller_id(product_id)
-        if not seller_id:
+        if not product.seller_id:
             logger.warning(f"Продавец для товара с ID {product_id} не найден.")
             await callback.answer("❌ Продавец не найден.", show_alert=True)
             return
-        # Проверяем текущий статус товара
-        with sqlite3.connect("db.sqlite3") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT status FROM products WHERE id=?", (product_id,))
-            current_status = cur.fetchone()
-            if not current_status or current_status[0] != "pending":
-                logger.warning(f"Товар с ID {product_id} имеет статус {current_status[0] if current_status else 'неизвестен'}, ожидается 'pending'.")
-                await callback.answer(f"❌ Товар или услуга уже обработаны (статус: {current_status[0] if current_status else 'неизвестен'}).", show_alert=True)
-                return
-        type_label = "Товар" if item_type == "product" else "Услуга"
-        caption = (
-            f"🆔 {type_label} №{product_id}\n\n"
-            f"{'📦' if item_type == 'product' else '🛠'} <b>{escape_html(name)}</b>\n"
-            f"✏️ {escape_html(description)}\n"
-            f"💸 Цена: {escape_html(price)}₽\n\n"
-            f"<i>Бот для продажи и покупки товаров и услуг @SeIIStuff_bot</i>\n\n"
-            f"<u>Чтобы купить, нажмите кнопку ниже. Или перейдите в бота @SeIIStuff_bot</u>"
-        )
-        kb_buy = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💰 Купить", url=f"https://t.me/SeIIStuff_bot?start=product_{product_id}")]
-        ])
-        sent = None
+        # Решение принимает только один администратор: повторные нажатия и чужие копии карточки отсекаются
+        if not reviews.begin(product_id, callback.from_user.id):
+            logger.warning(f"Товар с ID {product_id} уже обработан или обрабатывается другим администратором.")
+            await callback.answer("❌ Товар или услуга уже обработаны.", show_alert=True)
+            return
+        own_card = (callback.message.chat.id, callback.message.message_id)
+        type_label = "Товар" if product.type == "product" else "Услуга"
         try:
-            if photo:
-                sent = await bot.send_photo(chat_id=Config.CHANNEL_ID, photo=photo, caption=caption, parse_mode="HTML", reply_markup=kb_buy)
-            else:
-                sent = await bot.send_message(chat_id=Config.CHANNEL_ID, text=caption, parse_mode="HTML", reply_markup=kb_buy)
-            db.update_product_status(product_id, 'approved', channel_message_id=sent.message_id)
-            await bot.send_message(
-                seller_id,
-                f"✅ Ваш {type_label.lower()} одобрен и опубликован в канале!",
-                reply_markup=keyboards.get_main_menu()
-            )
+            try:
+                await publish_product(product)
+            except Exception:
+                reviews.abort(product_id)
+                raise
+            await reviews.finish(product_id, "✅ Одобрено", skip=own_card)
             old_caption = callback.message.caption or callback.message.text or ""
             if callback.message.photo:
                 await callback.message.edit_caption(caption=f"{old_caption}\n\n✅ Одобрено", parse_mode="HTML")
@@ -342,13 +446,9 @@ async def approve_product(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка при одобрении.", show_alert=True)
 
 # Обработчик отклонения товара
-@dp.callback_query(lambda c: c.data.startswith("reject_"))
+@router.callback_query(lambda c: c.data.startswith("reject_"), flags={"admin": True})
 async def reject_product(callback: types.CallbackQuery):
     """Обработка отклонения товара/услуги администратором."""
-    if callback.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к reject_product от user_id={callback.from_user.id}")
-        await callback.answer("🚫 У вас нет прав для этого действия.", show_alert=True)
-        return
     try:
         product_id = int(callback.data.split("_")[1])
         product = db.get_product_any_status(product_id)
@@ -356,23 +456,24 @@ async def reject_product(callback: types.CallbackQuery):
             logger.warning(f"Товар или услуга с ID {product_id} не найдены в базе данных.")
             await callback.answer("❌ Товар или услуга не найдены.", show_alert=True)
             return
-        name, _, _, _, item_type = product
-        seller_id = db.get_seller_id(product_id)
+        name, item_type, seller_id = product.name, product.type, product.seller_id
         if not seller_id:
             logger.warning(f"Продавец для товара с ID {product_id} не найден.")
             await callback.answer("❌ Продавец не найден.", show_alert=True)
             return
-        # Проверяем текущий статус товара
-        with sqlite3.connect("db.sqlite3") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT status FROM products WHERE id=?", (product_id,))
-            current_status = cur.fetchone()
-            if not current_status or current_status[0] != "pending":
-                logger.warning(f"Товар с ID {product_id} имеет статус {current_status[0] if current_status else 'неизвестен'}, ожидается 'pending'.")
-                await callback.answer(f"❌ Товар или услуга уже обработаны (статус: {current_status[0] if current_status else 'неизвестен'}).", show_alert=True)
-                return
+        # Решение принимает только один администратор: повторные нажатия и чужие копии карточки отсекаются
+        if not reviews.begin(product_id, callback.from_user.id):
+            logger.warning(f"Товар с ID {product_id} уже обработан или обрабатывается другим администратором.")
+            await callback.answer("❌ Товар или услуга уже обработаны.", show_alert=True)
+            return
+        own_card = (callback.message.chat.id, callback.message.message_id)
         type_label = "Товар" if item_type == "product" else "Услуга"
-        db.update_product_status(product_id, 'rejected')
+        try:
+            db.update_product_status(product_id, 'rejected')
+        except Exception:
+            reviews.abort(product_id)
+            raise
+        await reviews.finish(product_id, "❌ Отклонено", skip=own_card)
         try:
             await bot.send_message(seller_id, f"❌ Ваш {type_label.lower()} '{escape_html(name)}' был отклонён модератором.")
             old_caption = callback.message.caption or callback.message.text or ""
@@ -391,22 +492,45 @@ async def reject_product(callback: types.CallbackQuery):
         logger.error(f"Общая ошибка в reject_product для product_id={product_id}: {e}")
         await callback.answer("❌ Ошибка при отклонении.", show_alert=True)
 
+# Обработчик карточки, по которой решение уже принято другим администратором
+@router.callback_query(lambda c: c.data.startswith("reviewed_"), flags={"admin": True})
+async def reviewed_product(callback: types.CallbackQuery):
+    """Ответ на нажатие кнопки уже обработанной карточки модерации."""
+    await callback.answer("Решение по объявлению уже принято.", show_alert=True)
+
 # Обработчик начала чата
-@dp.callback_query(lambda c: c.data.startswith("buy_") and c.data != "buy_select_type")
+@router.callback_query(lambda c: c.data.startswith("buy_") and c.data != "buy_select_type")
 async def start_chat(callback: types.CallbackQuery, state: FSMContext):
     """Начало чата между покупателем и продавцом."""
     try:
         product_id = int(callback.data.split("_")[1])
         buyer_id = callback.from_user.id
         product = db.get_product(product_id)
-        if not product or product[4] not in ["product", "service"]:
+        if not product or product.type not in ["product", "service"]:
             logger.warning(f"Товар или услуга с ID {product_id} не найдены или не одобрены.")
             await callback.answer("❌ Товар или услуга не найдены или недоступны.", show_alert=True)
             return
-        seller_id = db.get_seller_id(product_id)
-        name, _, _, _, item_type = product
+        name, item_type = product.name, product.type
         type_label = "товару" if item_type == "product" else "услуге"
-        order_id = db.create_order(product_id, seller_id, buyer_id)
+        created = db.create_order(product_id, buyer_id, HOLD_TTL_SECONDS)
+        if not created:
+            hold = db.get_hold(product_id)
+            if hold and hold[0] != buyer_id:
+                logger.info(f"product_id={product_id} забронирован за buyer_id={hold[0]}, buyer_id={buyer_id} предложена очередь.")
+                kb_waitlist = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="🕒 Встать в очередь", callback_data=f"waitlist_{product_id}")]
+                ])
+                await callback.message.answer(
+                    "⏳ Это объявление сейчас забронировано другим покупателем.\n"
+                    "Встаньте в очередь — если сделка не состоится, бот предложит его вам.",
+                    reply_markup=kb_waitlist
+                )
+                await callback.answer()
+                return
+            logger.info(f"Заказ на product_id={product_id} для buyer_id={buyer_id} не создан: уже есть активный или товар недоступен.")
+            await callback.answer("⚠️ У вас уже есть активная сделка по этому объявлению или оно недоступно.", show_alert=True)
+            return
+        order_id, seller_id = created
         kb_finish_seller = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text=f"✅ Завершить сделку (продавец)", callback_data=f"finish_seller_{order_id}")],
             [InlineKeyboardButton(text="❌ Отменить сделку", callback_data=f"cancel_{order_id}")]
@@ -435,8 +559,49 @@ async def start_chat(callback: types.CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка в start_chat для product_id={product_id}: {e}")
         await callback.answer("❌ Ошибка при начале чата.", show_alert=True)
 
+# Обработчик записи в очередь на забронированный товар
+@router.callback_query(lambda c: c.data.startswith("waitlist_"))
+async def join_waitlist(callback: types.CallbackQuery):
+    """Постановка покупателя в очередь на забронированный товар."""
+    try:
+        product_id = int(callback.data.split("_")[1])
+        position = db.join_waitlist(product_id, callback.from_user.id)
+        await callback.answer(f"🕒 Вы в очереди на объявление №{product_id}, позиция: {position}.", show_alert=True)
+    except Exception as e:
+        logger.error(f"Ошибка в join_waitlist для callback {callback.data}: {e}")
+        await callback.answer("❌ Ошибка при записи в очередь.", show_alert=True)
+
+async def notify_waitlisted(buyer_id: int, product_id: int):
+    """Предложение освободившегося товара следующему покупателю из очереди."""
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💰 Купить", callback_data=f"buy_{product_id}")]
+    ])
+    try:
+        with api_priority(NOTIFY):
+            await bot.send_message(
+                buyer_id,
+                f"🔔 Объявление №{product_id}, в очереди на которое вы стояли, освободилось.\n"
+                f"Оно забронировано за вами на {OFFER_TTL_SECONDS // 60} минут — нажмите кнопку, чтобы начать сделку.",
+                reply_markup=kb
+            )
+    except Exception as e:
+        logger.warning(f"Не удалось предложить product_id={product_id} покупателю {buyer_id}: {e}")
+
+async def on_hold_expired(order_id: int, order: tuple):
+    """Уведомление сторон об отмене зависшей сделки."""
+    product_id, seller_id, buyer_id, _, _, item_type, next_buyer = order
+    type_label = "товару" if item_type == "product" else "услуге"
+    for user_id in (seller_id, buyer_id):
+        try:
+            with api_priority(NOTIFY):
+                await bot.send_message(user_id, f"⌛ Сделка по {type_label} №{product_id} отменена: она слишком долго оставалась незавершённой.")
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить {user_id} об отмене сделки {order_id}: {e}")
+    if next_buyer:
+        await notify_waitlisted(next_buyer, product_id)
+
 # Обработчик пересылки сообщений в чате
-@dp.message(lambda message: message.text is None or (message.text and not message.text.startswith('/')))
+@router.message(lambda message: message.text is None or (message.text and not message.text.startswith('/')), flags={"throttle": "relay"})
 async def relay_message(message: types.Message, state: FSMContext):
     """Пересылка сообщений между покупателем и продавцом в активной сделке."""
     user_id = message.from_user.id
@@ -449,13 +614,13 @@ async def relay_message(message: types.Message, state: FSMContext):
                 log_user_message(user_id, "user", "->bot", photo_id=message.photo[-1].file_id)
             await message.answer("❌ У вас нет активных сделок.")
             return
-        product_id, seller_id, buyer_id = order
-        product = db.get_product(product_id)
+        seller_id, buyer_id = order.seller_id, order.buyer_id
+        product = db.get_product(order.product_id)
         if not product:
-            logger.warning(f"Товар или услуга с ID {product_id} не найдены для заказа.")
+            logger.warning(f"Товар или услуга с ID {order.product_id} не найдены для заказа.")
             await message.answer("❌ Товар или услуга не найдены.")
             return
-        name, _, _, _, item_type = product
+        item_type = product.type
         type_label = "покупателя" if item_type == "product" else "заказчика" if user_id == buyer_id else "продавца" if item_type == "product" else "исполнителя"
         target_id = seller_id if user_id == buyer_id else buyer_id
         if message.text:
@@ -464,89 +629,72 @@ async def relay_message(message: types.Message, state: FSMContext):
         elif message.photo:
             await bot.send_photo(target_id, message.photo[-1].file_id, caption=f"📸 Фото от {type_label}")
             log_user_message(user_id, "buyer" if user_id == buyer_id else "seller", f"->{'seller' if user_id == buyer_id else 'buyer'}", photo_id=message.photo[-1].file_id)
+        else:
+            return
+        # Переписка — активность в сделке: бронь отсчитывает простой заново
+        extend_hold(db, order.id)
     except Exception as e:
         logger.error(f"Ошибка в relay_message для user_id={user_id}: {e}")
         await message.answer("❌ Ошибка при обработке сообщения.")
 
 # Обработчик подтверждения сделки продавцом
-@dp.callback_query(lambda c: c.data.startswith("finish_seller_"))
+@router.callback_query(lambda c: c.data.startswith("finish_seller_"))
 async def finish_seller(callback: types.CallbackQuery):
     """Подтверждение сделки продавцом."""
     try:
         order_id = int(callback.data.split("_")[2])
-        result = db.confirm_order(order_id, "seller")
+        result = db.confirm_order(order_id, "seller", callback.from_user.id)
         if not result:
-            logger.warning(f"Заказ с ID {order_id} не найден.")
-            await callback.answer("❌ Заказ не найден.", show_alert=True)
+            logger.warning(f"Активный заказ с ID {order_id} для user_id={callback.from_user.id} не найден.")
+            await callback.answer("❌ Заказ не найден или уже закрыт.", show_alert=True)
             return
         seller_conf, buyer_conf, product_id, seller_id, buyer_id = result
         if buyer_conf:
-            await complete_order(order_id, product_id, seller_id, buyer_id)
+            await complete_order(order_id)
+            await callback.answer()
         else:
+            extend_hold(db, order_id)
             await callback.answer("Вы подтвердили сделку. Ждём подтверждения от покупателя.")
     except Exception as e:
         logger.error(f"Ошибка в finish_seller для order_id={order_id}: {e}")
         await callback.answer("❌ Ошибка при подтверждении сделки.", show_alert=True)
 
 # Обработчик подтверждения сделки покупателем
-@dp.callback_query(lambda c: c.data.startswith("finish_buyer_"))
+@router.callback_query(lambda c: c.data.startswith("finish_buyer_"))
 async def finish_buyer(callback: types.CallbackQuery):
     """Подтверждение сделки покупателем."""
     try:
         order_id = int(callback.data.split("_")[2])
-        result = db.confirm_order(order_id, "buyer")
+        result = db.confirm_order(order_id, "buyer", callback.from_user.id)
         if not result:
-            logger.warning(f"Заказ с ID {order_id} не найден.")
-            await callback.answer("❌ Заказ не найден.", show_alert=True)
+            logger.warning(f"Активный заказ с ID {order_id} для user_id={callback.from_user.id} не найден.")
+            await callback.answer("❌ Заказ не найден или уже закрыт.", show_alert=True)
             return
         seller_conf, buyer_conf, product_id, seller_id, buyer_id = result
         if seller_conf:
-            await complete_order(order_id, product_id, seller_id, buyer_id)
+            await complete_order(order_id)
+            await callback.answer()
         else:
+            extend_hold(db, order_id)
             await callback.answer("Вы подтвердили сделку. Ждём подтверждения от продавца.")
     except Exception as e:
         logger.error(f"Ошибка в finish_buyer для order_id={order_id}: {e}")
         await callback.answer("❌ Ошибка при подтверждении сделки.", show_alert=True)
 
-async def complete_order(order_id: int, product_id: int, seller_id: int, buyer_id: int):
+async def complete_order(order_id: int):
     """Завершение сделки после подтверждения обеих сторон."""
     try:
-        product = db.get_product(product_id)
-        if not product:
-            logger.warning(f"Товар или услуга с ID {product_id} не найдены для завершения заказа.")
+        result = db.complete_order(order_id)
+        if not result:
+            # Сделку уже завершил параллельный запрос
+            logger.info(f"Заказ с ID {order_id} уже завершён или ещё не подтверждён обеими сторонами.")
             return
-        name, price, description, photo, item_type = product
+        (product_id, seller_id, buyer_id, buyer_msg_id, seller_msg_id,
+         name, price, description, photo, item_type, channel_message_id) = result
         type_label = "Товар" if item_type == "product" else "Услуга"
-        db.update_order_status(order_id, "completed")
-        db.update_product_status(product_id, "sold")
-        channel_message_id = db.get_channel_message_id(product_id)
-        if channel_message_id:
-            crossed_caption = (
-                f"<s>{'📦' if item_type == 'product' else '🛠'} <b>{type_label}: {escape_html(name)}</b>\n"
-                f"💸 Цена: {escape_html(price)}\n"
-                f"✏️ {escape_html(description)}</s>\n\n"
-                f"<b>✅ ПРОДАНО</b>"
-            )
-            try:
-                if photo:
-                    await bot.edit_message_caption(
-                        chat_id=Config.CHANNEL_ID,
-                        message_id=channel_message_id,
-                        caption=crossed_caption,
-                        parse_mode="HTML",
-                        reply_markup=None
-                    )
-                else:
-                    await bot.edit_message_text(
-                        chat_id=Config.CHANNEL_ID,
-                        message_id=channel_message_id,
-                        text=crossed_caption,
-                        parse_mode="HTML",
-                        reply_markup=None
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка при редактировании сообщения в канале для product_id={product_id}: {e}")
-        buyer_msg_id, seller_msg_id = db.get_order_message_ids(order_id)
+        audiences.on_order_completed(seller_id, buyer_id, item_type)
+        # Пост в канале помечается проданным через журнал синхронизации
+        channel_sync.kick()
         if buyer_msg_id:
             try:
                 await bot.delete_message(buyer_id, buyer_msg_id)
@@ -563,25 +711,18 @@ async def complete_order(order_id: int, product_id: int, seller_id: int, buyer_i
         logger.error(f"Ошибка в complete_order для order_id={order_id}: {e}")
 
 # Обработчик отмены сделки
-@dp.callback_query(lambda c: c.data.startswith("cancel_"))
+@router.callback_query(lambda c: c.data.startswith("cancel_"))
 async def cancel_order(callback: types.CallbackQuery):
     """Отмена сделки покупателем или продавцом."""
     try:
         order_id = int(callback.data.split("_")[1])
-        order = db.get_order(order_id)
+        order = db.cancel_order(order_id, offer_ttl=OFFER_TTL_SECONDS, user_id=callback.from_user.id)
         if not order:
-            logger.warning(f"Заказ с ID {order_id} не найден.")
-            await callback.answer("❌ Заказ не найден.", show_alert=True)
-            return
-        if order[4] != "in_progress":
-            logger.warning(f"Заказ с ID {order_id} уже имеет статус {order[4]}.")
+            logger.warning(f"Активный заказ с ID {order_id} пользователя {callback.from_user.id} не найден.")
             await callback.answer("⚠️ Этот заказ уже закрыт.", show_alert=True)
             return
-        product_id, seller_id, buyer_id, _, _ = order
-        product = db.get_product(product_id)
-        type_label = "Товар" if product[4] == "product" else "Услуга"
-        db.update_order_status(order_id, "canceled")
-        buyer_msg_id, seller_msg_id = db.get_order_message_ids(order_id)
+        product_id, seller_id, buyer_id, buyer_msg_id, seller_msg_id, item_type, next_buyer = order
+        type_label = "Товар" if item_type == "product" else "Услуга"
         kb = keyboards.get_main_menu()
         if buyer_msg_id:
             await bot.send_message(buyer_id, f"❌ Сделка по {type_label.lower()} №{order_id} отменена.", reply_markup=kb)
@@ -597,125 +738,158 @@ async def cancel_order(callback: types.CallbackQuery):
                 await bot.delete_message(seller_id, seller_msg_id)
             except Exception as e:
                 logger.warning(f"Ошибка удаления сообщения у продавца {seller_id}: {e}")
+        if next_buyer:
+            await notify_waitlisted(next_buyer, product_id)
         await callback.answer(f"Сделка по {type_label.lower()} №{order_id} отменена.")
     except Exception as e:
         logger.error(f"Ошибка в cancel_order для order_id={order_id}: {e}")
         await callback.answer("❌ Ошибка при отмене сделки.", show_alert=True)
 
 # Обработчик команды /pending
-@dp.message(Command(commands=["pending"]))
+@router.message(Command(commands=["pending"]), flags={"admin": True})
 async def show_pending(message: types.Message):
     """Отображение списка товаров/услуг на модерации."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /pending от user_id={message.from_user.id}")
-        return
     try:
         products = db.get_pending_products()
         if not products:
             await message.answer("✅ Нет товаров или услуг на модерации.")
             return
-        for product_id, name, price, item_type in products:
-            product = db.get_product_any_status(product_id)
-            if not product:
-                continue
-            name, price, description, photo, item_type = product
-            type_label = "Товар" if item_type == "product" else "Услуга"
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{product_id}"),
-                    InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{product_id}")
-                ]
-            ])
+        for product in products:
+            type_label = "Товар" if product.type == "product" else "Услуга"
+            kb = review_keyboard(product.id, 0)
             caption = (
-                f"🆔 {type_label} №{product_id}\n\n"
-                f"{'📦' if item_type == 'product' else '🛠'} <b>{escape_html(name)}</b>\n"
-                f"✏️ {escape_html(description)}\n"
-                f"💸 Цена: {escape_html(price)}₽"
+                f"🆔 {type_label} №{product.id}\n\n"
+                f"{'📦' if product.type == 'product' else '🛠'} <b>{escape_html(product.name)}</b>\n"
+                f"✏️ {escape_html(product.description)}\n"
+                f"💸 Цена: {escape_html(product.price)}₽"
             )
-            if photo:
-                await message.answer_photo(photo=photo, caption=caption, parse_mode="HTML", reply_markup=kb)
+            if product.photo:
+                sent = await message.answer_photo(photo=product.photo, caption=caption, parse_mode="HTML", reply_markup=kb)
             else:
-                await message.answer(caption, parse_mode="HTML", reply_markup=kb)
+                sent = await message.answer(caption, parse_mode="HTML", reply_markup=kb)
+            # Карточка обновится, когда решение примет другой администратор
+            db.add_moderation_copy(product.id, message.from_user.id, sent.message_id)
     except Exception as e:
         logger.error(f"Ошибка в show_pending для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при получении списка.")
 
+# Размер страницы админских списков и максимальная длина названия в строке
+ADMIN_PAGE_SIZE = 20
+ADMIN_NAME_MAX_LEN = 40
+
+def _short_name(name: Optional[str]) -> str:
+    """Обрезает название для строки списка и экранирует HTML."""
+    name = name or "—"
+    if len(name) > ADMIN_NAME_MAX_LEN:
+        name = name[:ADMIN_NAME_MAX_LEN - 1] + "…"
+    return escape_html(name)
+
+def render_admin_page(kind: str, cursor: Optional[int] = None, backward: bool = False) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    """Формирование страницы админского списка (заказы, активные или отклонённые объявления)."""
+    if kind == "orders":
+        rows, has_prev, has_next = db.get_active_orders_page(cursor, backward, ADMIN_PAGE_SIZE)
+        if not rows:
+            return None, None
+        text_lines = ["📋 <b>Активные сделки:</b>\n"]
+        for order_id, product_id, seller_id, buyer_id, status, name, item_type in rows:
+            type_label = "Товар" if item_type == "product" else "Услуга"
+            text_lines.append(
+                f"🆔 {order_id} | {type_label} #{product_id} {_short_name(name)}\n👤 Продавец: {seller_id}\n🧑‍💻 Покупатель: {buyer_id}\nСтатус: {status}\n"
+            )
+        item_rows = None
+    else:
+        status = "approved" if kind == "approved" else "rejected"
+        rows, has_prev, has_next = db.get_products_page(status, cursor, backward, ADMIN_PAGE_SIZE)
+        if not rows:
+            return None, None
+        header = "📄 Список активных товаров и услуг:" if kind == "approved" else "📄 Список отклонённых товаров и услуг:"
+        text_lines = [header]
+        for product_id, name, price, item_type in rows:
+            type_label = "Товар" if item_type == "product" else "Услуга"
+            text_lines.append(
+                f"{'📦' if item_type == 'product' else '🛠'} {type_label} #{product_id} — {_short_name(name)} — {escape_html(price)}₽"
+            )
+        item_rows = None
+        if kind == "approved":
+            item_rows = [
+                [InlineKeyboardButton(text=f"🗑 Удалить #{product_id}", callback_data=f"delete_product_{product_id}")]
+                for product_id, _, _, _ in rows
+            ]
+    kb = keyboards.get_admin_page_kb(kind, rows[0][0], rows[-1][0], has_prev, has_next, item_rows)
+    return "\n".join(text_lines), kb
+
 # Обработчик команды /approved
-@dp.message(Command(commands=["approved"]))
+@router.message(Command(commands=["approved"]), flags={"admin": True})
 async def show_approved(message: types.Message):
     """Отображение списка активных товаров/услуг."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /approved от user_id={message.from_user.id}")
-        return
     try:
-        products = db.get_approved_products()
-        if not products:
+        text, kb = render_admin_page("approved")
+        if not text:
             await message.answer("🤷‍♂️ Нет активных товаров или услуг.")
             return
-        for product_id, name, price, item_type in products:
-            name = escape_html(name)
-            price = escape_html(price)
-            type_label = "Товар" if item_type == "product" else "Услуга"
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_product_{product_id}")]
-            ])
-            await message.answer(f"{'📦' if item_type == 'product' else '🛠'} {type_label} #{product_id} {name} — {price}₽", reply_markup=kb)
+        await message.answer(text, parse_mode="HTML", reply_markup=kb)
     except Exception as e:
         logger.error(f"Ошибка в show_approved для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при получении списка.")
 
 # Обработчик команды /reject
-@dp.message(Command(commands=["reject"]))
+@router.message(Command(commands=["reject"]), flags={"admin": True})
 async def show_rejected(message: types.Message):
     """Отображение списка отклоненных товаров/услуг."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /reject от user_id={message.from_user.id}")
-        return
     try:
-        products = db.get_rejected_products()
-        if not products:
+        text, kb = render_admin_page("rejected")
+        if not text:
             await message.answer("❌ Нет отклонённых товаров или услуг.")
             return
-        text = "📄 Список отклонённых товаров и услуг:\n"
-        for product_id, name, price, item_type in products:
-            name = escape_html(name)
-            price = escape_html(price)
-            type_label = "Товар" if item_type == "product" else "Услуга"
-            text += f"{'📦' if item_type == 'product' else '🛠'} {type_label} #{product_id} — {name} — {price}₽\n"
-        await message.answer(text, parse_mode="HTML")
+        await message.answer(text, parse_mode="HTML", reply_markup=kb)
     except Exception as e:
         logger.error(f"Ошибка в show_rejected для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при получении списка.")
 
+# Обработчик навигации по админским спискам
+@router.callback_query(F.data.startswith("adm_page:"), flags={"admin": True})
+async def paginate_admin_list(callback: types.CallbackQuery):
+    """Переключение страниц админских списков по курсору."""
+    try:
+        _, kind, direction, cursor = callback.data.split(":")
+        text, kb = render_admin_page(kind, int(cursor), backward=direction == "p")
+        if not text:
+            await callback.answer("📭 Больше записей нет.", show_alert=True)
+            return
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в paginate_admin_list для callback_data={callback.data}: {e}")
+        await callback.answer("❌ Ошибка при переключении страницы.", show_alert=True)
+
 # Обработчик команды /delete
-@dp.message(Command(commands=["delete"]))
+@router.message(Command(commands=["delete"]), flags={"admin": True})
 async def delete_item(message: types.Message):
     """Удаление товара/услуги или рекламного поста."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /delete от user_id={message.from_user.id}")
-        return
     try:
         args = message.text.split()
-        if len(args) != 3 or args[1] not in ["adv", "post"]:
-            await message.answer("⚠️ Использование: /delete <adv/post> <id>")
+        if len(args) < 3 or args[1] not in ["adv", "post"] or (args[1] == "adv" and len(args) != 3):
+            await message.answer("⚠️ Использование: /delete <adv/post> <id> (для post можно несколько id)")
             return
         item_type, item_id = args[1], int(args[2])
         if item_type == "post":
-            product = db.get_product_any_status(item_id)
-            if not product:
-                logger.warning(f"Товар или услуга с ID {item_id} не найдены для удаления.")
-                await message.answer(f"❌ Товар или услуга с ID {item_id} не найдена.")
-                return
-            channel_msg_id, item_type = db.get_channel_message_id(item_id), product[4]
-            type_label = "Товар" if item_type == "product" else "Услуга"
-            if channel_msg_id:
-                try:
-                    await bot.delete_message(Config.CHANNEL_ID, channel_msg_id)
-                except Exception as e:
-                    logger.warning(f"Ошибка удаления сообщения в канале для product_id={item_id}: {e}")
-                    await message.answer(f"⚠️ Не удалось удалить сообщение в канале: {e}")
-            db.delete_product(item_id)
-            await message.answer(f"🗑 {type_label} #{item_id} удалён.")
+            item_ids = [int(arg) for arg in args[2:]]
+            products = db.get_products_by_ids(item_ids)
+            missing = [i for i in item_ids if i not in products]
+            if missing:
+                logger.warning(f"Товары или услуги с ID {missing} не найдены для удаления.")
+                await message.answer(f"❌ Не найдены: {', '.join(map(str, missing))}.")
+                if not products:
+                    return
+            # Посты в канале удаляются синхронизацией по журналу
+            db.delete_products(list(products))
+            channel_sync.kick()
+            if len(products) == 1:
+                product = next(iter(products.values()))
+                type_label = "Товар" if product.type == "product" else "Услуга"
+                await message.answer(f"🗑 {type_label} #{product.id} удалён.")
+            else:
+                await message.answer(f"🗑 Удалено объявлений: {len(products)} ({', '.join(map(str, products))}).")
         elif item_type == "adv":
             ad = db.get_ad(item_id)
             if not ad:
@@ -737,74 +911,69 @@ async def delete_item(message: types.Message):
         await message.answer("❌ Ошибка при удалении.")
 
 # Обработчик команды /broadcast
-@dp.message(Command(commands=["broadcast"]))
+@router.message(Command(commands=["broadcast"]), flags={"admin": True})
 async def broadcast(message: types.Message):
     """Рассылка сообщения всем пользователям."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /broadcast от user_id={message.from_user.id}")
-        return
-    args = message.text.split(maxsplit=1)
-    if len(args) < 2:
-        await message.answer("⚠️ Напиши текст рассылки: /broadcast <текст>")
+    args = message.text.split(maxsplit=2)
+    segment = "all"
+    if len(args) > 2 and args[1] in SEGMENTS:
+        segment = args[1]
+        text = args[2]
+    elif len(args) > 1:
+        text = message.text.split(maxsplit=1)[1]
+    else:
+        await message.answer("⚠️ Напиши текст рассылки: /broadcast [сегмент] <текст>")
         return
-    text = args[1]
-    users = db.get_all_users()
-    sent = 0
-    for user_id in users:
-        try:
-            await bot.send_message(user_id, text)
-            sent += 1
-        except Exception as e:
-            logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-    await message.answer(f"✅ Сообщение отправлено {sent} пользователям.")
+    sent = await audiences.deliver(segment, lambda user_id: bot.send_message(user_id, text))
+    await message.answer(f"✅ Сообщение отправлено {sent} пользователям (сегмент {segment}).")
+
+# Обработчик команды /segments
+@router.message(Command(commands=["segments"]), flags={"admin": True})
+async def cmd_segments(message: types.Message):
+    """Отображение сегментов аудитории и их размеров."""
+    try:
+        text = "🎯 <b>Сегменты аудитории:</b>\n"
+        for segment, title in SEGMENTS.items():
+            text += f"<code>{segment}</code> — {title}: {audiences.count(segment)}\n"
+        await message.answer(text, parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_segments для user_id={message.from_user.id}: {e}")
+        await message.answer("❌ Ошибка при получении сегментов.")
 
 # Обработчик команды /orders
-@dp.message(Command(commands=["orders"]))
+@router.message(Command(commands=["orders"]), flags={"admin": True})
 async def cmd_orders(message: types.Message):
     """Отображение списка активных сделок."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /orders от user_id={message.from_user.id}")
-        return
     try:
-        orders = db.get_active_orders()
-        if not orders:
+        text, kb = render_admin_page("orders")
+        if not text:
             await message.answer("🛒 Активных сделок нет.")
             return
-        text_lines = ["📋 <b>Активные сделки:</b>\n"]
-        for order_id, product_id, seller_id, buyer_id, status in orders:
-            product = db.get_product(product_id)
-            type_label = "Товар" if product[4] == "product" else "Услуга"
-            text_lines.append(
-                f"🆔 {order_id} | {type_label} #{product_id}\n👤 Продавец: {seller_id}\n🧑‍💻 Покупатель: {buyer_id}\nСтатус: {status}\n"
-            )
-        await message.answer("\n".join(text_lines), parse_mode="HTML")
+        await message.answer(text, parse_mode="HTML", reply_markup=kb)
     except Exception as e:
         logger.error(f"Ошибка в cmd_orders для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при получении списка сделок.")
 
 # Обработчик команды /close_order
-@dp.message(Command(commands=["close_order"]))
+@router.message(Command(commands=["close_order"]), flags={"admin": True})
 async def cmd_close_order(message: types.Message):
     """Принудительное завершение сделки администратором."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /close_order от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /close_order <id>")
         return
     try:
         order_id = int(args[1])
-        order = db.get_order(order_id)
-        if not order:
-            logger.warning(f"Заказ с ID {order_id} не найден.")
-            await message.answer("❌ Заказ не найден.")
+        result = db.complete_order(order_id, force=True)
+        if not result:
+            logger.warning(f"Активный заказ с ID {order_id} не найден.")
+            await message.answer("❌ Активный заказ не найден.")
             return
-        product_id, seller_id, buyer_id, _, _ = order
-        product = db.get_product(product_id)
-        type_label = "Товар" if product[4] == "product" else "Услуга"
-        db.update_order_status(order_id, "completed")
-        db.update_product_status(product_id, "sold")
+        product_id, seller_id, buyer_id = result[:3]
+        item_type = result[9]
+        type_label = "Товар" if item_type == "product" else "Услуга"
+        audiences.on_order_completed(seller_id, buyer_id, item_type)
+        channel_sync.kick()
         await bot.send_message(seller_id, f"✅ Сделка по {type_label.lower()} #{order_id} была завершена администратором.")
         await bot.send_message(buyer_id, f"✅ Сделка по {type_label.lower()} #{order_id} была завершена администратором.")
         await message.answer(f"✅ Сделка по {type_label.lower()} #{order_id} закрыта.")
@@ -813,49 +982,45 @@ async def cmd_close_order(message: types.Message):
         await message.answer("❌ Ошибка при закрытии сделки.")
 
 # Обработчик команды /cancel_order
-@dp.message(Command(commands=["cancel_order"]))
+@router.message(Command(commands=["cancel_order"]), flags={"admin": True})
 async def cmd_cancel_order(message: types.Message):
     """Принудительная отмена сделки администратором."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /cancel_order от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /cancel_order <id>")
         return
     try:
         order_id = int(args[1])
-        order = db.get_order(order_id)
+        order = db.cancel_order(order_id, offer_ttl=OFFER_TTL_SECONDS)
         if not order:
-            logger.warning(f"Заказ с ID {order_id} не найден.")
-            await message.answer("❌ Заказ не найден.")
+            logger.warning(f"Активный заказ с ID {order_id} не найден.")
+            await message.answer("❌ Активный заказ не найден.")
             return
-        product_id, seller_id, buyer_id, _, _ = order
-        product = db.get_product(product_id)
-        type_label = "Товар" if product[4] == "product" else "Услуга"
-        db.update_order_status(order_id, "canceled")
+        product_id, seller_id, buyer_id, _, _, item_type, next_buyer = order
+        type_label = "Товар" if item_type == "product" else "Услуга"
         await bot.send_message(seller_id, f"❌ Сделка по {type_label.lower()} #{order_id} отменена администратором.")
         await bot.send_message(buyer_id, f"❌ Сделка по {type_label.lower()} #{order_id} отменена администратором.")
+        if next_buyer:
+            await notify_waitlisted(next_buyer, product_id)
         await message.answer(f"❌ Сделка по {type_label.lower()} #{order_id} отменена.")
     except Exception as e:
         logger.error(f"Ошибка в cmd_cancel_order для order_id={order_id}: {e}")
         await message.answer("❌ Ошибка при отмене сделки.")
 
 # Обработчик команды /stats
-@dp.message(Command(commands=["stats"]))
+@router.message(Command(commands=["stats"]), flags={"admin": True})
 async def cmd_stats(message: types.Message):
     """Отображение статистики бота."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /stats от user_id={message.from_user.id}")
-        return
     try:
         total_products, active_products, sold_products, total_users = db.get_stats()
+        active_users = db.count_active_users(30)
         stats_text = (
             f"📊 <b>Статистика:</b>\n"
             f"Всего товаров и услуг: {total_products}\n"
             f"Активных: {active_products}\n"
             f"Продано: {sold_products}\n"
             f"Пользователей: {total_users}\n"
+            f"Активных за 30 дней: {active_users}\n"
         )
         await message.answer(stats_text, parse_mode="HTML")
     except Exception as e:
@@ -863,12 +1028,9 @@ async def cmd_stats(message: types.Message):
         await message.answer("❌ Ошибка при получении статистики.")
 
 # Обработчик команды /user
-@dp.message(Command(commands=["user"]))
+@router.message(Command(commands=["user"]), flags={"admin": True})
 async def cmd_user_info(message: types.Message):
     """Отображение информации о пользователе."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /user от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /user <user_id>")
@@ -888,12 +1050,9 @@ async def cmd_user_info(message: types.Message):
         await message.answer("❌ Ошибка при получении информации.")
 
 # Обработчик команды /logs
-@dp.message(Command(commands=["logs"]))
+@router.message(Command(commands=["logs"]), flags={"admin": True})
 async def cmd_logs(message: types.Message, state: FSMContext):
     """Отображение списка папок с логами."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /logs от user_id={message.from_user.id}")
-        return
     try:
         folders = keyboards.get_date_folders()
         if not folders:
@@ -906,7 +1065,7 @@ async def cmd_logs(message: types.Message, state: FSMContext):
         await message.answer("❌ Ошибка при получении логов.")
 
 # Обработчик пагинации логов
-@dp.callback_query(F.data.startswith("logs_page:"))
+@router.callback_query(F.data.startswith("logs_page:"))
 async def paginate_logs(callback: types.CallbackQuery):
     """Переключение страниц с папками логов."""
     try:
@@ -918,13 +1077,9 @@ async def paginate_logs(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка при переключении страницы логов.", show_alert=True)
 
 # Обработчик открытия папки логов
-@dp.callback_query(F.data.startswith("logs_open:"))
+@router.callback_query(F.data.startswith("logs_open:"), flags={"admin": True})
 async def open_logs_folder(callback: types.CallbackQuery, state: FSMContext):
     """Отправка файлов логов из выбранной папки."""
-    if callback.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к logs_open от user_id={callback.from_user.id}")
-        await callback.answer("🚫 У вас нет прав для этого действия.", show_alert=True)
-        return
     try:
         folder = callback.data.split(":")[1]
         folder_path = os.path.join(Config.LOGS_BASE_DIR, folder)
@@ -956,17 +1111,12 @@ async def open_logs_folder(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Ошибка при открытии папки логов.", show_alert=True)
 
 # Обработчик команды /db_backup
-@dp.message(Command(commands=["db_backup"]))
+@router.message(Command(commands=["db_backup"]), flags={"admin": True})
 async def cmd_db_backup(message: types.Message):
     """Создание и отправка бэкапа базы данных."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /db_backup от user_id={message.from_user.id}")
-        return
     try:
-        import shutil
-        from datetime import datetime
         backup_path = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite3"
-        shutil.copyfile("db.sqlite3", backup_path)
+        await asyncio.to_thread(db.backup, backup_path)
         await bot.send_document(
             chat_id=message.from_user.id,
             document=FSInputFile(backup_path),
@@ -978,40 +1128,68 @@ async def cmd_db_backup(message: types.Message):
         logger.error(f"Ошибка в cmd_db_backup для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при создании бэкапа.")
 
+# Обработчик команды /export
+@router.message(Command(commands=["export"]), flags={"admin": True})
+async def cmd_export(message: types.Message):
+    """Потоковая выгрузка таблицы в CSV/JSONL и отправка файлами."""
+    args = message.text.split()
+    if len(args) < 2 or len(args) > 4 or args[1] not in EXPORT_TABLES:
+        await message.answer("⚠️ Использование: /export <products/orders/users> [csv/jsonl] [gz]")
+        return
+    table = args[1]
+    fmt = args[2] if len(args) > 2 else "csv"
+    compress = len(args) > 3 and args[3] == "gz"
+    if fmt not in EXPORT_FORMATS or (len(args) > 3 and not compress):
+        await message.answer("⚠️ Использование: /export <products/orders/users> [csv/jsonl] [gz]")
+        return
+    try:
+        await message.answer(f"⏳ Выгружаю {table}...")
+        with tempfile.TemporaryDirectory(prefix="export_") as out_dir:
+            files = await export_table(db, table, fmt, compress, out_dir)
+            for path, count in files:
+                await bot.send_document(
+                    chat_id=message.from_user.id,
+                    document=FSInputFile(path),
+                    caption=f"📤 {table}: {count} строк"
+                )
+        await message.answer(f"✅ Выгрузка {table} завершена ({len(files)} файл(ов)).")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_export для table={table}: {e}")
+        await message.answer("❌ Ошибка при выгрузке.")
+
 # Обработчик команды /ban
-@dp.message(Command(commands=["ban"]))
+@router.message(Command(commands=["ban"]), flags={"admin": True})
 async def cmd_ban_user(message: types.Message):
     """Запрет пользователю продавать."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /ban от user_id={message.from_user.id}")
-        return
     args = message.text.split()
-    if len(args) != 2:
-        await message.answer("⚠️ Использование: /ban <user_id>")
+    if len(args) < 2:
+        await message.answer("⚠️ Использование: /ban <user_id> [user_id ...]")
         return
     try:
-        user_id = int(args[1])
-        db.ban_user(user_id)
-        await message.answer(f"🚫 Пользователь {user_id} заблокирован для продаж.")
-        await bot.send_message(user_id, "🚫 Вам запрещено продавать товары и услуги.")
+        user_ids = [int(arg) for arg in args[1:]]
+        permissions.ban_many(user_ids)
+        await message.answer(f"🚫 Заблокированы для продаж: {', '.join(map(str, user_ids))}.")
+        with api_priority(NOTIFY):
+            for user_id in user_ids:
+                try:
+                    await bot.send_message(user_id, "🚫 Вам запрещено продавать товары и услуги.")
+                except Exception as e:
+                    logger.warning(f"Не удалось уведомить user_id={user_id} о блокировке: {e}")
     except Exception as e:
-        logger.error(f"Ошибка в cmd_ban_user для user_id={user_id}: {e}")
+        logger.error(f"Ошибка в cmd_ban_user для {args[1:]}: {e}")
         await message.answer("❌ Ошибка при блокировке пользователя.")
 
 # Обработчик команды /unban
-@dp.message(Command(commands=["unban"]))
+@router.message(Command(commands=["unban"]), flags={"admin": True})
 async def cmd_unban_user(message: types.Message):
     """Снятие запрета на продажу для пользователя."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /unban от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /unban <user_id>")
         return
     try:
         user_id = int(args[1])
-        db.unban_user(user_id)
+        permissions.unban(user_id)
         await message.answer(f"✅ Пользователь {user_id} разблокирован для продаж.")
         await bot.send_message(user_id, "✅ Вам разрешено продавать товары и услуги.")
     except Exception as e:
@@ -1019,12 +1197,9 @@ async def cmd_unban_user(message: types.Message):
         await message.answer("❌ Ошибка при разблокировке пользователя.")
 
 # Обработчик команды /sellers
-@dp.message(Command(commands=["sellers"]))
+@router.message(Command(commands=["sellers"]), flags={"admin": True})
 async def cmd_top_sellers(message: types.Message):
     """Отображение топ-10 продавцов по количеству продаж."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /sellers от user_id={message.from_user.id}")
-        return
     try:
         sellers = db.get_top_sellers()
         if not sellers:
@@ -1039,12 +1214,9 @@ async def cmd_top_sellers(message: types.Message):
         await message.answer("❌ Ошибка при получении топа продавцов.")
 
 # Обработчик команды /buyers
-@dp.message(Command(commands=["buyers"]))
+@router.message(Command(commands=["buyers"]), flags={"admin": True})
 async def cmd_top_buyers(message: types.Message):
     """Отображение топ-10 покупателей по количеству покупок."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /buyers от user_id={message.from_user.id}")
-        return
     try:
         buyers = db.get_top_buyers()
         if not buyers:
@@ -1059,12 +1231,9 @@ async def cmd_top_buyers(message: types.Message):
         await message.answer("❌ Ошибка при получении топа покупателей.")
 
 # Обработчик команды /send_user
-@dp.message(Command(commands=["send_user"]))
+@router.message(Command(commands=["send_user"]), flags={"admin": True})
 async def cmd_send_user(message: types.Message):
     """Отправка личного сообщения пользователю от имени администратора."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /send_user от user_id={message.from_user.id}")
-        return
     args = message.text.split(maxsplit=2)
     if len(args) < 3:
         await message.answer("⚠️ Использование: /send_user <user_id> <текст>")
@@ -1079,56 +1248,48 @@ async def cmd_send_user(message: types.Message):
         await message.answer("❌ Ошибка при отправке сообщения.")
 
 # Обработчик команды /pin
-@dp.message(Command(commands=["pin"]))
+@router.message(Command(commands=["pin"]), flags={"admin": True})
 async def cmd_pin(message: types.Message):
     """Закрепление сообщения товара или услуги в канале."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /pin от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /pin <id>")
         return
     try:
         product_id = int(args[1])
-        channel_message_id = db.get_channel_message_id(product_id)
-        if not channel_message_id:
-            logger.warning(f"Сообщение в канале для product_id={product_id} не найдено.")
-            await message.answer("❌ Сообщение в канале не найдено.")
-            return
         product = db.get_product(product_id)
         if not product:
             logger.warning(f"Товар или услуга с ID {product_id} не найдены или не одобрены.")
             await message.answer("❌ Товар или услуга не найдены.")
             return
-        type_label = "Товар" if product[4] == "product" else "Услуга"
-        await bot.pin_chat_message(chat_id=Config.CHANNEL_ID, message_id=channel_message_id)
+        if not product.channel_message_id:
+            logger.warning(f"Сообщение в канале для product_id={product_id} не найдено.")
+            await message.answer("❌ Сообщение в канале не найдено.")
+            return
+        type_label = "Товар" if product.type == "product" else "Услуга"
+        await bot.pin_chat_message(chat_id=Config.CHANNEL_ID, message_id=product.channel_message_id)
+        db.set_channel_post_pinned(product_id, True)
         await message.answer(f"📌 {type_label} #{product_id} закреплён в канале.")
     except Exception as e:
         logger.error(f"Ошибка в cmd_pin для product_id={product_id}: {e}")
         await message.answer("❌ Ошибка при закреплении сообщения.")
 
 # Обработчик команды /unpin
-@dp.message(Command(commands=["unpin"]))
+@router.message(Command(commands=["unpin"]), flags={"admin": True})
 async def cmd_unpin(message: types.Message):
     """Открепление всех сообщений в канале."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /unpin от user_id={message.from_user.id}")
-        return
     try:
         await bot.unpin_all_chat_messages(chat_id=Config.CHANNEL_ID)
+        db.set_channel_post_pinned(None, False)
         await message.answer("📌 Все сообщения откреплены в канале.")
     except Exception as e:
         logger.error(f"Ошибка в cmd_unpin для user_id={message.from_user.id}: {e}")
         await message.answer("❌ Ошибка при откреплении сообщений.")
 
 # Обработчик команды /adv
-@dp.message(Command(commands=["adv"]))
+@router.message(Command(commands=["adv"]), flags={"admin": True})
 async def cmd_create_ad(message: types.Message, state: FSMContext):
     """Создание нового рекламного поста."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /adv от user_id={message.from_user.id}")
-        return
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
         await message.answer("⚠️ Напиши текст рекламы: /adv <текст>")
@@ -1142,15 +1303,12 @@ async def cmd_create_ad(message: types.Message, state: FSMContext):
         await message.answer("❌ Ошибка при создании рекламного поста.")
 
 # Обработчик команды /send_adv
-@dp.message(Command(commands=["send_adv"]))
+@router.message(Command(commands=["send_adv"]), flags={"admin": True})
 async def cmd_send_ad(message: types.Message):
     """Отправка рекламного поста в канал или всем пользователям."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /send_adv от user_id={message.from_user.id}")
-        return
     args = message.text.split()
-    if len(args) != 3 or args[2] not in ["all", "channel"]:
-        await message.answer("⚠️ Использование: /send_adv <id_поста> <all/channel>")
+    if len(args) != 3 or (args[2] != "channel" and args[2] not in SEGMENTS):
+        await message.answer("⚠️ Использование: /send_adv <id_поста> <channel/сегмент>")
         return
     try:
         ad_id = int(args[1])
@@ -1173,37 +1331,95 @@ async def cmd_send_ad(message: types.Message):
             except Exception as e:
                 logger.error(f"Ошибка при отправке рекламы в канал для ad_id={ad_id}: {e}")
                 await message.answer("❌ Ошибка при отправке в канал.")
-        else:  # all
-            users = db.get_all_users()
-            sent = 0
-            for user_id in users:
-                try:
-                    if photo:
-                        await bot.send_photo(user_id, photo, caption=text, parse_mode="HTML")
-                    else:
-                        await bot.send_message(user_id, text, parse_mode="HTML")
-                    sent += 1
-                except Exception as e:
-                    logger.warning(f"Не удалось отправить рекламу пользователю {user_id}: {e}")
-            await message.answer(f"✅ Рекламный пост #{ad_id} отправлен {sent} пользователям.")
+        else:
+            # Рассылка идёт разовой кампанией с ограничением скорости, а не блокирует обработчик
+            campaign_id = db.create_campaign(ad_id, target, int(time.time()))
+            await message.answer(
+                f"✅ Рекламный пост #{ad_id} поставлен в рассылку кампанией #{campaign_id} "
+                f"({audiences.count(target)} пользователей, сегмент {target}). Ход: /campaigns"
+            )
     except Exception as e:
         logger.error(f"Ошибка в cmd_send_ad для ad_id={ad_id}: {e}")
         await message.answer("❌ Ошибка при отправке рекламного поста.")
 
+# Обработчик команды /campaign
+@router.message(Command(commands=["campaign"]), flags={"admin": True})
+async def cmd_campaign(message: types.Message):
+    """Планирование рекламной кампании."""
+    args = message.text.split()
+    if len(args) < 3 or (args[2] != "channel" and args[2] not in SEGMENTS):
+        await message.answer(
+            "⚠️ Использование: /campaign <id_поста> <channel/сегмент> [at=+1h|2025-01-31T18:00] "
+            "[repeat=N every=1d] [spread=2h] [pin=12h]"
+        )
+        return
+    try:
+        ad_id, target = int(args[1]), args[2]
+        if not db.get_ad(ad_id):
+            await message.answer(f"❌ Рекламный пост #{ad_id} не найден.")
+            return
+        options = parse_campaign_options(args[3:], int(time.time()))
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    try:
+        campaign_id = db.create_campaign(ad_id, target, **options)
+        start = datetime.fromtimestamp(options["start_at"]).strftime("%Y-%m-%d %H:%M")
+        await message.answer(f"🗓 Кампания #{campaign_id} запланирована: пост #{ad_id} → {target}, старт {start}.")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_campaign для ad_id={ad_id}: {e}")
+        await message.answer("❌ Ошибка при создании кампании.")
+
+# Обработчик команды /campaigns
+@router.message(Command(commands=["campaigns"]), flags={"admin": True})
+async def cmd_campaigns(message: types.Message):
+    """Список рекламных кампаний."""
+    try:
+        rows = db.get_campaigns()
+        if not rows:
+            await message.answer("📭 Кампаний нет.")
+            return
+        text = "🗓 <b>Рекламные кампании:</b>\n"
+        for campaign_id, ad_id, target, status, next_run_at, runs_done, repeat_count, sent, run_total in rows:
+            next_run = datetime.fromtimestamp(next_run_at).strftime("%Y-%m-%d %H:%M") if next_run_at else "—"
+            text += (
+                f"#{campaign_id} пост #{ad_id} → {target}: {status}, запусков {runs_done}/{repeat_count}, "
+                f"отправлено {sent} (в запуске {run_total or 0}), следующий {next_run}\n"
+            )
+        await message.answer(text, parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_campaigns для user_id={message.from_user.id}: {e}")
+        await message.answer("❌ Ошибка при получении кампаний.")
+
+# Обработчик команды /cancel_campaign
+@router.message(Command(commands=["cancel_campaign"]), flags={"admin": True})
+async def cmd_cancel_campaign(message: types.Message):
+    """Отмена рекламной кампании."""
+    args = message.text.split()
+    if len(args) != 2:
+        await message.answer("⚠️ Использование: /cancel_campaign <id>")
+        return
+    try:
+        campaign_id = int(args[1])
+        if db.cancel_campaign(campaign_id):
+            await message.answer(f"🛑 Кампания #{campaign_id} отменена.")
+        else:
+            await message.answer(f"❌ Активная кампания #{campaign_id} не найдена.")
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_cancel_campaign для message {message.text}: {e}")
+        await message.answer("❌ Ошибка при отмене кампании.")
+
 # Обработчик команды /admins
-@dp.message(Command(commands=["admins"]))
+@router.message(Command(commands=["admins"]), flags={"admin": True})
 async def cmd_list_admins(message: types.Message):
     """Отображение списка текущих администраторов."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /admins от user_id={message.from_user.id}")
-        return
     try:
-        admins = Config.ADMINS
+        admins = admin_registry.admins
         if not admins:
             await message.answer("🤷‍♂️ Список администраторов пуст.")
             return
         text = "👑 <b>Список администраторов:</b>\n"
-        for admin_id in admins:
+        for admin_id in sorted(admins):
             text += f"Пользователь {admin_id}\n"
         await message.answer(text, parse_mode="HTML")
     except Exception as e:
@@ -1211,22 +1427,18 @@ async def cmd_list_admins(message: types.Message):
         await message.answer("❌ Ошибка при получении списка администраторов.")
 
 # Обработчик команды /add_admin
-@dp.message(Command(commands=["add_admin"]))
+@router.message(Command(commands=["add_admin"]), flags={"admin": True})
 async def cmd_add_admin(message: types.Message):
     """Добавление нового администратора."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /add_admin от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /add_admin <user_id>")
         return
     try:
         user_id = int(args[1])
-        if user_id in Config.ADMINS:
+        if not admin_registry.add(user_id):
             await message.answer(f"⚠️ Пользователь {user_id} уже является администратором.")
             return
-        Config.ADMINS.append(user_id)
         await message.answer(f"✅ Пользователь {user_id} добавлен в администраторы.")
         await bot.send_message(user_id, "👑 Вы назначены администратором бота!")
     except Exception as e:
@@ -1234,22 +1446,18 @@ async def cmd_add_admin(message: types.Message):
         await message.answer("❌ Ошибка при добавлении администратора.")
 
 # Обработчик команды /remove_admin
-@dp.message(Command(commands=["remove_admin"]))
+@router.message(Command(commands=["remove_admin"]), flags={"admin": True})
 async def cmd_remove_admin(message: types.Message):
     """Удаление администратора."""
-    if message.from_user.id not in Config.ADMINS:
-        logger.warning(f"Несанкционированный доступ к /remove_admin от user_id={message.from_user.id}")
-        return
     args = message.text.split()
     if len(args) != 2:
         await message.answer("⚠️ Использование: /remove_admin <user_id>")
         return
     try:
         user_id = int(args[1])
-        if user_id not in Config.ADMINS:
+        if not admin_registry.remove(user_id):
             await message.answer(f"⚠️ Пользователь {user_id} не является администратором.")
             return
-        Config.ADMINS.remove(user_id)
         await message.answer(f"✅ Пользователь {user_id} удалён из администраторов.")
         await bot.send_message(user_id, "🚫 Вы больше не администратор бота.")
     except Exception as e:
@@ -1264,17 +1472,15 @@ async def show_product_card(message: types.Message, product_id: int):
             logger.warning(f"Товар или услуга с ID {product_id} не найдены или не одобрены.")
             await message.answer("❌ Товар или услуга не найдены.")
             return
-        name, price, description, photo, item_type = product
-        type_label = "Товар" if item_type == "product" else "Услуга"
+        type_label = "Товар" if product.type == "product" else "Услуга"
         caption = (
-            f"{'📦' if item_type == 'product' else '🛠'} <b>{type_label}: {escape_html(name)}</b>\n"
-            f"💸 Цена: {escape_html(price)}\n"
-            f"✏️ {escape_html(description)}"
+            f"{'📦' if product.type == 'product' else '🛠'} <b>{type_label}: {escape_html(product.name)}</b>\n"
+            f"💸 Цена: {escape_html(product.price)}\n"
+            f"✏️ {escape_html(product.description)}"
         )
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💰 Купить", callback_data=f"buy_{product_id}")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data=f"buy_type_{item_type}")]
-        ])
+        thumb, photos_count = db.get_product_preview(product_id)
+        photo = thumb or product.photo
+        kb = keyboards.get_product_card_kb(product_id, product.type, photos_count)
         if photo:
             await message.answer_photo(photo=photo, caption=caption, parse_mode="HTML", reply_markup=kb)
         else:
@@ -1283,47 +1489,116 @@ async def show_product_card(message: types.Message, product_id: int):
         logger.error(f"Ошибка в show_product_card для product_id={product_id}: {e}")
         await message.answer("❌ Ошибка при отображении карточки товара.")
 
-async def notify_admins(product_id: int, data: dict, seller_id: int):
-    """Уведомление администраторов о новом товаре/услуге на модерации."""
+async def notify_admins(product_id: int, data: dict, seller_id: int, reasons: Tuple[str, ...] = ()):
+    """Передача нового товара/услуги на модерацию одному из администраторов."""
     try:
-        type_label = "Товар" if data["type"] == "product" else "Услуга"
-        caption = (
-            f"🆕 {type_label} №{product_id} от пользователя {seller_id}\n\n"
-            f"{'📦' if data['type'] == 'product' else '🛠'} <b>{escape_html(data['name'])}</b>\n"
-            f"✏️ {escape_html(data['description'])}\n"
-            f"💸 Цена: {escape_html(data['price'])}₽\n"
-            f"📱 Контакт: {escape_html(data['contact'])}"
-        )
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{product_id}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{product_id}")
-            ]
-        ])
-        for admin_id in Config.ADMINS:
-            try:
-                if data.get("photo"):
-                    await bot.send_photo(
-                        chat_id=admin_id,
-                        photo=data["photo"],
-                        caption=caption,
-                        parse_mode="HTML",
-                        reply_markup=kb
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id=admin_id,
-                        text=caption,
-                        parse_mode="HTML",
-                        reply_markup=kb
-                    )
-            except Exception as e:
-                logger.warning(f"Не удалось уведомить админа {admin_id} о product_id={product_id}: {e}")
+        caption = review_caption(product_id, seller_id, data, reasons)
+        await reviews.submit(product_id, caption, data.get("photo"), len(data.get("photos") or []))
     except Exception as e:
         logger.error(f"Ошибка в notify_admins для product_id={product_id}: {e}")
 
+def create_app() -> Tuple[Bot, Dispatcher]:
+    """Создаёт бота, диспетчер, базу и подсистемы; повторный вызов возвращает уже созданные."""
+    global bot, dp, db, keyboards, admin_registry, user_writer, permissions, audiences, albums
+    global reservations, maintenance, channel_sync, campaigns, scheduler, lifecycle, moderator, reviews
+    if dp is not None:
+        return bot, dp
+    phase_started = time.perf_counter()
+
+    def phase(name: str):
+        nonlocal phase_started
+        now = time.perf_counter()
+        _startup_timings.append((name, (now - phase_started) * 1000))
+        phase_started = now
+
+    # Запросы к API идут через общий лимит с приоритетом интерактивных ответов;
+    # обработчики делят его поровну, front-процесс только получает обновления
+    bot = create_bot(Config.TOKEN, processes=WORKERS)
+    # При запуске в нескольких процессах состояния FSM хранятся в общей SQLite-базе
+    storage = SQLiteStorage("fsm.sqlite3") if WORKERS > 1 else MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    phase("bot")
+    db = Database("db.sqlite3")
+    phase("db" if db.schema_upgraded else "db (схема актуальна)")
+    keyboards = Keyboards(db)
+    admin_registry = AdminRegistry(db, seed=Config.ADMINS)
+    phase("admins")
+    user_writer = UserWriter(db)
+    permissions = PermissionCache(db, user_writer)
+    audiences = Audiences(db)
+    albums = AlbumCollector()
+    moderator = AutoModerator(db)
+    reviews = ReviewDispatcher(db, bot, admin_registry)
+    reservations = ReservationSweeper(db, on_hold_expired, notify_waitlisted)
+    maintenance = Maintenance(db, on_hold_expired)
+    channel_sync = ChannelSync(db, bot, Config.CHANNEL_ID)
+    campaigns = Campaigns(db, bot, Config.CHANNEL_ID, audiences)
+    scheduler = Scheduler(db)
+    lifecycle = Lifecycle()
+    # Dispatcher уже зарегистрировал FSMContextMiddleware; снимаем его, чтобы учёт и ограничение
+    # шли раньше чтения состояния из хранилища, и возвращаем следом
+    dp.update.outer_middleware.unregister(dp.fsm)
+    # Учёт обрабатываемых обновлений для корректной остановки
+    dp.update.outer_middleware(InFlightMiddleware(lifecycle))
+    # Ограничение частоты обновлений от одного пользователя — до состояния FSM, базы и API
+    throttler = Throttler()
+    dp.update.outer_middleware(ThrottleMiddleware(throttler, admin_registry, "update"))
+    dp.update.outer_middleware(dp.fsm)
+    dp.message.middleware(ThrottleMiddleware(throttler, admin_registry, "message"))
+    dp.callback_query.middleware(ThrottleMiddleware(throttler, admin_registry, "callback"))
+    # Регистрация и учёт активности всех пользователей, писавших боту
+    dp.update.outer_middleware(ActivityMiddleware(user_writer))
+    # Проверка прав для хендлеров с флагом admin
+    dp.message.middleware(AdminMiddleware(admin_registry))
+    dp.callback_query.middleware(AdminMiddleware(admin_registry))
+    # Право на продажу для хендлеров с флагом sell
+    dp.message.middleware(SellPermissionMiddleware(permissions))
+    dp.callback_query.middleware(SellPermissionMiddleware(permissions))
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    phase("handlers")
+    return bot, dp
+
+def register_jobs():
+    """Регистрирует периодические задачи планировщика (только в основном процессе)."""
+    scheduler.add("reservations", SWEEP_INTERVAL_SECONDS, reservations.sweep)
+    scheduler.add("expire_orders", EXPIRE_ORDERS_INTERVAL, maintenance.expire_orders)
+    scheduler.add("expire_listings", EXPIRE_LISTINGS_INTERVAL, maintenance.expire_listings)
+    scheduler.add("channel_sync", CHANNEL_SYNC_INTERVAL, channel_sync.sync)
+    scheduler.add("channel_reconcile", CHANNEL_RECONCILE_INTERVAL, channel_sync.reconcile)
+    scheduler.add("archive", ARCHIVE_INTERVAL, maintenance.archive)
+    scheduler.add("campaigns", CAMPAIGN_TICK_SECONDS, campaigns.tick)
+    scheduler.add("review_reassign", REVIEW_REASSIGN_INTERVAL, reviews.reassign_expired)
+    scheduler.add("compact", COMPACT_INTERVAL, maintenance.compact, delay=COMPACT_INTERVAL)
+
+async def on_startup():
+    """Запуск фоновых задач бота и отчёт о времени запуска."""
+    user_writer.start()
+    if is_primary_shard():
+        audiences.start()
+        register_jobs()
+        scheduler.start()
+    total = (time.perf_counter() - _process_started) * 1000
+    phases = ", ".join(f"{name} {ms:.0f} мс" for name, ms in _startup_timings)
+    logger.info(f"Бот запущен за {total:.0f} мс ({phases})")
+
+async def on_shutdown():
+    """Корректная остановка: дожидается текущих обновлений и задач, записывает буферы и сбрасывает WAL."""
+    deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+    lifecycle.stop_intake()
+    await lifecycle.drain(DRAIN_TIMEOUT_SECONDS)
+    # Кампании сохраняют курсор и при прерывании, поэтому задаче хватает оставшегося времени
+    await scheduler.stop(max(deadline - time.monotonic(), 0))
+    await campaigns.stop(max(deadline - time.monotonic(), 0))
+    await audiences.stop()
+    await user_writer.stop()
+    await asyncio.to_thread(db.checkpoint)
+    logger.info("Бот остановлен")
+
 async def main():
     """Запуск бота."""
+    bot, dp = create_app()
     try:
         await dp.start_polling(bot)
     except Exception as e:
@@ -1331,4 +1606,7 @@ async def main():
         raise
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WORKERS > 1:
+        run_sharded(*create_app(), WORKERS, app_module=__name__)
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from audiences import Audiences, is_undeliverable_error
+from database import Database
+from telegram_api import api_priority, BULK
+
+logger = logging.getLogger(__name__)
+
+# Как часто планировщик продвигает кампании
+CAMPAIGN_TICK_SECONDS = 10
+# Потолок скорости рассылки кампаний; общий лимит API с приоритетами — в telegram_api
+CAMPAIGN_MAX_RATE = 8.0
+CAMPAIGN_MIN_RATE = 0.2
+CAMPAIGN_OPTIONS = ("at", "repeat", "every", "spread", "pin")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(value: str) -> int:
+    """Разбирает длительность вида 30m, 2h, 1d в секунды."""
+    match = re.fullmatch(r"(\d+)([smhd])", value.strip().lower())
+    if not match:
+        raise ValueError(f"Неверная длительность: {value}")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+def parse_start_time(value: str, now: int) -> int:
+    """Разбирает время запуска: +30m относительно текущего момента или YYYY-MM-DDTHH:MM."""
+    if value.startswith("+"):
+        return now + parse_duration(value[1:])
+    return int(datetime.strptime(value, "%Y-%m-%dT%H:%M").timestamp())
+
+def parse_campaign_options(args: list, now: int) -> Dict[str, int]:
+    """Разбирает параметры кампании вида key=value."""
+    options = {"start_at": now, "repeat_count": 1, "repeat_interval": 0, "spread_seconds": 0, "pin_seconds": 0}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or key not in CAMPAIGN_OPTIONS:
+            raise ValueError(f"Неизвестный параметр: {arg}")
+        if key == "at":
+            options["start_at"] = parse_start_time(value, now)
+        elif key == "repeat":
+            options["repeat_count"] = max(int(value), 1)
+        elif key == "every":
+            options["repeat_interval"] = parse_duration(value)
+        elif key == "spread":
+            options["spread_seconds"] = parse_duration(value)
+        elif key == "pin":
+            options["pin_seconds"] = parse_duration(value)
+    if options["repeat_count"] > 1 and not options["repeat_interval"]:
+        raise ValueError("Для повторов укажите интервал every=")
+    if options["repeat_count"] > 1 and options["pin_seconds"] > options["repeat_interval"]:
+        raise ValueError("Закрепление pin= не может быть дольше интервала every=")
+    return options
+
+class Campaigns:
+    """Доставка рекламных кампаний по расписанию с равномерной скоростью и курсором в базе."""
+    def __init__(self, db: Database, bot: Bot, channel_id: int, audiences: Audiences):
+        self.db = db
+        self.bot = bot
+        self.channel_id = channel_id
+        self.audiences = audiences
+        # Порции рассылки идут отдельными задачами, чтобы не задерживать остальные задачи планировщика
+        self._deliveries: Dict[int, asyncio.Task] = {}
+
+    async def _send(self, chat_id: int, text: str, photo: Optional[str]):
+        """Отправляет рекламный пост в чат."""
+        if photo:
+            return await self.bot.send_photo(chat_id, photo, caption=text, parse_mode="HTML")
+        return await self.bot.send_message(chat_id, text, parse_mode="HTML")
+
+    async def _unpin_due(self, now: int):
+        """Открепляет посты, срок закрепления которых истёк."""
+        for campaign_id, message_id in self.db.get_due_unpins(now):
+            try:
+                await self.bot.unpin_chat_message(chat_id=self.channel_id, message_id=message_id)
+            except Exception as e:
+                logger.warning(f"Не удалось открепить пост {message_id} кампании {campaign_id}: {e}")
+            self.db.set_campaign_pin(campaign_id, None, None)
+
+    async def _post_to_channel(self, ad_id: int, text: str, photo: Optional[str]) -> int:
+        """Публикует пост кампании в канале и возвращает его ID."""
+        sent = await self._send(self.channel_id, text, photo)
+        self.db.update_ad_channel_message_id(ad_id, sent.message_id)
+        return sent.message_id
+
+    async def _pin(self, campaign_id: int, message_id: int, pin_seconds: int, now: int):
+        """Закрепляет пост кампании; ошибка не отменяет уже состоявшуюся публикацию."""
+        try:
+            await self.bot.pin_chat_message(chat_id=self.channel_id, message_id=message_id, disable_notification=True)
+            self.db.set_campaign_pin(campaign_id, message_id, now + pin_seconds)
+        except Exception as e:
+            logger.warning(f"Кампания {campaign_id}: пост {message_id} опубликован, но не закреплён: {e}")
+
+    def _finish_run(self, campaign_id: int, runs_done: int, repeat_count: int, run_started_at: int, repeat_interval: int):
+        """Завершает запуск кампании и планирует следующий повтор."""
+        more = runs_done + 1 < repeat_count
+        self.db.finish_campaign_run(campaign_id, run_started_at + repeat_interval if more else None)
+        logger.info(f"Кампания {campaign_id}: запуск {runs_done + 1}/{repeat_count} завершён")
+
+    async def _deliver_slice(self, campaign_id: int, target: str, run_total: int, spread_seconds: int,
+                             cursor: int, text: str, photo: Optional[str]) -> bool:
+        """Отправляет очередную порцию сегмента; True — запуск доставлен целиком."""
+        rate = CAMPAIGN_MAX_RATE if not spread_seconds else run_total / spread_seconds
+        rate = min(max(rate, CAMPAIGN_MIN_RATE), CAMPAIGN_MAX_RATE)
+        budget = max(math.ceil(rate * CAMPAIGN_TICK_SECONDS), 1)
+        user_ids = self.db.get_segment_users_page(None if target == "all" else target, cursor, budget)
+        sent = 0
+        # Курсор сохраняется и при RetryAfter, и при остановке бота посреди порции
+        try:
+            for user_id in user_ids:
+                try:
+                    await self._send(user_id, text, photo)
+                    sent += 1
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Кампания {campaign_id} приостановлена на {e.retry_after} с")
+                    return False
+                except Exception as e:
+                    if is_undeliverable_error(e):
+                        self.audiences.mark_undeliverable(user_id)
+                    logger.warning(f"Кампания {campaign_id}: не удалось отправить пользователю {user_id}: {e}")
+                cursor = user_id
+                await asyncio.sleep(1 / rate)
+        finally:
+            self.db.advance_campaign(campaign_id, cursor, sent)
+            self.audiences.flush()
+        return len(user_ids) < budget
+
+    async def _run_slice(self, campaign_id: int, target: str, run_total: int, spread_seconds: int, cursor: int,
+                         text: str, photo: Optional[str], runs_done: int, repeat_count: int,
+                         run_started_at: int, repeat_interval: int):
+        """Доставляет порцию кампании в фоне и завершает запуск, если сегмент пройден."""
+        try:
+            if await self._deliver_slice(campaign_id, target, run_total, spread_seconds, cursor, text, photo):
+                self._finish_run(campaign_id, runs_done, repeat_count, run_started_at, repeat_interval)
+        except Exception as e:
+            logger.error(f"Ошибка в кампании {campaign_id}: {e}")
+
+    async def stop(self, timeout: float = 0):
+        """Дожидается текущих порций рассылки не дольше timeout, затем прерывает их (курсор сохраняется)."""
+        tasks = list(self._deliveries.values())
+        if not tasks:
+            return
+        if timeout > 0:
+            await asyncio.wait(tasks, timeout=timeout)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def tick(self):
+        """Продвигает все активные кампании на один шаг в полосе массовых запросов."""
+        with api_priority(BULK):
+            await self._tick()
+
+    async def _tick(self):
+        """Один шаг всех активных кампаний."""
+        now = int(time.time())
+        await self._unpin_due(now)
+        for (campaign_id, ad_id, target, status, repeat_count, repeat_interval, spread_seconds, pin_seconds,
+             runs_done, run_started_at, run_total, cursor, text, photo) in self.db.get_active_campaigns(now):
+            try:
+                if text is None:
+                    logger.warning(f"Кампания {campaign_id}: рекламный пост #{ad_id} удалён, кампания отменена.")
+                    self.db.cancel_campaign(campaign_id)
+                    continue
+                if status == "scheduled":
+                    run_total = 1 if target == "channel" else self.audiences.count(target)
+                    if not self.db.start_campaign_run(campaign_id, now, run_total):
+                        continue
+                    run_started_at, cursor = now, -1
+                    logger.info(f"Кампания {campaign_id}: запуск {runs_done + 1}/{repeat_count}, получателей {run_total}")
+                if target == "channel":
+                    # Запуск закрывается сразу после публикации: сбой закрепления не должен приводить к повтору поста
+                    message_id = await self._post_to_channel(ad_id, text, photo)
+                    self._finish_run(campaign_id, runs_done, repeat_count, run_started_at, repeat_interval)
+                    if pin_seconds:
+                        await self._pin(campaign_id, message_id, pin_seconds, now)
+                elif campaign_id not in self._deliveries:
+                    task = asyncio.create_task(self._run_slice(
+                        campaign_id, target, run_total, spread_seconds, cursor, text, photo,
+                        runs_done, repeat_count, run_started_at, repeat_interval
+                    ))
+                    self._deliveries[campaign_id] = task
+                    task.add_done_callback(lambda _, cid=campaign_id: self._deliveries.pop(cid, None))
+            except Exception as e:
+                logger.error(f"Ошибка в кампании {campaign_id}: {e}")
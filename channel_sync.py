@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from database import Database
+from telegram_api import api_priority, BULK
+from utils import escape_html
+
+logger = logging.getLogger(__name__)
+
+# Сколько постов синхронизировать за запуск и пауза между запросами к каналу
+CHANNEL_SYNC_BATCH = 20
+CHANNEL_SYNC_PAUSE_SECONDS = 1.0
+CHANNEL_SYNC_ATTEMPTS = 3
+CHANNEL_SYNC_INTERVAL = 30
+CHANNEL_RECONCILE_INTERVAL = 24 * 3600
+# Ошибки, после которых пост уже в нужном состоянии
+ALREADY_SYNCED_ERRORS = ("message is not modified", "message to delete not found", "message to edit not found")
+
+def sold_caption(name: str, price: str, description: str, item_type: str) -> str:
+    """Зачёркнутый текст поста проданного объявления."""
+    type_label = "Товар" if item_type == "product" else "Услуга"
+    return (
+        f"<s>{'📦' if item_type == 'product' else '🛠'} <b>{type_label}: {escape_html(name)}</b>\n"
+        f"💸 Цена: {escape_html(price)}\n"
+        f"✏️ {escape_html(description)}</s>\n\n"
+        f"<b>✅ ПРОДАНО</b>"
+    )
+
+class ChannelSync:
+    """Приводит посты в канале к статусам объявлений по журналу channel_posts."""
+    def __init__(self, db: Database, bot: Bot, channel_id: int):
+        self.db = db
+        self.bot = bot
+        self.channel_id = channel_id
+        self._lock = asyncio.Lock()
+        self._kicked: Set[asyncio.Task] = set()
+
+    async def _apply(self, message_id: int, pinned: bool, desired: str, name: Optional[str], price: Optional[str],
+                     description: Optional[str], photo: Optional[str], item_type: Optional[str]):
+        """Применяет к посту нужное состояние."""
+        if pinned and desired != "live":
+            await self.bot.unpin_chat_message(chat_id=self.channel_id, message_id=message_id)
+        if desired == "deleted":
+            await self.bot.delete_message(chat_id=self.channel_id, message_id=message_id)
+        elif desired == "sold":
+            caption = sold_caption(name, price, description, item_type)
+            if photo:
+                await self.bot.edit_message_caption(
+                    chat_id=self.channel_id, message_id=message_id, caption=caption, parse_mode="HTML", reply_markup=None
+                )
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=self.channel_id, message_id=message_id, text=caption, parse_mode="HTML", reply_markup=None
+                )
+
+    async def sync(self) -> int:
+        """Синхронизирует очередную пачку разошедшихся постов, возвращает число применённых изменений."""
+        async with self._lock:
+            with api_priority(BULK):
+                return await self._sync_batch()
+
+    async def _sync_batch(self) -> int:
+        """Применяет изменения к одной пачке постов из журнала."""
+        applied = 0
+        for (product_id, message_id, state, pinned, desired,
+             name, price, description, photo, item_type) in self.db.get_dirty_channel_posts(CHANNEL_SYNC_BATCH):
+            if desired != state or (pinned and desired != "live"):
+                try:
+                    await self._apply(message_id, pinned, desired, name, price, description, photo, item_type)
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Синхронизация канала приостановлена на {e.retry_after} с")
+                    break
+                except TelegramBadRequest as e:
+                    if not any(text in str(e).lower() for text in ALREADY_SYNCED_ERRORS):
+                        logger.warning(f"Не удалось синхронизировать пост {message_id} объявления {product_id}: {e}")
+                        self.db.fail_channel_post(product_id, str(e), CHANNEL_SYNC_ATTEMPTS)
+                        continue
+                except Exception as e:
+                    logger.warning(f"Не удалось синхронизировать пост {message_id} объявления {product_id}: {e}")
+                    self.db.fail_channel_post(product_id, str(e), CHANNEL_SYNC_ATTEMPTS)
+                    continue
+                applied += 1
+                await asyncio.sleep(CHANNEL_SYNC_PAUSE_SECONDS)
+            self.db.finish_channel_post(product_id, desired)
+        if applied:
+            logger.info(f"Синхронизировано постов в канале: {applied}")
+        return applied
+
+    async def reconcile(self) -> int:
+        """Полная сверка журнала с объявлениями на случай расхождений."""
+        marked = await asyncio.to_thread(self.db.reconcile_channel_posts)
+        if marked:
+            logger.info(f"Сверка канала: на синхронизацию поставлено {marked} постов")
+            await self.sync()
+        return marked
+
+    def kick(self):
+        """Запускает синхронизацию сразу, не дожидаясь планировщика."""
+        task = asyncio.create_task(self.sync())
+        self._kicked.add(task)
+        task.add_done_callback(self._kicked.discard)
@@ -0,0 +1,369 @@
+"""Проверка планов запросов Database: все методы вызываются на большой тестовой базе,
+для каждого запроса выполняется EXPLAIN QUERY PLAN, неожиданный полный просмотр таблицы — ошибка.
+
+Запуск: python check_query_plans.py [-v]
+"""
+import inspect
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from itertools import islice
+
+from database import Database, TimedConnection, TimedCursor
+
+# Объём тестовой базы: планировщик выбирает план по статистике ANALYZE, поэтому таблицы должны быть большими
+SEED_USERS = 20_000
+SEED_PRODUCTS = 50_000
+SEED_ORDERS = 20_000
+
+# Маленькие служебные таблицы: их полный просмотр дешевле индекса
+SMALL_TABLES = {"admins", "settings", "scheduled_jobs", "audience_state", "ads", "ad_campaigns", "sqlite_master"}
+
+# Полные просмотры, которые метод делает намеренно: отчёты, пересборки, обслуживание и выгрузки
+EXPECTED_SCANS = {
+    # Миграции схемы выполняются один раз при обновлении
+    "_init_db": {"*"},
+    "compact": {"*"},
+    "reconcile_channel_posts": {"channel_posts"},
+    "rebuild_segment": {"products", "products_archive", "orders", "user_totals", "users"},
+    "get_stats": {"products", "users", "user_totals"},
+    "get_top_buyers": {"orders", "user_totals"},
+    "get_top_sellers": {"orders", "user_totals"},
+    # Рассылка всем пользователям
+    "get_all_users": {"users"},
+    "count_segment_users": {"users"},
+    # Первая страница выгрузки: просмотр по первичному ключу с LIMIT
+    "iter_table_rows": {"products", "orders", "users", "products_archive", "orders_archive"},
+    # Закрытые сделки — большая часть orders: пакет с LIMIT дешевле читать подряд
+    "archive_cold_rows": {"orders"},
+    # В moderation_claims только объявления, ожидающие модерации
+    "assign_moderator": {"moderation_claims"},
+    "expire_reviews_of": {"moderation_claims"},
+}
+
+# Значения аргументов по имени параметра; методы с особыми аргументами — в METHOD_ARGS
+ARG_VALUES = {
+    "product_id": 101,
+    "product_ids": [101, 102, 103],
+    "user_id": 1001,
+    "user_ids": [1001, 1002, 1003],
+    "seller_id": 1002,
+    "buyer_id": 1003,
+    "order_id": 11,
+    "admin_id": 1,
+    "admin_ids": [1, 2, 3],
+    "ad_id": 1,
+    "campaign_id": 1,
+    "limit": 50,
+    "days": 7,
+    "page": 2,
+    "segment": "buyers",
+    "status": "approved",
+    "name": "expire_listings",
+    "interval": 60,
+    "hold_ttl": 900,
+    "offer_ttl": 900,
+    "max_attempts": 5,
+    "error": "test",
+    "state": "live",
+    "user_type": "buyer",
+    "run_total": 100,
+    "sent": 10,
+    "cursor": 500,
+    "after": 500,
+    "message_id": 77,
+    "channel_message_id": 77,
+    "text": "Реклама",
+    "photo": None,
+    "target": "all",
+    "pinned": True,
+    "unpin_at": None,
+    "seen": [(1001, 0), (1002, 0)],
+    "data": {"name": "Велосипед", "description": "Горный, б/у", "price": "15 000", "contact": "@seller",
+             "type": "product", "photos": []},
+    "table": "products",
+}
+# Аргументы, зависящие от текущего времени
+TIME_ARGS = {
+    "now", "cutoff", "lease_until", "expires_at", "start_at", "next_run_at", "finished_at", "prev_refreshed_at", "prev_cutoff",
+}
+
+# Аргументы отдельных методов; список — метод вызывается с каждым набором
+METHOD_ARGS = {
+    "add_admin": {"user_id": 4},
+    "remove_admin": {"user_id": 4},
+    "add_segment_members": {"segment": "test"},
+    "update_product_status": {"product_id": 104, "status": "approved", "channel_message_id": 77},
+    "update_product_status_many": {"product_ids": [105, 106], "status": "rejected"},
+    "delete_product": {"product_id": 107},
+    "delete_products": {"product_ids": [108, 109]},
+    "merge_pending_product": {"product_id": 110},
+    "get_products": [{"item_type": "product"}, {"item_type": None}],
+    "get_products_page": [{"status": "approved"}, {"status": "pending", "cursor": 500, "backward": True}],
+    "get_active_orders_page": [{"cursor": None}, {"cursor": 500}],
+    "get_segment_users_page": {"segment": None},
+    "count_segment_users": {"segment": None},
+    "iter_segment_users": {"segment": None},
+    "rebuild_segment": {"segment": "service_sellers"},
+    "refresh_activity_segment": {"segment": "active_7"},
+    "get_product_photos": {"size": "full"},
+    "unban_user": {"user_id": 1001},
+    "update_order_message_id": {"seller_message_id": 78, "buyer_message_id": 79},
+}
+
+# Методы, работающие с файлом базы или PRAGMA, а не с запросами
+SKIP_METHODS = {"backup", "checkpoint", "get_table_columns"}
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"WHERE", "SET", "ON", "LEFT", "JOIN", "INNER", "ORDER", "GROUP", "LIMIT", "VALUES", "SELECT", "USING", "UNION", "WITH"}
+
+def seed(db_path: str):
+    """Заполняет тестовую базу данными, похожими на рабочие, и собирает статистику."""
+    rnd = random.Random(42)
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO users (user_id, can_sell, first_seen, last_seen, deliverable) VALUES (?, 1, ?, ?, 1)",
+        ((1000 + i, now - rnd.randint(0, 400 * 86400), now - rnd.randint(0, 90 * 86400)) for i in range(SEED_USERS))
+    )
+    statuses = ["approved"] * 6 + ["sold"] * 2 + ["expired", "rejected", "pending"]
+    products = []
+    for i in range(1, SEED_PRODUCTS + 1):
+        status = rnd.choice(statuses)
+        products.append((
+            i, 1000 + rnd.randrange(SEED_USERS), f"Товар {i}", f"Описание {i}", str(rnd.randint(100, 100_000)),
+            "@seller", f"photo{i}", status, rnd.choice(("product", "service")),
+            rnd.randint(1, 10**6) if status == "approved" else None,
+            now - rnd.randint(0, 60 * 86400) if status != "pending" else None,
+            now - rnd.randint(0, 30 * 86400) if status in ("sold", "expired") else None,
+            f"{i:016x}", f"{i % 20_000:016x}", f"uniq{i}",
+        ))
+    cur.executemany(
+        """
+        INSERT INTO products (id, seller_id, name, description, price, contact, photo, status, type,
+                              channel_message_id, approved_at, closed_at, content_hash, name_hash, photo_unique_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        products
+    )
+    cur.executemany(
+        "INSERT INTO product_photos (product_id, position, size, file_id, file_unique_id, width, height) VALUES (?, 0, ?, ?, ?, 800, 600)",
+        ((p[0], size, f"file{p[0]}{size}", f"uniq{p[0]}") for p in products for size in ("full", "thumb"))
+    )
+    order_statuses = ["completed"] * 6 + ["canceled"] * 2 + ["in_progress"]
+    cur.executemany(
+        """
+        INSERT INTO orders (id, product_id, seller_id, buyer_id, status, seller_message_id, buyer_message_id, created_at, closed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (i, rnd.randint(1, SEED_PRODUCTS), 1000 + rnd.randrange(SEED_USERS), 1000 + rnd.randrange(SEED_USERS),
+             status, rnd.randint(1, 10**6), rnd.randint(1, 10**6), now - rnd.randint(0, 60 * 86400),
+             None if status == "in_progress" else now - rnd.randint(0, 30 * 86400))
+            for i, status in ((i, rnd.choice(order_statuses)) for i in range(1, SEED_ORDERS + 1))
+        )
+    )
+    cur.execute(
+        """
+        INSERT INTO user_totals (user_id, products, products_sold, sold, bought)
+        SELECT user_id, abs(random()) % 10, abs(random()) % 5, abs(random()) % 5, abs(random()) % 5 FROM users
+        """
+    )
+    cur.execute("INSERT INTO audience_members (segment, user_id) SELECT 'buyers', user_id FROM users WHERE user_id % 3 = 0")
+    cur.execute(
+        """
+        INSERT INTO channel_posts (product_id, message_id, state, dirty, synced_at)
+        SELECT id, channel_message_id, 'live', id % 50 = 0, approved_at FROM products WHERE status='approved'
+        """
+    )
+    cur.execute(
+        "INSERT OR IGNORE INTO product_holds (product_id, buyer_id, order_id, expires_at) SELECT product_id, buyer_id, id, created_at + 900 FROM orders WHERE status='in_progress'"
+    )
+    cur.execute(
+        "INSERT OR IGNORE INTO product_waitlist (product_id, buyer_id, created_at) SELECT product_id, seller_id, created_at FROM orders WHERE id % 4 = 0"
+    )
+    cur.execute(
+        "INSERT INTO moderation_claims (product_id, admin_id, lease_until) SELECT id, 1 + id % 3, ? FROM products WHERE status='pending'",
+        (now,)
+    )
+    cur.execute("INSERT INTO moderation_copies (product_id, admin_id, message_id) SELECT product_id, admin_id, product_id FROM moderation_claims")
+    cur.execute(
+        """
+        INSERT INTO products_archive SELECT id + 1000000, seller_id, name, description, price, contact, photo, 'sold', type,
+                                            channel_message_id, approved_at, closed_at FROM products WHERE id % 5 = 0
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO orders_archive SELECT id + 1000000, product_id, seller_id, buyer_id, 'completed', seller_message_id,
+                                          buyer_message_id, 1, 1, created_at, closed_at FROM orders WHERE id % 5 = 0
+        """
+    )
+    cur.executemany("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", ((1,), (2,), (3,)))
+    cur.execute("INSERT INTO ads (id, text) VALUES (1, 'Реклама')")
+    cur.execute("INSERT INTO ad_campaigns (id, ad_id, target, next_run_at) VALUES (1, 1, 'all', ?)", (now,))
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.close()
+
+class PlanRecorder:
+    """Поставщик соединений, который перед каждым запросом сохраняет его план."""
+    def __init__(self):
+        self.method = None
+        self.plans = []
+        self._conn = None
+        recorder = self
+
+        class RecordingCursor(TimedCursor):
+            def execute(self, sql, parameters=()):
+                recorder.explain(self.connection, sql, parameters)
+                return super().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                rows = list(seq_of_parameters)
+                if rows:
+                    recorder.explain(self.connection, sql, rows[0])
+                return super().executemany(sql, rows)
+
+        class RecordingConnection(TimedConnection):
+            def cursor(self, factory=RecordingCursor):
+                return super().cursor(factory)
+
+        self._factory = RecordingConnection
+
+    def __call__(self, db_path: str) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(db_path, factory=self._factory)
+        return self._conn
+
+    def explain(self, conn: sqlite3.Connection, sql: str, parameters):
+        """Сохраняет план запроса; служебные команды и DDL пропускаются."""
+        keyword = sql.lstrip().split(None, 1)[0].upper()
+        if keyword not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE"):
+            return
+        try:
+            details = [row[3] for row in sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        except sqlite3.Error as e:
+            details = [f"ERROR {e}"]
+        self.plans.append((self.method, " ".join(sql.split()), details))
+
+def call_args(name: str, method, now: int) -> list:
+    """Подбирает наборы аргументов метода по именам параметров."""
+    variants = METHOD_ARGS.get(name, {})
+    if isinstance(variants, dict):
+        variants = [variants]
+    calls = []
+    for overrides in variants:
+        kwargs = {}
+        for param in inspect.signature(method).parameters.values():
+            if param.name in overrides:
+                kwargs[param.name] = overrides[param.name]
+            elif param.default is not inspect.Parameter.empty:
+                continue
+            elif param.name in TIME_ARGS:
+                kwargs[param.name] = now - 7 * 86400 if "cutoff" in param.name else now
+            elif param.name in ARG_VALUES:
+                kwargs[param.name] = ARG_VALUES[param.name]
+            else:
+                raise KeyError(param.name)
+        calls.append(kwargs)
+    return calls
+
+def table_aliases(sql: str) -> dict:
+    """Соответствие псевдонимов таблиц именам таблиц в запросе."""
+    aliases = {}
+    for table, alias in _TABLE_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _NOT_ALIASES:
+            aliases[alias] = table
+    return aliases
+
+def unexpected_scans(method: str, sql: str, details, partial_indexes: set) -> list:
+    """Строки плана с полным просмотром таблицы или временным индексом, не объяснённые списками исключений."""
+    expected = EXPECTED_SCANS.get(method, set())
+    if "*" in expected:
+        return []
+    aliases = table_aliases(sql)
+    found = []
+    for detail in details:
+        if detail.startswith("ERROR") or "AUTOMATIC" in detail:
+            found.append(detail)
+            continue
+        match = _SCAN_RE.match(detail)
+        if not match:
+            continue
+        name, index = match.groups()
+        # Просмотр подзапроса, CTE или частичного индекса ограничен размером выборки
+        if name not in aliases or index in partial_indexes:
+            continue
+        table = aliases[name]
+        if table in SMALL_TABLES or table in expected:
+            continue
+        found.append(detail)
+    return found
+
+def main() -> int:
+    verbose = "-v" in sys.argv
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "plans.sqlite3")
+        recorder = PlanRecorder()
+        recorder.method = "_init_db"
+        db = Database(db_path, connect=recorder)
+        print("Заполнение тестовой базы...")
+        seed(db_path)
+        now = int(time.time())
+        skipped = []
+        checked = []
+        for name, method in inspect.getmembers(db, inspect.ismethod):
+            if name.startswith("_") or name in SKIP_METHODS:
+                continue
+            try:
+                calls = call_args(name, method, now)
+            except KeyError as e:
+                skipped.append(f"{name}: нет значения для параметра {e}")
+                continue
+            recorder.method = name
+            checked.append(name)
+            for kwargs in calls:
+                try:
+                    result = method(**kwargs)
+                    if inspect.isgenerator(result):
+                        list(islice(result, 3000))
+                except Exception as e:
+                    skipped.append(f"{name}: {type(e).__name__}: {e}")
+        partial_indexes = {
+            row[0] for row in sqlite3.connect(db_path).execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '%WHERE%'"
+            )
+        }
+
+    failures = 0
+    covered = set()
+    for method, sql, details in recorder.plans:
+        covered.add(method)
+        bad = unexpected_scans(method, sql, details, partial_indexes)
+        if bad:
+            failures += 1
+            print(f"❌ {method}: {sql}")
+            for detail in bad:
+                print(f"     {detail}")
+        elif verbose:
+            print(f"✅ {method}: {sql}\n     " + "\n     ".join(details))
+    # Метод без единого плана выпал из проверки (ошибка, новый параметр или запрос не дошёл до базы)
+    skipped.extend(f"{name}: ни одного проверенного запроса" for name in checked if name not in covered)
+    for note in skipped:
+        print(f"❌ {note}")
+    print(
+        f"Методов с запросами: {len(covered)}, запросов: {len(recorder.plans)}, "
+        f"с неожиданным SCAN: {failures}, не проверено: {len(skipped)}"
+    )
+    return 1 if failures or skipped else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
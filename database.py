@@ -1,23 +1,175 @@
+import logging
+import random
 import sqlite3
-from typing import Optional, List, Tuple
+import threading
+import time
+from contextlib import closing
+from typing import Callable, Dict, Optional, List, Sequence, Tuple, Iterator, Iterable
+
+from dedup import data_fingerprint, listing_fingerprint
+from models import Order, Product, ORDER_COLUMNS, PRODUCT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы в PRAGMA user_version; увеличивается при каждом изменении DDL в _init_db
+SCHEMA_VERSION = 6
+
+# Запросы, по которым пересобираются сегменты аудитории для рассылок
+SEGMENT_QUERIES = {
+    "buyers": """
+        SELECT buyer_id AS user_id FROM orders WHERE status='completed'
+        UNION SELECT user_id FROM user_totals WHERE bought > 0
+    """,
+    "sellers": """
+        SELECT seller_id AS user_id FROM orders WHERE status='completed'
+        UNION SELECT user_id FROM user_totals WHERE sold > 0
+    """,
+    "service_sellers": """
+        SELECT seller_id AS user_id FROM products WHERE type='service' AND status IN ('approved', 'sold', 'expired')
+        UNION SELECT seller_id FROM products_archive WHERE type='service' AND status IN ('sold', 'expired')
+    """,
+}
+
+# Таблицы, доступные для выгрузки, и их ключ для постраничного чтения
+EXPORT_TABLES = {
+    "products": "id",
+    "orders": "id",
+    "users": "user_id",
+    "products_archive": "id",
+    "orders_archive": "id",
+}
+
+# Колонки, переносимые в архивные таблицы
+ARCHIVE_PRODUCT_COLUMNS = (
+    "id, seller_id, name, description, price, contact, photo, status, type, channel_message_id, approved_at, closed_at"
+)
+ARCHIVE_ORDER_COLUMNS = (
+    "id, product_id, seller_id, buyer_id, status, seller_message_id, buyer_message_id, "
+    "seller_confirmed, buyer_confirmed, created_at, closed_at"
+)
+
+# Служебные команды транзакций не считаются запросами
+_TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+# Размер кэша подготовленных запросов соединения (по умолчанию в sqlite3 — 128)
+CACHED_STATEMENTS = 512
+# Сколько ID подставлять в один IN (...) в пакетных методах
+IN_BATCH_SIZE = 500
+
+# Запросы дольше порога пишутся в лог вместе с параметрами
+SLOW_QUERY_MS = 100.0
+# Сколько символов параметров запроса выводить в лог
+SLOW_QUERY_PARAMS_LENGTH = 200
+
+def _chunks(ids: Sequence[int], size: int = IN_BATCH_SIZE) -> Iterator[Sequence[int]]:
+    """Делит список ID на части для IN (...)."""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _log_slow_query(sql: str, params_text: str, elapsed_ms: float):
+    """Пишет медленный запрос в лог одной строкой."""
+    if len(params_text) > SLOW_QUERY_PARAMS_LENGTH:
+        params_text = params_text[:SLOW_QUERY_PARAMS_LENGTH] + "..."
+    logger.warning(f"Медленный запрос {elapsed_ms:.1f} мс: {' '.join(sql.split())} params={params_text}")
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий execute/executemany; для SELECT учитывается выполнение до первой строки."""
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= self.connection.slow_query_ms:
+                _log_slow_query(sql, repr(parameters), elapsed_ms)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= self.connection.slow_query_ms:
+                _log_slow_query(sql, f"<executemany, изменено строк: {self.rowcount}>", elapsed_ms)
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого пишут медленные запросы в лог."""
+    slow_query_ms = SLOW_QUERY_MS
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в sqlite3 создаёт курсор в обход cursor(), поэтому переопределяется отдельно
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class ThreadConnections:
+    """Поставщик долгоживущих соединений: по одному на поток и файл базы, с большим кэшем запросов."""
+    def __init__(self, cached_statements: int = CACHED_STATEMENTS, slow_query_ms: float = SLOW_QUERY_MS):
+        self.cached_statements = cached_statements
+        self.slow_query_ms = slow_query_ms
+        self._local = threading.local()
+
+    def __call__(self, db_path: str) -> sqlite3.Connection:
+        connections: Dict[str, sqlite3.Connection] = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(db_path)
+        if conn is None:
+            conn = connections[db_path] = sqlite3.connect(
+                db_path, cached_statements=self.cached_statements, factory=TimedConnection
+            )
+            conn.slow_query_ms = self.slow_query_ms
+        return conn
 
 class Database:
-    def __init__(self, db_path: str):
-        """Инициализация базы данных с указанным путем к файлу SQLite."""
+    def __init__(self, db_path: str, connect: Optional[Callable[[str], sqlite3.Connection]] = None):
+        """Инициализация базы данных с указанным путем к файлу SQLite и поставщиком соединений."""
         self.db_path = db_path
+        # Все запросы бота идут через _connect: поставщик можно заменить (пул, общее соединение, тесты)
+        self.connect = connect or ThreadConnections()
+        # Счётчик выполненных SQL-запросов для бюджетов запросов на хендлер (executemany — по строке на запрос)
+        self.query_count = 0
+        self.schema_upgraded = False
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение с базой от поставщика, с подсчётом выполненных запросов."""
+        conn = self.connect(self.db_path)
+        conn.set_trace_callback(self._count_query)
+        return conn
+
+    def _count_query(self, statement: str):
+        """Учитывает выполненный запрос (вызывается SQLite для каждого оператора)."""
+        if not statement.lstrip().upper().startswith(_TRANSACTION_STATEMENTS):
+            self.query_count += 1
+
     def _init_db(self):
-        """Инициализация структуры базы данных."""
+        """Инициализация структуры базы данных; пропускается, если версия схемы уже актуальна."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
+                cur.execute("PRAGMA user_version")
+                if cur.fetchone()[0] == SCHEMA_VERSION:
+                    return
+                self.schema_upgraded = True
+                # WAL позволяет нескольким процессам бота читать базу во время записи
+                cur.execute("PRAGMA journal_mode=WAL")
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS users (
                         user_id INTEGER PRIMARY KEY,
-                        can_sell INTEGER DEFAULT 1
+                        can_sell INTEGER DEFAULT 1,
+                        first_seen INTEGER,
+                        last_seen INTEGER,
+                        deliverable INTEGER DEFAULT 1
                     )
                 """)
+                self._add_missing_columns(cur, "users", {
+                    "first_seen": "INTEGER", "last_seen": "INTEGER", "deliverable": "INTEGER DEFAULT 1"
+                })
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen)")
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS products (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,6 +185,22 @@ class Database:
                         FOREIGN KEY(seller_id) REFERENCES users(user_id)
                     )
                 """)
+                if "approved_at" in self._add_missing_columns(cur, "products", {"approved_at": "INTEGER", "closed_at": "INTEGER"}):
+                    # Уже опубликованные объявления отсчитывают срок жизни с момента миграции
+                    cur.execute("UPDATE products SET approved_at=? WHERE status='approved'", (int(time.time()),))
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_products_status_approved ON products(status, approved_at)")
+                # Лента, страницы админки и очередь модерации: строки статуса сразу в порядке id, без сортировки
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_products_status ON products(status)")
+                # Отпечатки объявления для поиска повторных подач (см. dedup.py)
+                fingerprint_added = "content_hash" in self._add_missing_columns(cur, "products", {
+                    "content_hash": "TEXT", "name_hash": "TEXT", "photo_unique_id": "TEXT"
+                })
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_products_seller_content ON products(seller_id, content_hash)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_products_seller_name ON products(seller_id, name_hash)")
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_products_photo_unique ON products(photo_unique_id) "
+                    "WHERE photo_unique_id IS NOT NULL"
+                )
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS orders (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,6 +217,12 @@ class Database:
                         FOREIGN KEY(buyer_id) REFERENCES users(user_id)
                     )
                 """)
+                self._add_missing_columns(cur, "orders", {"created_at": "INTEGER", "closed_at": "INTEGER"})
+                # Сделки, начатые до появления created_at, отсчитывают простой с момента миграции
+                cur.execute(
+                    "UPDATE orders SET created_at=? WHERE status='in_progress' AND created_at IS NULL",
+                    (int(time.time()),)
+                )
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS ads (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -57,73 +231,452 @@ class Database:
                         channel_message_id INTEGER
                     )
                 """)
+                # Рекламные кампании: расписание, повторы и курсор доставки текущего запуска
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS ad_campaigns (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ad_id INTEGER,
+                        target TEXT,
+                        status TEXT DEFAULT 'scheduled',
+                        next_run_at INTEGER,
+                        repeat_count INTEGER DEFAULT 1,
+                        repeat_interval INTEGER DEFAULT 0,
+                        spread_seconds INTEGER DEFAULT 0,
+                        pin_seconds INTEGER DEFAULT 0,
+                        runs_done INTEGER DEFAULT 0,
+                        run_started_at INTEGER,
+                        run_total INTEGER,
+                        cursor INTEGER,
+                        sent INTEGER DEFAULT 0,
+                        pinned_message_id INTEGER,
+                        unpin_at INTEGER,
+                        FOREIGN KEY(ad_id) REFERENCES ads(id)
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_ad_campaigns_status ON ad_campaigns(status, next_run_at)")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS product_photos (
+                        product_id INTEGER,
+                        position INTEGER,
+                        size TEXT,
+                        file_id TEXT,
+                        file_unique_id TEXT,
+                        width INTEGER,
+                        height INTEGER,
+                        PRIMARY KEY(product_id, size, position),
+                        FOREIGN KEY(product_id) REFERENCES products(id)
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS admins (
+                        user_id INTEGER PRIMARY KEY,
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS settings (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS audience_members (
+                        segment TEXT,
+                        user_id INTEGER,
+                        PRIMARY KEY(segment, user_id)
+                    ) WITHOUT ROWID
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS audience_state (
+                        segment TEXT PRIMARY KEY,
+                        refreshed_at INTEGER,
+                        cutoff INTEGER
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS product_holds (
+                        product_id INTEGER PRIMARY KEY,
+                        buyer_id INTEGER,
+                        order_id INTEGER,
+                        expires_at INTEGER
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_product_holds_expires ON product_holds(expires_at)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_product_holds_order ON product_holds(order_id)")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS product_waitlist (
+                        product_id INTEGER,
+                        buyer_id INTEGER,
+                        created_at INTEGER,
+                        PRIMARY KEY(product_id, buyer_id)
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_product_waitlist_queue ON product_waitlist(product_id, created_at)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_product_status ON orders(product_id, status)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_seller_status ON orders(seller_id, status)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_buyer_status ON orders(buyer_id, status)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+                # Архив закрытых объявлений и сделок: горячие таблицы остаются маленькими
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS products_archive (
+                        id INTEGER PRIMARY KEY,
+                        seller_id INTEGER,
+                        name TEXT,
+                        description TEXT,
+                        price TEXT,
+                        contact TEXT,
+                        photo TEXT,
+                        status TEXT,
+                        type TEXT,
+                        channel_message_id INTEGER,
+                        approved_at INTEGER,
+                        closed_at INTEGER
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_products_archive_seller ON products_archive(seller_id)")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS orders_archive (
+                        id INTEGER PRIMARY KEY,
+                        product_id INTEGER,
+                        seller_id INTEGER,
+                        buyer_id INTEGER,
+                        status TEXT,
+                        seller_message_id INTEGER,
+                        buyer_message_id INTEGER,
+                        seller_confirmed INTEGER,
+                        buyer_confirmed INTEGER,
+                        created_at INTEGER,
+                        closed_at INTEGER
+                    )
+                """)
+                # Итоги по архиву на пользователя: /user и топы не читают архивные таблицы
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS user_totals (
+                        user_id INTEGER PRIMARY KEY,
+                        products INTEGER DEFAULT 0,
+                        products_sold INTEGER DEFAULT 0,
+                        sold INTEGER DEFAULT 0,
+                        bought INTEGER DEFAULT 0
+                    )
+                """)
+                # Отклонённые объявления в архиве: автомодерация учитывает их и после переноса
+                if self._add_missing_columns(cur, "user_totals", {"products_rejected": "INTEGER DEFAULT 0"}):
+                    cur.execute(
+                        """
+                        UPDATE user_totals SET products_rejected = (
+                            SELECT COUNT(*) FROM products_archive a WHERE a.seller_id = user_totals.user_id AND a.status='rejected'
+                        )
+                        """
+                    )
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                        name TEXT PRIMARY KEY,
+                        next_run_at INTEGER,
+                        last_run_at INTEGER,
+                        last_error TEXT
+                    )
+                """)
+                # Назначение объявлений на модерации одному администратору с арендой и копии карточек у админов
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS moderation_claims (
+                        product_id INTEGER PRIMARY KEY,
+                        admin_id INTEGER,
+                        lease_until INTEGER,
+                        decided_by INTEGER
+                    )
+                """)
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_moderation_claims_open ON moderation_claims(lease_until) "
+                    "WHERE decided_by IS NULL"
+                )
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS moderation_copies (
+                        product_id INTEGER,
+                        admin_id INTEGER,
+                        message_id INTEGER,
+                        PRIMARY KEY(product_id, admin_id)
+                    )
+                """)
+                cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='channel_posts'")
+                journal_exists = cur.fetchone() is not None
+                # Журнал постов в канале: что опубликовано и нужно ли привести пост к статусу объявления
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS channel_posts (
+                        product_id INTEGER PRIMARY KEY,
+                        message_id INTEGER,
+                        state TEXT,
+                        pinned INTEGER DEFAULT 0,
+                        dirty INTEGER DEFAULT 0,
+                        attempts INTEGER DEFAULT 0,
+                        last_error TEXT,
+                        synced_at INTEGER
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_posts_dirty ON channel_posts(product_id) WHERE dirty=1")
+                if not journal_exists:
+                    # Опубликованные ранее объявления считаются актуальными, кроме снятых с публикации
+                    cur.execute(
+                        """
+                        INSERT INTO channel_posts (product_id, message_id, state, dirty)
+                        SELECT id, channel_message_id,
+                            CASE WHEN status='sold' THEN 'sold' ELSE 'live' END,
+                            status NOT IN ('approved', 'sold')
+                        FROM products WHERE channel_message_id IS NOT NULL
+                        """
+                    )
+                if fingerprint_added:
+                    self._backfill_fingerprints(cur)
+                cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Ошибка при инициализации базы данных: {e}")
             raise
 
-    def can_user_sell(self, user_id: int) -> bool:
-        """Проверяет, может ли пользователь продавать."""
+    def _backfill_fingerprints(self, cur: sqlite3.Cursor):
+        """Заполняет отпечатки у объявлений, созданных до появления поиска повторов."""
+        cur.execute(
+            """
+            SELECT p.id, p.name, p.description, p.price, ph.file_unique_id
+            FROM products p
+            LEFT JOIN product_photos ph ON ph.product_id=p.id AND ph.size='full' AND ph.position=0
+            """
+        )
+        rows = [
+            (fp["content_hash"], fp["name_hash"], fp["photo_unique_id"], product_id)
+            for product_id, name, description, price, photo_unique_id in cur.fetchall()
+            for fp in (listing_fingerprint(name, description, price, photo_unique_id),)
+        ]
+        cur.executemany("UPDATE products SET content_hash=?, name_hash=?, photo_unique_id=? WHERE id=?", rows)
+
+    def backup(self, path: str):
+        """Сохраняет согласованную копию базы через backup API SQLite (с учётом WAL)."""
+        try:
+            # Контекст соединения sqlite3 только фиксирует транзакцию; файл копии закрывает closing
+            with self._connect() as conn, closing(sqlite3.connect(path)) as target:
+                conn.backup(target)
+        except sqlite3.Error as e:
+            print(f"Ошибка в backup для path={path}: {e}")
+            raise
+
+    def checkpoint(self):
+        """Переносит WAL в основной файл базы и обрезает его (перед остановкой бота)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"Ошибка в checkpoint: {e}")
+
+    def _add_missing_columns(self, cur: sqlite3.Cursor, table: str, columns: dict) -> List[str]:
+        """Добавляет в существующую таблицу колонки, появившиеся в новых версиях схемы, и возвращает добавленные."""
+        cur.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cur.fetchall()}
+        added = []
+        for name, decl in columns.items():
+            if name not in existing:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+                added.append(name)
+        return added
+
+    def get_can_sell(self, user_id: int) -> Optional[bool]:
+        """Проверяет, может ли пользователь продавать. None — пользователь ещё не зарегистрирован."""
+        try:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT can_sell FROM users WHERE user_id=?", (user_id,))
                 row = cur.fetchone()
-                if row is None:
-                    cur.execute("INSERT INTO users (user_id, can_sell) VALUES (?, ?)", (user_id, 1))
-                    conn.commit()
-                    return True
-                return row[0] == 1
+                return None if row is None else row[0] == 1
         except sqlite3.Error as e:
-            print(f"Ошибка в can_user_sell для user_id={user_id}: {e}")
-            return False
+            print(f"Ошибка в get_can_sell для user_id={user_id}: {e}")
+            raise
+
+    def touch_users(self, seen: List[Tuple[int, int]]):
+        """Регистрирует пользователей и обновляет время последней активности одной пачкой."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.executemany(
+                    """
+                    INSERT INTO users (user_id, can_sell, first_seen, last_seen) VALUES (?, 1, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_seen=MAX(excluded.last_seen, COALESCE(users.last_seen, 0)),
+                        first_seen=COALESCE(users.first_seen, excluded.first_seen),
+                        deliverable=1
+                    """,
+                    [(user_id, ts, ts) for user_id, ts in seen]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в touch_users для {len(seen)} пользователей: {e}")
+            raise
 
     def add_product(self, seller_id: int, data: dict) -> int:
         """Добавляет новый товар или услугу в базу данных."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
+                fp = data_fingerprint(data)
                 cur.execute(
                     """
-                    INSERT INTO products (seller_id, name, description, price, contact, photo, status, type)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO products (
+                        seller_id, name, description, price, contact, photo, status, type,
+                        content_hash, name_hash, photo_unique_id
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """,
                     (
                         seller_id, data["name"], data["description"], data["price"],
-                        data["contact"], data.get("photo"), "pending", data["type"]
+                        data["contact"], data.get("photo"), "pending", data["type"],
+                        fp["content_hash"], fp["name_hash"], fp["photo_unique_id"]
                     )
                 )
                 product_id = cur.lastrowid
+                self._insert_product_photos(cur, product_id, data.get("photos") or [])
                 conn.commit()
                 return product_id
         except sqlite3.Error as e:
             print(f"Ошибка при добавлении продукта для seller_id={seller_id}: {e}")
             raise
 
-    def get_product(self, product_id: int) -> Optional[Tuple[str, str, str, Optional[str], str]]:
-        """Получает данные о товаре/услуге по ID для отображения покупателям."""
+    def find_duplicate(self, seller_id: int, data: dict) -> Optional[Tuple[int, str, str]]:
+        """Ищет по индексам действующее объявление, повторяющее новое: (id, статус, вид совпадения)."""
+        # content — тот же продавец, текст и цена; photo — то же фото у любого продавца; name — то же название у продавца
+        fp = data_fingerprint(data)
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT id, status, match FROM (
+                        SELECT id, status, 'content' AS match, 0 AS priority FROM products
+                        WHERE seller_id=? AND content_hash=? AND status IN ('pending', 'approved')
+                        UNION ALL
+                        SELECT id, status, 'photo', 1 FROM products
+                        WHERE photo_unique_id=? AND status IN ('pending', 'approved')
+                        UNION ALL
+                        SELECT id, status, 'name', 2 FROM products
+                        WHERE seller_id=? AND name_hash=? AND status IN ('pending', 'approved')
+                    )
+                    ORDER BY priority, id DESC LIMIT 1
+                    """,
+                    (seller_id, fp["content_hash"], fp["photo_unique_id"], seller_id, fp["name_hash"])
+                )
+                return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в find_duplicate для seller_id={seller_id}: {e}")
+            return None
+
+    def merge_pending_product(self, product_id: int, data: dict) -> bool:
+        """Обновляет контакт и фото объявления на модерации повторной подачей того же текста."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                fp = data_fingerprint(data)
+                cur.execute(
+                    """
+                    UPDATE products SET contact=?, photo=COALESCE(?, photo), photo_unique_id=COALESCE(?, photo_unique_id)
+                    WHERE id=? AND status='pending'
+                    """,
+                    (data["contact"], data.get("photo"), fp["photo_unique_id"], product_id)
+                )
+                if not cur.rowcount:
+                    return False
+                if data.get("photos"):
+                    cur.execute("DELETE FROM product_photos WHERE product_id=?", (product_id,))
+                    self._insert_product_photos(cur, product_id, data["photos"])
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Ошибка в merge_pending_product для product_id={product_id}: {e}")
+            return False
+
+    def _insert_product_photos(self, cur: sqlite3.Cursor, product_id: int, photos: List[dict]):
+        """Сохраняет file_id всех размеров фотографий объявления."""
+        cur.executemany(
+            """
+            INSERT OR REPLACE INTO product_photos (product_id, position, size, file_id, file_unique_id, width, height)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (product_id, position, size, item["file_id"], item.get("file_unique_id"), item.get("width"), item.get("height"))
+                for position, sizes in enumerate(photos)
+                for size, item in sizes.items()
+            ]
+        )
+
+    def get_product_photos(self, product_id: int, size: str = "full") -> List[str]:
+        """Получает file_id фотографий объявления нужного размера в порядке альбома."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT file_id FROM product_photos WHERE product_id=? AND size=? ORDER BY position",
+                    (product_id, size)
+                )
+                return [row[0] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_product_photos для product_id={product_id}: {e}")
+            return []
+
+    def get_product_preview(self, product_id: int) -> Tuple[Optional[str], int]:
+        """Получает file_id миниатюры первой фотографии и общее количество фотографий."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
-                    "SELECT name, price, description, photo, type FROM products WHERE id=? AND status='approved'",
-                    (product_id,)
+                    """
+                    SELECT
+                        (SELECT file_id FROM product_photos WHERE product_id=? AND size='thumb' AND position=0),
+                        (SELECT COUNT(*) FROM product_photos WHERE product_id=? AND size='full')
+                    """,
+                    (product_id, product_id)
                 )
+                thumb, count = cur.fetchone()
+                return thumb, count
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_product_preview для product_id={product_id}: {e}")
+            return None, 0
+
+    def get_product(self, product_id: int) -> Optional[Product]:
+        """Получает одобренный товар/услугу по ID для отображения покупателям."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = Product.from_row
+                cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=? AND status='approved'", (product_id,))
                 return cur.fetchone()
         except sqlite3.Error as e:
             print(f"Ошибка в get_product для product_id={product_id}: {e}")
             return None
 
-    def get_product_any_status(self, product_id: int) -> Optional[Tuple[str, str, str, Optional[str], str]]:
-        """Получает данные о товаре/услуге по ID независимо от статуса."""
+    def get_seller_history(self, seller_id: int) -> Tuple[int, int]:
+        """История продавца для автомодерации: (одобренные, включая проданные в архиве; отклонённые, включая архив)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
-                    "SELECT name, price, description, photo, type FROM products WHERE id=?",
-                    (product_id,)
+                    """
+                    SELECT
+                        COUNT(*) FILTER (WHERE status IN ('approved', 'sold', 'expired'))
+                            + COALESCE((SELECT products_sold FROM user_totals WHERE user_id=?), 0),
+                        COUNT(*) FILTER (WHERE status='rejected')
+                            + COALESCE((SELECT products_rejected FROM user_totals WHERE user_id=?), 0)
+                    FROM products WHERE seller_id=?
+                    """,
+                    (seller_id, seller_id, seller_id)
                 )
                 return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_seller_history для seller_id={seller_id}: {e}")
+            return 0, 0
+
+    def get_product_any_status(self, product_id: int) -> Optional[Product]:
+        """Получает товар/услугу по ID независимо от статуса."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = Product.from_row
+                cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=?", (product_id,))
+                return cur.fetchone()
         except sqlite3.Error as e:
             print(f"Ошибка в get_product_any_status для product_id={product_id}: {e}")
             return None
@@ -131,7 +684,7 @@ class Database:
     def get_seller_id(self, product_id: int) -> Optional[int]:
         """Получает ID продавца по ID продукта."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT seller_id FROM products WHERE id=?", (product_id,))
                 row = cur.fetchone()
@@ -142,170 +695,556 @@ class Database:
 
     def update_product_status(self, product_id: int, status: str, channel_message_id: Optional[int] = None):
         """Обновляет статус продукта и, при необходимости, ID сообщения в канале."""
+        if not channel_message_id:
+            self.update_product_status_many([product_id], status)
+            return
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                if channel_message_id:
-                    cur.execute(
-                        "UPDATE products SET status=?, channel_message_id=? WHERE id=?",
-                        (status, channel_message_id, product_id)
-                    )
-                else:
-                    cur.execute("UPDATE products SET status=? WHERE id=?", (status, product_id))
+                now = int(time.time())
+                approved_at = now if status == "approved" else None
+                closed_at = now if status in ("sold", "rejected", "expired") else None
+                cur.execute(
+                    """
+                    UPDATE products SET status=?, channel_message_id=?,
+                        approved_at=COALESCE(?, approved_at), closed_at=?
+                    WHERE id=?
+                    """,
+                    (status, channel_message_id, approved_at, closed_at, product_id)
+                )
+                cur.execute(
+                    """
+                    INSERT INTO channel_posts (product_id, message_id, state, synced_at) VALUES (?, ?, 'live', ?)
+                    ON CONFLICT(product_id) DO UPDATE SET
+                        message_id=excluded.message_id, state='live', dirty=0, attempts=0, synced_at=excluded.synced_at
+                    """,
+                    (product_id, channel_message_id, now)
+                )
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Ошибка в update_product_status для product_id={product_id}: {e}")
             raise
 
-    def get_pending_products(self) -> List[Tuple[int, str, str, str]]:
-        """Получает список товаров/услуг на модерации."""
+    def update_product_status_many(self, product_ids: Sequence[int], status: str) -> int:
+        """Меняет статус нескольких объявлений в одной транзакции и возвращает число изменённых."""
+        if not product_ids:
+            return 0
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT id, name, price, type FROM products WHERE status='pending'")
-                return cur.fetchall()
+                now = int(time.time())
+                approved_at = now if status == "approved" else None
+                closed_at = now if status in ("sold", "rejected", "expired") else None
+                cur.executemany(
+                    "UPDATE products SET status=?, approved_at=COALESCE(?, approved_at), closed_at=? WHERE id=?",
+                    [(status, approved_at, closed_at, product_id) for product_id in product_ids]
+                )
+                updated = cur.rowcount
+                self._mark_channel_dirty(cur, list(product_ids))
+                conn.commit()
+                return updated
         except sqlite3.Error as e:
-            print(f"Ошибка в get_pending_products: {e}")
-            return []
+            print(f"Ошибка в update_product_status_many для {len(product_ids)} объявлений: {e}")
+            raise
 
-    def get_approved_products(self) -> List[Tuple[int, str, str, str]]:
-        """Получает список активных товаров/услуг."""
+    def get_products_by_ids(self, product_ids: Sequence[int]) -> Dict[int, Product]:
+        """Получает объявления по списку ID (любого статуса) запросами IN (...) по частям."""
+        products: Dict[int, Product] = {}
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT id, name, price, type FROM products WHERE status='approved'")
-                return cur.fetchall()
+                cur.row_factory = Product.from_row
+                for chunk in _chunks(list(product_ids)):
+                    placeholders = ",".join("?" * len(chunk))
+                    cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})", tuple(chunk))
+                    products.update((product.id, product) for product in cur.fetchall())
+                return products
         except sqlite3.Error as e:
-            print(f"Ошибка в get_approved_products: {e}")
-            return []
+            print(f"Ошибка в get_products_by_ids для {len(product_ids)} объявлений: {e}")
+            return {}
 
-    def get_rejected_products(self) -> List[Tuple[int, str, str, str]]:
-        """Получает список отклоненных товаров/услуг."""
+    def assign_moderator(self, product_id: int, admin_ids: List[int], lease_until: int,
+                         exclude: Iterable[int] = ()) -> Optional[int]:
+        """Назначает объявление наименее загруженному администратору (кроме exclude, если есть другие)."""
+        excluded = set(exclude)
+        candidates = [a for a in admin_ids if a not in excluded] or list(admin_ids)
+        if not candidates:
+            return None
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT id, name, price, type FROM products WHERE status='rejected'")
-                return cur.fetchall()
+                cur.execute("SELECT admin_id, COUNT(*) FROM moderation_claims WHERE decided_by IS NULL GROUP BY admin_id")
+                load = dict(cur.fetchall())
+                least = min(load.get(a, 0) for a in candidates)
+                admin_id = random.choice([a for a in candidates if load.get(a, 0) == least])
+                cur.execute(
+                    """
+                    INSERT INTO moderation_claims (product_id, admin_id, lease_until) VALUES (?, ?, ?)
+                    ON CONFLICT(product_id) DO UPDATE SET admin_id=excluded.admin_id, lease_until=excluded.lease_until
+                    WHERE decided_by IS NULL
+                    """,
+                    (product_id, admin_id, lease_until)
+                )
+                conn.commit()
+                return admin_id if cur.rowcount else None
         except sqlite3.Error as e:
-            print(f"Ошибка в get_rejected_products: {e}")
-            return []
+            print(f"Ошибка в assign_moderator для product_id={product_id}: {e}")
+            return None
 
-    def create_order(self, product_id: int, seller_id: int, buyer_id: int) -> int:
-        """Создает новый заказ."""
+    def add_moderation_copy(self, product_id: int, admin_id: int, message_id: int):
+        """Запоминает карточку объявления, отправленную администратору."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    "INSERT INTO orders (product_id, seller_id, buyer_id, status) VALUES (?, ?, ?, ?)",
-                    (product_id, seller_id, buyer_id, "in_progress")
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO moderation_copies (product_id, admin_id, message_id) VALUES (?, ?, ?)",
+                    (product_id, admin_id, message_id)
                 )
-                order_id = cur.lastrowid
                 conn.commit()
-                return order_id
         except sqlite3.Error as e:
-            print(f"Ошибка в create_order для product_id={product_id}: {e}")
-            raise
+            print(f"Ошибка в add_moderation_copy для product_id={product_id}: {e}")
 
-    def get_active_order_by_user(self, user_id: int) -> Optional[Tuple[int, int, int]]:
-        """Получает активный заказ для пользователя (продавца или покупателя)."""
+    def get_moderation_copies(self, product_id: int) -> List[Tuple[int, int]]:
+        """Карточки объявления у администраторов: (admin_id, message_id)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute(
-                    """
-                    SELECT product_id, seller_id, buyer_id
-                    FROM orders
-                    WHERE (seller_id=? OR buyer_id=?) AND status='in_progress'
-                    LIMIT 1
-                    """,
-                    (user_id, user_id)
-                )
-                return cur.fetchone()
+                cur.execute("SELECT admin_id, message_id FROM moderation_copies WHERE product_id=?", (product_id,))
+                return cur.fetchall()
         except sqlite3.Error as e:
-            print(f"Ошибка в get_active_order_by_user для user_id={user_id}: {e}")
-            return None
+            print(f"Ошибка в get_moderation_copies для product_id={product_id}: {e}")
+            return []
 
-    def update_order_message_id(self, order_id: int, seller_message_id: Optional[int] = None, buyer_message_id: Optional[int] = None):
-        """Обновляет ID сообщений чата для заказа."""
+    def expire_reviews_of(self, admin_ids: Sequence[int]) -> int:
+        """Снимает аренду с нерешённых объявлений администраторов (например, удалённых из списка)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                if seller_message_id and buyer_message_id:
+                released = 0
+                for chunk in _chunks(list(admin_ids)):
+                    placeholders = ",".join("?" * len(chunk))
                     cur.execute(
-                        "UPDATE orders SET seller_message_id=?, buyer_message_id=? WHERE id=?",
-                        (seller_message_id, buyer_message_id, order_id)
+                        f"UPDATE moderation_claims SET lease_until=0 WHERE decided_by IS NULL AND admin_id IN ({placeholders})",
+                        tuple(chunk)
                     )
-                elif seller_message_id:
-                    cur.execute("UPDATE orders SET seller_message_id=? WHERE id=?", (seller_message_id, order_id))
-                elif buyer_message_id:
-                    cur.execute("UPDATE orders SET buyer_message_id=? WHERE id=?", (buyer_message_id, order_id))
+                    released += cur.rowcount
                 conn.commit()
+                return released
         except sqlite3.Error as e:
-            print(f"Ошибка в update_order_message_id для order_id={order_id}: {e}")
-            raise
+            print(f"Ошибка в expire_reviews_of: {e}")
+            return 0
 
-    def confirm_order(self, order_id: int, user_type: str) -> Optional[Tuple[bool, int, int, int]]:
-        """Подтверждает сделку со стороны продавца или покупателя."""
+    def get_expired_reviews(self, now: int, limit: int) -> List[Tuple[int, int]]:
+        """Объявления на модерации, аренда которых истекла без решения: (product_id, admin_id)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                field = "seller_confirmed" if user_type == "seller" else "buyer_confirmed"
-                cur.execute(f"UPDATE orders SET {field}=1 WHERE id=?", (order_id,))
                 cur.execute(
-                    "SELECT seller_confirmed, buyer_confirmed, product_id, seller_id, buyer_id FROM orders WHERE id=?",
-                    (order_id,)
+                    """
+                    SELECT c.product_id, c.admin_id FROM moderation_claims c
+                    JOIN products p ON p.id = c.product_id AND p.status='pending'
+                    WHERE c.decided_by IS NULL AND c.lease_until <= ?
+                    ORDER BY c.lease_until LIMIT ?
+                    """,
+                    (now, limit)
                 )
-                row = cur.fetchone()
-                if not row:
-                    return None
-                seller_conf, buyer_conf, product_id, seller_id, buyer_id = row
-                conn.commit()
-                return bool(seller_conf), bool(buyer_conf), product_id, seller_id, buyer_id
+                return cur.fetchall()
         except sqlite3.Error as e:
-            print(f"Ошибка в confirm_order для order_id={order_id}: {e}")
-            return None
+            print(f"Ошибка в get_expired_reviews: {e}")
+            return []
 
-    def update_order_status(self, order_id: int, status: str):
-        """Обновляет статус заказа."""
+    def begin_decision(self, product_id: int, admin_id: int) -> bool:
+        """Атомарно закрепляет решение по объявлению на модерации за администратором; False — уже решается или решено."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("UPDATE orders SET status=? WHERE id=?", (status, order_id))
+                cur.execute(
+                    """
+                    INSERT INTO moderation_claims (product_id, admin_id, lease_until, decided_by)
+                    SELECT id, ?, 0, ? FROM products WHERE id=? AND status='pending'
+                    ON CONFLICT(product_id) DO UPDATE SET decided_by=excluded.decided_by WHERE decided_by IS NULL
+                    RETURNING product_id
+                    """,
+                    (admin_id, admin_id, product_id)
+                )
+                claimed = cur.fetchone() is not None
                 conn.commit()
+                return claimed
         except sqlite3.Error as e:
-            print(f"Ошибка в update_order_status для order_id={order_id}: {e}")
-            raise
+            print(f"Ошибка в begin_decision для product_id={product_id}: {e}")
+            return False
 
-    def get_order(self, order_id: int) -> Optional[Tuple[int, int, int, Optional[int], str]]:
-        """Получает информацию о заказе по ID."""
+    def abort_decision(self, product_id: int):
+        """Снимает закрепление решения, если оно не состоялось (например, ошибка публикации)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    "SELECT product_id, seller_id, buyer_id, seller_message_id, status FROM orders WHERE id=?",
-                    (order_id,)
-                )
-                return cur.fetchone()
+            with self._connect() as conn:
+                conn.execute("UPDATE moderation_claims SET decided_by=NULL WHERE product_id=?", (product_id,))
+                conn.commit()
         except sqlite3.Error as e:
-            print(f"Ошибка в get_order для order_id={order_id}: {e}")
-            return None
+            print(f"Ошибка в abort_decision для product_id={product_id}: {e}")
 
-    def get_order_message_ids(self, order_id: int) -> Tuple[Optional[int], Optional[int]]:
-        """Получает ID сообщений чата для заказа."""
+    def finish_decision(self, product_id: int) -> List[Tuple[int, int]]:
+        """Завершает модерацию объявления и возвращает карточки у администраторов для обновления."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT buyer_message_id, seller_message_id FROM orders WHERE id=?", (order_id,))
-                row = cur.fetchone()
-                return (row[0], row[1]) if row else (None, None)
+                cur.execute("DELETE FROM moderation_claims WHERE product_id=?", (product_id,))
+                cur.execute("DELETE FROM moderation_copies WHERE product_id=? RETURNING admin_id, message_id", (product_id,))
+                copies = cur.fetchall()
+                conn.commit()
+                return copies
         except sqlite3.Error as e:
-            print(f"Ошибка в get_order_message_ids для order_id={order_id}: {e}")
-            return None, None
+            print(f"Ошибка в finish_decision для product_id={product_id}: {e}")
+            return []
 
-    def get_channel_message_id(self, product_id: int) -> Optional[int]:
+    def get_pending_products(self) -> List[Product]:
+        """Получает список товаров/услуг на модерации."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = Product.from_row
+                cur.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE status='pending' ORDER BY id")
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_pending_products: {e}")
+            return []
+
+    def create_order(self, product_id: int, buyer_id: int, hold_ttl: int) -> Optional[Tuple[int, int]]:
+        """Бронирует одобренный товар за покупателем и создает заказ в одной транзакции.
+
+        Бронь берётся, если товар свободен или предложен этому покупателю из очереди.
+        Возвращает (order_id, seller_id) или None, если товар занят или недоступен.
+        """
+        now = int(time.time())
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    INSERT INTO product_holds (product_id, buyer_id, order_id, expires_at) VALUES (?, ?, NULL, ?)
+                    ON CONFLICT(product_id) DO UPDATE SET expires_at=excluded.expires_at
+                    WHERE product_holds.buyer_id=excluded.buyer_id AND product_holds.order_id IS NULL
+                    RETURNING product_id
+                    """,
+                    (product_id, buyer_id, now + hold_ttl)
+                )
+                if not cur.fetchone():
+                    conn.rollback()
+                    return None
+                cur.execute(
+                    """
+                    INSERT INTO orders (product_id, seller_id, buyer_id, status, created_at)
+                    SELECT p.id, p.seller_id, ?, 'in_progress', ? FROM products p
+                    WHERE p.id=? AND p.status='approved' AND NOT EXISTS (
+                        SELECT 1 FROM orders o WHERE o.product_id=p.id AND o.buyer_id=? AND o.status='in_progress'
+                    )
+                    RETURNING id, seller_id
+                    """,
+                    (buyer_id, now, product_id, buyer_id)
+                )
+                row = cur.fetchone()
+                if not row:
+                    conn.rollback()
+                    return None
+                cur.execute("UPDATE product_holds SET order_id=? WHERE product_id=?", (row[0], product_id))
+                cur.execute("DELETE FROM product_waitlist WHERE product_id=? AND buyer_id=?", (product_id, buyer_id))
+                conn.commit()
+                return row
+        except sqlite3.Error as e:
+            print(f"Ошибка в create_order для product_id={product_id}: {e}")
+            raise
+
+    def touch_hold(self, order_id: int, expires_at: int, min_extension: int = 0) -> bool:
+        """Продлевает бронь активной сделки; запись пропускается, если продление меньше min_extension."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE product_holds SET expires_at=? WHERE order_id=? AND expires_at < ?",
+                    (expires_at, order_id, expires_at - min_extension)
+                )
+                conn.commit()
+                return cur.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка в touch_hold для order_id={order_id}: {e}")
+            return False
+
+    def get_hold(self, product_id: int) -> Optional[Tuple[int, Optional[int], int]]:
+        """Получает бронь товара: (buyer_id, order_id, expires_at)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT buyer_id, order_id, expires_at FROM product_holds WHERE product_id=?", (product_id,))
+                return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_hold для product_id={product_id}: {e}")
+            return None
+
+    def join_waitlist(self, product_id: int, buyer_id: int) -> int:
+        """Ставит покупателя в очередь на товар, возвращает его позицию в очереди."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "INSERT OR IGNORE INTO product_waitlist (product_id, buyer_id, created_at) VALUES (?, ?, ?)",
+                    (product_id, buyer_id, int(time.time()))
+                )
+                cur.execute(
+                    """
+                    SELECT COUNT(*) FROM product_waitlist
+                    WHERE product_id=? AND created_at <= (
+                        SELECT created_at FROM product_waitlist WHERE product_id=? AND buyer_id=?
+                    )
+                    """,
+                    (product_id, product_id, buyer_id)
+                )
+                position = cur.fetchone()[0]
+                conn.commit()
+                return position
+        except sqlite3.Error as e:
+            print(f"Ошибка в join_waitlist для product_id={product_id}: {e}")
+            raise
+
+    def _release_hold(self, cur: sqlite3.Cursor, product_id: int, offer_ttl: int) -> Optional[int]:
+        """Снимает бронь и предлагает товар первому покупателю из очереди на offer_ttl секунд."""
+        cur.execute("DELETE FROM product_holds WHERE product_id=?", (product_id,))
+        cur.execute(
+            """
+            DELETE FROM product_waitlist WHERE rowid = (
+                SELECT rowid FROM product_waitlist WHERE product_id=? ORDER BY created_at, rowid LIMIT 1
+            )
+            RETURNING buyer_id
+            """,
+            (product_id,)
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
+        cur.execute(
+            "INSERT INTO product_holds (product_id, buyer_id, order_id, expires_at) VALUES (?, ?, NULL, ?)",
+            (product_id, row[0], int(time.time()) + offer_ttl)
+        )
+        return row[0]
+
+    def release_hold(self, product_id: int, buyer_id: int, order_id: Optional[int], offer_ttl: int) -> Optional[int]:
+        """Снимает истёкшую бронь и передаёт товар следующему покупателю из очереди."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "DELETE FROM product_holds WHERE product_id=? AND buyer_id=? AND order_id IS ? RETURNING product_id",
+                    (product_id, buyer_id, order_id)
+                )
+                if not cur.fetchone():
+                    conn.rollback()
+                    return None
+                next_buyer = self._release_hold(cur, product_id, offer_ttl)
+                conn.commit()
+                return next_buyer
+        except sqlite3.Error as e:
+            print(f"Ошибка в release_hold для product_id={product_id}: {e}")
+            raise
+
+    def get_expired_holds(self, now: int, limit: int = 100) -> List[Tuple[int, int, Optional[int]]]:
+        """Получает истёкшие брони: (product_id, buyer_id, order_id)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT product_id, buyer_id, order_id FROM product_holds WHERE expires_at < ? ORDER BY expires_at LIMIT ?",
+                    (now, limit)
+                )
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_expired_holds: {e}")
+            return []
+
+    def get_idle_orders(self, cutoff: int, limit: int = 100) -> List[int]:
+        """Получает активные сделки без брони, начатые раньше cutoff."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT o.id FROM orders o
+                    WHERE o.status='in_progress' AND o.created_at < ?
+                        AND NOT EXISTS (SELECT 1 FROM product_holds h WHERE h.order_id = o.id)
+                    ORDER BY o.id LIMIT ?
+                    """,
+                    (cutoff, limit)
+                )
+                return [row[0] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_idle_orders: {e}")
+            return []
+
+    def get_active_order_by_user(self, user_id: int) -> Optional[Order]:
+        """Получает активный заказ для пользователя (продавца или покупателя)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = Order.from_row
+                cur.execute(
+                    f"""
+                    SELECT {ORDER_COLUMNS}
+                    FROM orders
+                    WHERE (seller_id=? OR buyer_id=?) AND status='in_progress'
+                    LIMIT 1
+                    """,
+                    (user_id, user_id)
+                )
+                return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_active_order_by_user для user_id={user_id}: {e}")
+            return None
+
+    def update_order_message_id(self, order_id: int, seller_message_id: Optional[int] = None, buyer_message_id: Optional[int] = None):
+        """Обновляет ID сообщений чата для заказа."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                if seller_message_id and buyer_message_id:
+                    cur.execute(
+                        "UPDATE orders SET seller_message_id=?, buyer_message_id=? WHERE id=?",
+                        (seller_message_id, buyer_message_id, order_id)
+                    )
+                elif seller_message_id:
+                    cur.execute("UPDATE orders SET seller_message_id=? WHERE id=?", (seller_message_id, order_id))
+                elif buyer_message_id:
+                    cur.execute("UPDATE orders SET buyer_message_id=? WHERE id=?", (buyer_message_id, order_id))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в update_order_message_id для order_id={order_id}: {e}")
+            raise
+
+    def confirm_order(self, order_id: int, user_type: str, user_id: int) -> Optional[Tuple[bool, bool, int, int, int]]:
+        """Подтверждает активную сделку со стороны продавца или покупателя одним запросом."""
+        field, party = ("seller_confirmed", "seller_id") if user_type == "seller" else ("buyer_confirmed", "buyer_id")
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    UPDATE orders SET {field}=1
+                    WHERE id=? AND {party}=? AND status='in_progress'
+                    RETURNING seller_confirmed, buyer_confirmed, product_id, seller_id, buyer_id
+                    """,
+                    (order_id, user_id)
+                )
+                row = cur.fetchone()
+                conn.commit()
+                if not row:
+                    return None
+                seller_conf, buyer_conf, product_id, seller_id, buyer_id = row
+                return bool(seller_conf), bool(buyer_conf), product_id, seller_id, buyer_id
+        except sqlite3.Error as e:
+            print(f"Ошибка в confirm_order для order_id={order_id}: {e}")
+            return None
+
+    def complete_order(self, order_id: int, force: bool = False) -> Optional[tuple]:
+        """Завершает сделку и помечает товар проданным в одной транзакции.
+
+        Без force сделка завершается, только если её подтвердили обе стороны.
+        Возвращает (product_id, seller_id, buyer_id, buyer_message_id, seller_message_id,
+        name, price, description, photo, type, channel_message_id) только тому, кто выполнил переход.
+        """
+        confirmed = "" if force else " AND seller_confirmed=1 AND buyer_confirmed=1"
+        now = int(time.time())
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    UPDATE orders SET status='completed', closed_at=?
+                    WHERE id=? AND status='in_progress'{confirmed}
+                    RETURNING product_id, seller_id, buyer_id, buyer_message_id, seller_message_id
+                    """,
+                    (now, order_id)
+                )
+                order = cur.fetchone()
+                if not order:
+                    conn.rollback()
+                    return None
+                cur.execute(
+                    """
+                    UPDATE products SET status='sold', closed_at=? WHERE id=?
+                    RETURNING name, price, description, photo, type, channel_message_id
+                    """,
+                    (now, order[0])
+                )
+                product = cur.fetchone() or (None, None, None, None, None, None)
+                self._mark_channel_dirty(cur, [order[0]])
+                cur.execute("DELETE FROM product_holds WHERE product_id=?", (order[0],))
+                cur.execute("DELETE FROM product_waitlist WHERE product_id=?", (order[0],))
+                conn.commit()
+                return order + product
+        except sqlite3.Error as e:
+            print(f"Ошибка в complete_order для order_id={order_id}: {e}")
+            raise
+
+    def cancel_order(self, order_id: int, offer_ttl: int = 0, user_id: Optional[int] = None) -> Optional[tuple]:
+        """Отменяет активную сделку и снимает бронь товара в одной транзакции.
+
+        Возвращает (product_id, seller_id, buyer_id, buyer_message_id, seller_message_id, type, next_buyer_id)
+        или None, если сделка не найдена, уже закрыта или user_id не является её участником.
+        next_buyer_id — покупатель из очереди, которому товар предложен на offer_ttl секунд.
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                query = "UPDATE orders SET status='canceled', closed_at=? WHERE id=? AND status='in_progress'"
+                params = [int(time.time()), order_id]
+                if user_id is not None:
+                    query += " AND (seller_id=? OR buyer_id=?)"
+                    params += [user_id, user_id]
+                cur.execute(
+                    query + """
+                    RETURNING product_id, seller_id, buyer_id, buyer_message_id, seller_message_id,
+                        (SELECT type FROM products WHERE products.id = orders.product_id)
+                    """,
+                    params
+                )
+                row = cur.fetchone()
+                if not row:
+                    conn.rollback()
+                    return None
+                next_buyer = None
+                cur.execute("SELECT 1 FROM product_holds WHERE product_id=? AND order_id=?", (row[0], order_id))
+                if cur.fetchone():
+                    next_buyer = self._release_hold(cur, row[0], offer_ttl)
+                conn.commit()
+                return row + (next_buyer,)
+        except sqlite3.Error as e:
+            print(f"Ошибка в cancel_order для order_id={order_id}: {e}")
+            raise
+
+    def get_order(self, order_id: int) -> Optional[Order]:
+        """Получает заказ по ID."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = Order.from_row
+                cur.execute(f"SELECT {ORDER_COLUMNS} FROM orders WHERE id=?", (order_id,))
+                return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_order для order_id={order_id}: {e}")
+            return None
+
+    def get_order_message_ids(self, order_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Получает ID сообщений чата для заказа."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT buyer_message_id, seller_message_id FROM orders WHERE id=?", (order_id,))
+                row = cur.fetchone()
+                return (row[0], row[1]) if row else (None, None)
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_order_message_ids для order_id={order_id}: {e}")
+            return None, None
+
+    def get_channel_message_id(self, product_id: int) -> Optional[int]:
         """Получает ID сообщения в канале для продукта."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT channel_message_id FROM products WHERE id=?", (product_id,))
                 row = cur.fetchone()
@@ -316,19 +1255,280 @@ class Database:
 
     def delete_product(self, product_id: int):
         """Удаляет товар или услугу из базы данных."""
+        self.delete_products([product_id])
+
+    def delete_products(self, product_ids: Sequence[int]) -> int:
+        """Удаляет несколько объявлений с фото в одной транзакции и возвращает число удалённых."""
+        if not product_ids:
+            return 0
+        rows = [(product_id,) for product_id in product_ids]
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.executemany("DELETE FROM product_photos WHERE product_id=?", rows)
+                cur.executemany("DELETE FROM products WHERE id=?", rows)
+                deleted = cur.rowcount
+                self._mark_channel_dirty(cur, list(product_ids))
+                conn.commit()
+                return deleted
+        except sqlite3.Error as e:
+            print(f"Ошибка в delete_products для {len(product_ids)} объявлений: {e}")
+            raise
+
+    def expire_listings(self, cutoff: int, limit: int = 200) -> int:
+        """Снимает с публикации объявления, одобренные раньше cutoff и не занятые сделкой.
+
+        Посты таких объявлений помечаются для синхронизации с каналом. Возвращает число снятых объявлений.
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    UPDATE products SET status='expired', closed_at=? WHERE id IN (
+                        SELECT p.id FROM products p
+                        WHERE p.status='approved' AND p.approved_at < ?
+                            AND NOT EXISTS (SELECT 1 FROM product_holds h WHERE h.product_id = p.id)
+                        LIMIT ?
+                    )
+                    RETURNING id
+                    """,
+                    (int(time.time()), cutoff, limit)
+                )
+                expired = [row[0] for row in cur.fetchall()]
+                self._mark_channel_dirty(cur, expired)
+                cur.executemany("DELETE FROM product_waitlist WHERE product_id=?", [(product_id,) for product_id in expired])
+                conn.commit()
+                return len(expired)
+        except sqlite3.Error as e:
+            print(f"Ошибка в expire_listings: {e}")
+            raise
+
+    def _mark_channel_dirty(self, cur: sqlite3.Cursor, product_ids: List[int]):
+        """Помечает посты объявлений в канале как требующие синхронизации."""
+        cur.executemany(
+            "UPDATE channel_posts SET dirty=1, attempts=0 WHERE product_id=?",
+            [(product_id,) for product_id in product_ids]
+        )
+
+    def get_dirty_channel_posts(self, limit: int) -> List[tuple]:
+        """Получает посты, расходящиеся со статусом объявления.
+
+        Возвращает (product_id, message_id, state, pinned, desired_state, name, price, description, photo, type).
+        desired_state: live — пост висит как есть, sold — помечен проданным, deleted — удалён из канала.
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT c.product_id, c.message_id, c.state, c.pinned,
+                        CASE WHEN p.id IS NULL THEN 'deleted'
+                             WHEN p.status='approved' THEN 'live'
+                             WHEN p.status='sold' THEN 'sold'
+                             ELSE 'deleted' END,
+                        p.name, p.price, p.description, p.photo, p.type
+                    FROM channel_posts c LEFT JOIN products p ON p.id = c.product_id
+                    WHERE c.dirty=1
+                    ORDER BY c.product_id
+                    LIMIT ?
+                    """,
+                    (limit,)
+                )
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_dirty_channel_posts: {e}")
+            return []
+
+    def finish_channel_post(self, product_id: int, state: str):
+        """Записывает в журнал применённое к посту состояние; удалённые посты убираются из журнала."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("DELETE FROM products WHERE id=?", (product_id,))
+                if state == "deleted":
+                    cur.execute("DELETE FROM channel_posts WHERE product_id=?", (product_id,))
+                else:
+                    cur.execute(
+                        """
+                        UPDATE channel_posts SET state=?, dirty=0, attempts=0, last_error=NULL, synced_at=?,
+                            pinned = pinned AND ? = 'live'
+                        WHERE product_id=?
+                        """,
+                        (state, int(time.time()), state, product_id)
+                    )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в finish_channel_post для product_id={product_id}: {e}")
+            raise
+
+    def fail_channel_post(self, product_id: int, error: str, max_attempts: int):
+        """Записывает ошибку синхронизации поста; после max_attempts попыток пост больше не синхронизируется."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    UPDATE channel_posts SET attempts = attempts + 1, last_error=?,
+                        dirty = attempts + 1 < ?
+                    WHERE product_id=?
+                    """,
+                    (error, max_attempts, product_id)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в fail_channel_post для product_id={product_id}: {e}")
+            raise
+
+    def reconcile_channel_posts(self) -> int:
+        """Сверяет весь журнал со статусами объявлений и помечает разошедшиеся посты. Возвращает их число."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    UPDATE channel_posts SET dirty=1, attempts=0
+                    WHERE dirty=0 AND attempts=0 AND state IS NOT (
+                        SELECT CASE WHEN p.status='approved' THEN 'live'
+                                    WHEN p.status='sold' THEN 'sold'
+                                    ELSE 'deleted' END
+                        FROM products p WHERE p.id = channel_posts.product_id
+                    )
+                    """
+                )
+                conn.commit()
+                return cur.rowcount
+        except sqlite3.Error as e:
+            print(f"Ошибка в reconcile_channel_posts: {e}")
+            raise
+
+    def set_channel_post_pinned(self, product_id: Optional[int], pinned: bool):
+        """Отмечает пост закреплённым или откреплённым; product_id=None — все посты."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                if product_id is None:
+                    cur.execute("UPDATE channel_posts SET pinned=? WHERE pinned != ?", (int(pinned), int(pinned)))
+                else:
+                    cur.execute("UPDATE channel_posts SET pinned=? WHERE product_id=?", (int(pinned), product_id))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в set_channel_post_pinned для product_id={product_id}: {e}")
+            raise
+
+    def archive_cold_rows(self, cutoff: int, limit: int = 500) -> Tuple[int, int]:
+        """Переносит в архив объявления и сделки, закрытые раньше cutoff, и пополняет итоги пользователей.
+
+        Объявление переносится, только если по нему нет активной сделки, брони и несинхронизированного поста в канале.
+        Возвращает (перенесено объявлений, перенесено сделок).
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT p.id, p.seller_id, p.status FROM products p
+                    WHERE p.status IN ('sold', 'rejected', 'expired') AND COALESCE(p.closed_at, 0) < ?
+                        AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.product_id = p.id AND o.status='in_progress')
+                        AND NOT EXISTS (SELECT 1 FROM product_holds h WHERE h.product_id = p.id)
+                        AND NOT EXISTS (SELECT 1 FROM channel_posts c WHERE c.product_id = p.id AND c.dirty=1)
+                    LIMIT ?
+                    """,
+                    (cutoff, limit)
+                )
+                products = cur.fetchall()
+                product_ids = [(product_id,) for product_id, _, _ in products]
+                cur.executemany(
+                    f"INSERT OR REPLACE INTO products_archive ({ARCHIVE_PRODUCT_COLUMNS}) "
+                    f"SELECT {ARCHIVE_PRODUCT_COLUMNS} FROM products WHERE id=?",
+                    product_ids
+                )
+                cur.executemany(
+                    """
+                    INSERT INTO user_totals (user_id, products, products_sold, products_rejected) VALUES (?, 1, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET products = products + 1,
+                        products_sold = products_sold + excluded.products_sold,
+                        products_rejected = products_rejected + excluded.products_rejected
+                    """,
+                    [(seller_id, int(status == "sold"), int(status == "rejected")) for _, seller_id, status in products]
+                )
+                cur.executemany("DELETE FROM product_photos WHERE product_id=?", product_ids)
+                cur.executemany("DELETE FROM product_waitlist WHERE product_id=?", product_ids)
+                cur.executemany("DELETE FROM channel_posts WHERE product_id=?", product_ids)
+                cur.executemany("DELETE FROM products WHERE id=?", product_ids)
+
+                cur.execute(
+                    """
+                    SELECT id, seller_id, buyer_id, status FROM orders
+                    WHERE status IN ('completed', 'canceled') AND COALESCE(closed_at, 0) < ?
+                    LIMIT ?
+                    """,
+                    (cutoff, limit)
+                )
+                orders = cur.fetchall()
+                order_ids = [(order_id,) for order_id, _, _, _ in orders]
+                cur.executemany(
+                    f"INSERT OR REPLACE INTO orders_archive ({ARCHIVE_ORDER_COLUMNS}) "
+                    f"SELECT {ARCHIVE_ORDER_COLUMNS} FROM orders WHERE id=?",
+                    order_ids
+                )
+                completed = [order for order in orders if order[3] == "completed"]
+                cur.executemany(
+                    """
+                    INSERT INTO user_totals (user_id, sold) VALUES (?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET sold = sold + 1
+                    """,
+                    [(seller_id,) for _, seller_id, _, _ in completed]
+                )
+                cur.executemany(
+                    """
+                    INSERT INTO user_totals (user_id, bought) VALUES (?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET bought = bought + 1
+                    """,
+                    [(buyer_id,) for _, _, buyer_id, _ in completed]
+                )
+                cur.executemany("DELETE FROM orders WHERE id=?", order_ids)
+                conn.commit()
+                return len(products), len(orders)
+        except sqlite3.Error as e:
+            print(f"Ошибка в archive_cold_rows: {e}")
+            raise
+
+    def compact(self):
+        """Удаляет осиротевшие брони и очереди, обновляет статистику планировщика и сбрасывает WAL."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    DELETE FROM product_waitlist WHERE product_id NOT IN (
+                        SELECT id FROM products WHERE status='approved'
+                    )
+                    """
+                )
+                cur.execute(
+                    """
+                    DELETE FROM product_holds WHERE order_id IS NULL AND product_id NOT IN (
+                        SELECT id FROM products WHERE status='approved'
+                    )
+                    """
+                )
+                cur.execute("DELETE FROM product_photos WHERE product_id NOT IN (SELECT id FROM products)")
+                # Назначения и копии карточек объявлений, снятых с модерации без решения через бота
+                for table in ("moderation_claims", "moderation_copies"):
+                    cur.execute(
+                        f"DELETE FROM {table} WHERE product_id NOT IN (SELECT id FROM products WHERE status='pending')"
+                    )
                 conn.commit()
+                cur.execute("PRAGMA optimize")
+                cur.execute("PRAGMA wal_checkpoint(PASSIVE)")
         except sqlite3.Error as e:
-            print(f"Ошибка в delete_product для product_id={product_id}: {e}")
+            print(f"Ошибка в compact: {e}")
             raise
 
     def get_all_users(self) -> List[int]:
         """Получает список всех пользователей."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT user_id FROM users")
                 return [row[0] for row in cur.fetchall()]
@@ -336,28 +1536,42 @@ class Database:
             print(f"Ошибка в get_all_users: {e}")
             return []
 
-    def get_active_orders(self) -> List[Tuple[int, int, int, int, str]]:
-        """Получает список активных заказов."""
+    def get_active_users(self, days: int) -> List[int]:
+        """Получает пользователей, которые были активны за последние days дней."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT id, product_id, seller_id, buyer_id, status FROM orders WHERE status='in_progress'")
-                return cur.fetchall()
+                cur.execute("SELECT user_id FROM users WHERE last_seen >= CAST(strftime('%s', 'now') AS INTEGER) - ?", (days * 86400,))
+                return [row[0] for row in cur.fetchall()]
         except sqlite3.Error as e:
-            print(f"Ошибка в get_active_orders: {e}")
+            print(f"Ошибка в get_active_users для days={days}: {e}")
             return []
 
+    def count_active_users(self, days: int) -> int:
+        """Считает пользователей, активных за последние days дней."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT COUNT(*) FROM users WHERE last_seen >= CAST(strftime('%s', 'now') AS INTEGER) - ?", (days * 86400,))
+                return cur.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка в count_active_users для days={days}: {e}")
+            return 0
+
     def get_stats(self) -> Tuple[int, int, int, int]:
         """Получает статистику: общее количество товаров, активных, проданных, пользователей."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT COUNT(*) FROM products")
-                total_products = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM products WHERE status='approved'")
-                active_products = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM products WHERE status='sold'")
-                sold_products = cur.fetchone()[0]
+                cur.execute(
+                    """
+                    SELECT COUNT(*) + (SELECT COALESCE(SUM(products), 0) FROM user_totals),
+                        COUNT(*) FILTER (WHERE status='approved'),
+                        COUNT(*) FILTER (WHERE status='sold') + (SELECT COALESCE(SUM(products_sold), 0) FROM user_totals)
+                    FROM products
+                    """
+                )
+                total_products, active_products, sold_products = cur.fetchone()
                 cur.execute("SELECT COUNT(*) FROM users")
                 total_users = cur.fetchone()[0]
                 return total_products, active_products, sold_products, total_users
@@ -368,7 +1582,7 @@ class Database:
     def get_user_info(self, user_id: int) -> Tuple[int, int, int]:
         """Получает информацию о пользователе: количество товаров, продаж, покупок."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT COUNT(*) FROM products WHERE seller_id=?", (user_id,))
                 products_count = cur.fetchone()[0]
@@ -376,28 +1590,41 @@ class Database:
                 sold_count = cur.fetchone()[0]
                 cur.execute("SELECT COUNT(*) FROM orders WHERE buyer_id=? AND status='completed'", (user_id,))
                 bought_count = cur.fetchone()[0]
-                return products_count, sold_count, bought_count
+                # Дочитываем итоги по архиву
+                cur.execute("SELECT products, sold, bought FROM user_totals WHERE user_id=?", (user_id,))
+                archived = cur.fetchone() or (0, 0, 0)
+                return products_count + archived[0], sold_count + archived[1], bought_count + archived[2]
         except sqlite3.Error as e:
             print(f"Ошибка в get_user_info для user_id={user_id}: {e}")
             return 0, 0, 0
 
     def ban_user(self, user_id: int):
         """Запрещает пользователю продавать."""
+        self.ban_users([user_id])
+
+    def ban_users(self, user_ids: Sequence[int]):
+        """Запрещает продавать нескольким пользователям в одной транзакции."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("INSERT OR REPLACE INTO users (user_id, can_sell) VALUES (?, ?)", (user_id, 0))
+                cur.executemany(
+                    "INSERT INTO users (user_id, can_sell) VALUES (?, 0) ON CONFLICT(user_id) DO UPDATE SET can_sell=0",
+                    [(user_id,) for user_id in user_ids]
+                )
                 conn.commit()
         except sqlite3.Error as e:
-            print(f"Ошибка в ban_user для user_id={user_id}: {e}")
+            print(f"Ошибка в ban_users для {len(user_ids)} пользователей: {e}")
             raise
 
     def unban_user(self, user_id: int):
         """Разрешает пользователю продавать."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
-                cur.execute("INSERT OR REPLACE INTO users (user_id, can_sell) VALUES (?, ?)", (user_id, 1))
+                cur.execute(
+                    "INSERT INTO users (user_id, can_sell) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET can_sell=1",
+                    (user_id,)
+                )
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Ошибка в unban_user для user_id={user_id}: {e}")
@@ -406,14 +1633,16 @@ class Database:
     def get_top_sellers(self) -> List[Tuple[int, int]]:
         """Получает топ-10 продавцов по количеству продаж."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
                     """
-                    SELECT seller_id, COUNT(*) as sales
-                    FROM orders
-                    WHERE status='completed'
-                    GROUP BY seller_id
+                    SELECT user_id, SUM(n) as sales FROM (
+                        SELECT seller_id AS user_id, COUNT(*) AS n FROM orders WHERE status='completed' GROUP BY seller_id
+                        UNION ALL
+                        SELECT user_id, sold FROM user_totals WHERE sold > 0
+                    )
+                    GROUP BY user_id
                     ORDER BY sales DESC
                     LIMIT 10
                     """
@@ -426,14 +1655,16 @@ class Database:
     def get_top_buyers(self) -> List[Tuple[int, int]]:
         """Получает топ-10 покупателей по количеству покупок."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
                     """
-                    SELECT buyer_id, COUNT(*) as purchases
-                    FROM orders
-                    WHERE status='completed'
-                    GROUP BY buyer_id
+                    SELECT user_id, SUM(n) as purchases FROM (
+                        SELECT buyer_id AS user_id, COUNT(*) AS n FROM orders WHERE status='completed' GROUP BY buyer_id
+                        UNION ALL
+                        SELECT user_id, bought FROM user_totals WHERE bought > 0
+                    )
+                    GROUP BY user_id
                     ORDER BY purchases DESC
                     LIMIT 10
                     """
@@ -446,7 +1677,7 @@ class Database:
     def create_ad(self, text: str, photo: Optional[str]) -> int:
         """Создает новый рекламный пост."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("INSERT INTO ads (text, photo) VALUES (?, ?)", (text, photo))
                 ad_id = cur.lastrowid
@@ -459,7 +1690,7 @@ class Database:
     def get_ad(self, ad_id: int) -> Optional[Tuple[str, Optional[str]]]:
         """Получает данные о рекламном посте по ID."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT text, photo FROM ads WHERE id=?", (ad_id,))
                 return cur.fetchone()
@@ -470,7 +1701,7 @@ class Database:
     def update_ad_channel_message_id(self, ad_id: int, channel_message_id: int):
         """Обновляет ID сообщения в канале для рекламного поста."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("UPDATE ads SET channel_message_id=? WHERE id=?", (channel_message_id, ad_id))
                 conn.commit()
@@ -481,7 +1712,7 @@ class Database:
     def get_ad_channel_message_id(self, ad_id: int) -> Optional[int]:
         """Получает ID сообщения в канале для рекламного поста."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT channel_message_id FROM ads WHERE id=?", (ad_id,))
                 row = cur.fetchone()
@@ -493,7 +1724,7 @@ class Database:
     def delete_ad(self, ad_id: int):
         """Удаляет рекламный пост из базы данных."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("DELETE FROM ads WHERE id=?", (ad_id,))
                 conn.commit()
@@ -501,10 +1732,169 @@ class Database:
             print(f"Ошибка в delete_ad для ad_id={ad_id}: {e}")
             raise
 
+    def create_campaign(self, ad_id: int, target: str, start_at: int, repeat_count: int = 1, repeat_interval: int = 0,
+                        spread_seconds: int = 0, pin_seconds: int = 0) -> int:
+        """Создает рекламную кампанию."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    INSERT INTO ad_campaigns (ad_id, target, next_run_at, repeat_count, repeat_interval, spread_seconds, pin_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (ad_id, target, start_at, repeat_count, repeat_interval, spread_seconds, pin_seconds)
+                )
+                campaign_id = cur.lastrowid
+                conn.commit()
+                return campaign_id
+        except sqlite3.Error as e:
+            print(f"Ошибка в create_campaign для ad_id={ad_id}: {e}")
+            raise
+
+    def get_active_campaigns(self, now: int) -> List[tuple]:
+        """Получает идущие кампании и кампании, время запуска которых наступило.
+
+        Возвращает (id, ad_id, target, status, repeat_count, repeat_interval, spread_seconds, pin_seconds,
+        runs_done, run_started_at, run_total, cursor, text, photo).
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT c.id, c.ad_id, c.target, c.status, c.repeat_count, c.repeat_interval, c.spread_seconds,
+                        c.pin_seconds, c.runs_done, c.run_started_at, c.run_total, c.cursor, a.text, a.photo
+                    FROM ad_campaigns c LEFT JOIN ads a ON a.id = c.ad_id
+                    WHERE c.status='running' OR (c.status='scheduled' AND c.next_run_at <= ?)
+                    ORDER BY c.id
+                    """,
+                    (now,)
+                )
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_active_campaigns: {e}")
+            return []
+
+    def start_campaign_run(self, campaign_id: int, now: int, run_total: int) -> bool:
+        """Начинает очередной запуск кампании; False — кампанию уже запустили или отменили."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    UPDATE ad_campaigns SET status='running', run_started_at=?, run_total=?, cursor=-1
+                    WHERE id=? AND status='scheduled'
+                    RETURNING id
+                    """,
+                    (now, run_total, campaign_id)
+                )
+                started = cur.fetchone() is not None
+                conn.commit()
+                return started
+        except sqlite3.Error as e:
+            print(f"Ошибка в start_campaign_run для campaign_id={campaign_id}: {e}")
+            raise
+
+    def advance_campaign(self, campaign_id: int, cursor: int, sent: int):
+        """Сохраняет курсор доставки, чтобы после перезапуска продолжить с того же места."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE ad_campaigns SET cursor=?, sent = sent + ? WHERE id=? AND status='running'",
+                    (cursor, sent, campaign_id)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в advance_campaign для campaign_id={campaign_id}: {e}")
+            raise
+
+    def finish_campaign_run(self, campaign_id: int, next_run_at: Optional[int]):
+        """Завершает запуск: планирует следующий повтор или закрывает кампанию (next_run_at=None)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    UPDATE ad_campaigns SET runs_done = runs_done + 1, cursor=NULL, next_run_at=?,
+                        status = CASE WHEN ? IS NULL THEN 'done' ELSE 'scheduled' END
+                    WHERE id=? AND status='running'
+                    """,
+                    (next_run_at, next_run_at, campaign_id)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в finish_campaign_run для campaign_id={campaign_id}: {e}")
+            raise
+
+    def set_campaign_pin(self, campaign_id: int, message_id: Optional[int], unpin_at: Optional[int]):
+        """Сохраняет закреплённый кампанией пост и время его открепления."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE ad_campaigns SET pinned_message_id=?, unpin_at=? WHERE id=?",
+                    (message_id, unpin_at, campaign_id)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в set_campaign_pin для campaign_id={campaign_id}: {e}")
+            raise
+
+    def get_due_unpins(self, now: int) -> List[Tuple[int, int]]:
+        """Получает закреплённые кампаниями посты, которые пора открепить: (campaign_id, message_id)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT id, pinned_message_id FROM ad_campaigns
+                    WHERE pinned_message_id IS NOT NULL AND (unpin_at <= ? OR status='canceled')
+                    """,
+                    (now,)
+                )
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_due_unpins: {e}")
+            return []
+
+    def get_campaigns(self, limit: int = 20) -> List[tuple]:
+        """Получает последние кампании: (id, ad_id, target, status, next_run_at, runs_done, repeat_count, sent, run_total)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT id, ad_id, target, status, next_run_at, runs_done, repeat_count, sent, run_total
+                    FROM ad_campaigns ORDER BY id DESC LIMIT ?
+                    """,
+                    (limit,)
+                )
+                return cur.fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_campaigns: {e}")
+            return []
+
+    def cancel_campaign(self, campaign_id: int) -> bool:
+        """Отменяет запланированную или идущую кампанию."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE ad_campaigns SET status='canceled' WHERE id=? AND status IN ('scheduled', 'running')",
+                    (campaign_id,)
+                )
+                conn.commit()
+                return cur.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Ошибка в cancel_campaign для campaign_id={campaign_id}: {e}")
+            raise
+
     def get_products(self, page: int, item_type: Optional[str] = None, page_size: int = 5) -> Tuple[List[Tuple[int, str, str, str]], int]:
         """Получает список товаров/услуг с пагинацией."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 query = "SELECT id, name, price, type FROM products WHERE status='approved'"
                 params = []
@@ -515,9 +1905,391 @@ class Database:
                 params.extend([page_size, page * page_size])
                 cur.execute(query, params)
                 products = cur.fetchall()
-                cur.execute("SELECT COUNT(*) FROM products WHERE status='approved'" + (f" AND type='{item_type}'" if item_type else ""))
+                if item_type:
+                    cur.execute("SELECT COUNT(*) FROM products WHERE status='approved' AND type=?", (item_type,))
+                else:
+                    cur.execute("SELECT COUNT(*) FROM products WHERE status='approved'")
                 total = cur.fetchone()[0]
                 return products, total
         except sqlite3.Error as e:
             print(f"Ошибка в get_products для item_type={item_type}, page={page}: {e}")
-            return [], 0
\ No newline at end of file
+            return [], 0
+
+    def _fetch_keyset_page(self, cur: sqlite3.Cursor, query: str, params: list, key: str,
+                           cursor: Optional[int], backward: bool, limit: int) -> Tuple[list, bool, bool]:
+        """Выполняет постраничный запрос по ключу (новые записи первыми)."""
+        if cursor is None:
+            cur.execute(f"{query} ORDER BY {key} DESC LIMIT ?", (*params, limit + 1))
+            rows = cur.fetchall()
+            return rows[:limit], False, len(rows) > limit
+        if backward:
+            cur.execute(f"{query} AND {key} > ? ORDER BY {key} ASC LIMIT ?", (*params, cursor, limit + 1))
+            rows = cur.fetchall()
+            return rows[:limit][::-1], len(rows) > limit, True
+        cur.execute(f"{query} AND {key} < ? ORDER BY {key} DESC LIMIT ?", (*params, cursor, limit + 1))
+        rows = cur.fetchall()
+        return rows[:limit], True, len(rows) > limit
+
+    def get_products_page(self, status: str, cursor: Optional[int] = None, backward: bool = False,
+                          limit: int = 20) -> Tuple[List[Tuple[int, str, str, str]], bool, bool]:
+        """Получает страницу товаров/услуг с указанным статусом и флаги наличия соседних страниц."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                return self._fetch_keyset_page(
+                    cur, "SELECT id, name, price, type FROM products WHERE status=?", [status],
+                    "id", cursor, backward, limit
+                )
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_products_page для status={status}, cursor={cursor}: {e}")
+            return [], False, False
+
+    def get_active_orders_page(self, cursor: Optional[int] = None, backward: bool = False,
+                               limit: int = 20) -> Tuple[List[Tuple[int, int, int, int, str, Optional[str], Optional[str]]], bool, bool]:
+        """Получает страницу активных заказов вместе с названием и типом товара одним запросом."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                return self._fetch_keyset_page(
+                    cur,
+                    """
+                    SELECT o.id, o.product_id, o.seller_id, o.buyer_id, o.status, p.name, p.type
+                    FROM orders o LEFT JOIN products p ON p.id = o.product_id
+                    WHERE o.status='in_progress'
+                    """,
+                    [], "o.id", cursor, backward, limit
+                )
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_active_orders_page для cursor={cursor}: {e}")
+            return [], False, False
+
+    def get_table_columns(self, table: str) -> List[str]:
+        """Получает список колонок таблицы, доступной для выгрузки."""
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Таблица {table} недоступна для выгрузки")
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(f"PRAGMA table_info({table})")
+                return [row[1] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_table_columns для table={table}: {e}")
+            return []
+
+    def iter_table_rows(self, table: str, batch_size: int = 500) -> Iterator[tuple]:
+        """Построчно читает таблицу пачками по ключу, не загружая её целиком в память."""
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Таблица {table} недоступна для выгрузки")
+        key = EXPORT_TABLES[table]
+        last_key = None
+        while True:
+            try:
+                with self._connect() as conn:
+                    cur = conn.cursor()
+                    if last_key is None:
+                        cur.execute(f"SELECT {key}, * FROM {table} ORDER BY {key} LIMIT ?", (batch_size,))
+                    else:
+                        cur.execute(
+                            f"SELECT {key}, * FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                            (last_key, batch_size)
+                        )
+                    rows = cur.fetchall()
+            except sqlite3.Error as e:
+                print(f"Ошибка в iter_table_rows для table={table}: {e}")
+                raise
+            for row in rows:
+                yield row[1:]
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][0]
+
+    def _bump_version(self, cur: sqlite3.Cursor, name: str):
+        """Увеличивает счётчик версии, по которому другие процессы узнают об изменениях."""
+        cur.execute(
+            """
+            INSERT INTO settings (key, value) VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1
+            """,
+            (name,)
+        )
+
+    def get_settings_version(self, name: str) -> int:
+        """Получает текущую версию по ключу настроек."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT value FROM settings WHERE key=?", (name,))
+                row = cur.fetchone()
+                return int(row[0]) if row else 0
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_settings_version для name={name}: {e}")
+            return 0
+
+    def seed_admins(self, user_ids: List[int]):
+        """Заполняет список администраторов из конфигурации, если он ещё пуст."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT 1 FROM admins LIMIT 1")
+                if cur.fetchone() or not user_ids:
+                    return
+                cur.executemany("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", [(uid,) for uid in user_ids])
+                self._bump_version(cur, "admins_version")
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в seed_admins: {e}")
+            raise
+
+    def get_admins(self) -> Tuple[int, List[int]]:
+        """Получает версию и список администраторов одним снимком."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT value FROM settings WHERE key='admins_version'")
+                row = cur.fetchone()
+                cur.execute("SELECT user_id FROM admins ORDER BY added_at, user_id")
+                return (int(row[0]) if row else 0), [r[0] for r in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_admins: {e}")
+            raise
+
+    def add_admin(self, user_id: int) -> bool:
+        """Добавляет администратора. Возвращает False, если он уже был."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+                if cur.rowcount == 0:
+                    return False
+                self._bump_version(cur, "admins_version")
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Ошибка в add_admin для user_id={user_id}: {e}")
+            raise
+
+    def remove_admin(self, user_id: int) -> bool:
+        """Удаляет администратора. Возвращает False, если его не было."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM admins WHERE user_id=?", (user_id,))
+                if cur.rowcount == 0:
+                    return False
+                self._bump_version(cur, "admins_version")
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Ошибка в remove_admin для user_id={user_id}: {e}")
+            raise
+
+    def get_segment_state(self, segment: str) -> Optional[Tuple[int, Optional[int]]]:
+        """Получает время последнего пересчёта сегмента и использованную границу активности."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT refreshed_at, cutoff FROM audience_state WHERE segment=?", (segment,))
+                return cur.fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_segment_state для segment={segment}: {e}")
+            return None
+
+    def rebuild_segment(self, segment: str, now: int, cutoff: Optional[int] = None):
+        """Полностью пересобирает сегмент аудитории."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM audience_members WHERE segment=?", (segment,))
+                if cutoff is not None:
+                    cur.execute(
+                        "INSERT INTO audience_members (segment, user_id) SELECT ?, user_id FROM users WHERE last_seen >= ?",
+                        (segment, cutoff)
+                    )
+                else:
+                    cur.execute(
+                        f"INSERT OR IGNORE INTO audience_members (segment, user_id) SELECT ?, user_id FROM ({SEGMENT_QUERIES[segment]})",
+                        (segment,)
+                    )
+                cur.execute(
+                    "INSERT OR REPLACE INTO audience_state (segment, refreshed_at, cutoff) VALUES (?, ?, ?)",
+                    (segment, now, cutoff)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в rebuild_segment для segment={segment}: {e}")
+            raise
+
+    def refresh_activity_segment(self, segment: str, now: int, cutoff: int, prev_refreshed_at: int, prev_cutoff: int,
+                                 flush_lag: int = 0):
+        """Инкрементально обновляет сегмент активных: убирает выпавших из окна и добавляет недавно активных.
+
+        flush_lag — насколько позже записываются отметки активности (буфер UserWriter): окно добавления
+        расширяется назад, чтобы отметка, записанная после прошлого обновления, не потерялась.
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    DELETE FROM audience_members WHERE segment=? AND user_id IN (
+                        SELECT user_id FROM users WHERE last_seen >= ? AND last_seen < ?
+                    )
+                    """,
+                    (segment, prev_cutoff, cutoff)
+                )
+                cur.execute(
+                    """
+                    INSERT OR IGNORE INTO audience_members (segment, user_id)
+                    SELECT ?, user_id FROM users WHERE last_seen >= ?
+                    """,
+                    (segment, max(prev_refreshed_at - flush_lag, cutoff))
+                )
+                cur.execute(
+                    "INSERT OR REPLACE INTO audience_state (segment, refreshed_at, cutoff) VALUES (?, ?, ?)",
+                    (segment, now, cutoff)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в refresh_activity_segment для segment={segment}: {e}")
+            raise
+
+    def add_segment_members(self, segment: str, user_ids: List[int]):
+        """Добавляет пользователей в сегмент при событиях (завершённая сделка и т.п.)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.executemany(
+                    "INSERT OR IGNORE INTO audience_members (segment, user_id) VALUES (?, ?)",
+                    [(segment, user_id) for user_id in user_ids]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в add_segment_members для segment={segment}: {e}")
+            raise
+
+    def get_segment_users_page(self, segment: Optional[str], after: int, limit: int) -> List[int]:
+        """Получает следующую страницу достижимых пользователей сегмента после user_id=after (None — все)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                if segment is None:
+                    cur.execute(
+                        "SELECT user_id FROM users WHERE user_id > ? AND deliverable=1 ORDER BY user_id LIMIT ?",
+                        (after, limit)
+                    )
+                else:
+                    cur.execute(
+                        """
+                        SELECT m.user_id FROM audience_members m JOIN users u ON u.user_id = m.user_id
+                        WHERE m.segment=? AND m.user_id > ? AND u.deliverable=1
+                        ORDER BY m.user_id LIMIT ?
+                        """,
+                        (segment, after, limit)
+                    )
+                return [row[0] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_segment_users_page для segment={segment}: {e}")
+            raise
+
+    def iter_segment_users(self, segment: Optional[str], batch_size: int = 1000) -> Iterator[int]:
+        """Построчно отдаёт достижимых пользователей сегмента (None — все пользователи)."""
+        last_id = -1
+        while True:
+            rows = self.get_segment_users_page(segment, last_id, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]
+
+    def count_segment_users(self, segment: Optional[str]) -> int:
+        """Считает достижимых пользователей сегмента (None — все пользователи)."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                if segment is None:
+                    cur.execute("SELECT COUNT(*) FROM users WHERE deliverable=1")
+                else:
+                    cur.execute(
+                        """
+                        SELECT COUNT(*) FROM audience_members m JOIN users u ON u.user_id = m.user_id
+                        WHERE m.segment=? AND u.deliverable=1
+                        """,
+                        (segment,)
+                    )
+                return cur.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка в count_segment_users для segment={segment}: {e}")
+            return 0
+
+    def mark_undeliverable(self, user_ids: List[int]):
+        """Помечает пользователей, которым бот не может писать."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.executemany("UPDATE users SET deliverable=0 WHERE user_id=?", [(user_id,) for user_id in user_ids])
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в mark_undeliverable для {len(user_ids)} пользователей: {e}")
+            raise
+
+    def ensure_job(self, name: str, next_run_at: int):
+        """Регистрирует периодическую задачу, не сбрасывая уже сохранённый таймер."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("INSERT OR IGNORE INTO scheduled_jobs (name, next_run_at) VALUES (?, ?)", (name, next_run_at))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в ensure_job для {name}: {e}")
+            raise
+
+    def get_due_jobs(self, now: int) -> List[str]:
+        """Получает задачи, время запуска которых наступило."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT name FROM scheduled_jobs WHERE next_run_at <= ? ORDER BY next_run_at", (now,))
+                return [row[0] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_due_jobs: {e}")
+            return []
+
+    def claim_job(self, name: str, now: int, interval: int) -> bool:
+        """Переносит таймер задачи на следующий запуск; True — задача взята этим процессом."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE scheduled_jobs SET next_run_at=? WHERE name=? AND next_run_at <= ? RETURNING name",
+                    (now + interval, name, now)
+                )
+                claimed = cur.fetchone() is not None
+                conn.commit()
+                return claimed
+        except sqlite3.Error as e:
+            print(f"Ошибка в claim_job для {name}: {e}")
+            return False
+
+    def finish_job(self, name: str, finished_at: int, error: Optional[str] = None):
+        """Сохраняет время и результат последнего запуска задачи."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "UPDATE scheduled_jobs SET last_run_at=?, last_error=? WHERE name=?",
+                    (finished_at, error, name)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка в finish_job для {name}: {e}")
+
+    def get_next_job_time(self) -> Optional[int]:
+        """Получает время ближайшего запуска среди всех задач."""
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT MIN(next_run_at) FROM scheduled_jobs")
+                return cur.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка в get_next_job_time: {e}")
+            return None
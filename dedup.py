@@ -0,0 +1,42 @@
+import hashlib
+import re
+from typing import Dict, Optional
+
+# Хэш укорачивается: для поиска повторов у одного продавца коллизии не страшны
+HASH_LENGTH = 16
+# Виды совпадения, которые find_duplicate возвращает для показа модераторам
+DUPLICATE_MATCH_LABELS = {
+    "content": "тот же текст и цена",
+    "photo": "то же фото",
+    "name": "то же название у продавца",
+}
+
+def normalize_text(text: Optional[str]) -> str:
+    """Приводит текст к виду для сравнения: регистр, ё, пунктуация и лишние пробелы не учитываются."""
+    text = (text or "").lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def normalize_price(price: Optional[str]) -> str:
+    """Оставляет в цене только цифры: «1 500 ₽» и «1500р» совпадают."""
+    return re.sub(r"\D", "", price or "")
+
+def _hash(*parts: str) -> str:
+    """Короткий хэш нормализованных частей."""
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()[:HASH_LENGTH]
+
+def listing_fingerprint(name: Optional[str], description: Optional[str], price: Optional[str],
+                        photo_unique_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """Отпечаток объявления для поиска повторов по индексам products."""
+    normalized_name = normalize_text(name)
+    return {
+        "content_hash": _hash(normalized_name, normalize_text(description), normalize_price(price)),
+        "name_hash": _hash(normalized_name),
+        "photo_unique_id": photo_unique_id,
+    }
+
+def data_fingerprint(data: dict) -> Dict[str, Optional[str]]:
+    """Отпечаток объявления из данных формы продажи: первое фото определяется по file_unique_id."""
+    photos = data.get("photos") or []
+    photo_unique_id = photos[0]["full"].get("file_unique_id") if photos else None
+    return listing_fingerprint(data.get("name"), data.get("description"), data.get("price"), photo_unique_id)
@@ -0,0 +1,86 @@
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Iterator, List, Tuple, IO
+
+from database import Database, EXPORT_TABLES
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "jsonl")
+# Сколько строк попадает в один файл-чанк (лимит документа в Telegram — 50 МБ)
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_BATCH_SIZE = 500
+
+def iter_chunks(rows: Iterator[tuple], chunk_rows: int) -> Iterator[Iterator[tuple]]:
+    """Разбивает поток строк на последовательные чанки без буферизации."""
+    rows = iter(rows)
+    for first in rows:
+        def chunk(first=first):
+            yield first
+            for _ in range(chunk_rows - 1):
+                try:
+                    yield next(rows)
+                except StopIteration:
+                    return
+        current = chunk()
+        yield current
+        # Дочитываем чанк, если потребитель остановился раньше
+        for _ in current:
+            pass
+
+def _open_chunk(path: str, compress: bool) -> IO[str]:
+    """Открывает файл чанка на запись, при необходимости со сжатием gzip."""
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+def _write_chunk(f: IO[str], columns: List[str], rows: Iterator[tuple], fmt: str) -> int:
+    """Записывает строки чанка в файл в выбранном формате."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+def write_export(db: Database, table: str, fmt: str, compress: bool, out_dir: str,
+                 chunk_rows: int = EXPORT_CHUNK_ROWS) -> List[Tuple[str, int]]:
+    """Выгружает таблицу в файлы-чанки, возвращает список (путь, количество строк)."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    columns = db.get_table_columns(table)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ext = fmt + (".gz" if compress else "")
+    files = []
+    rows = db.iter_table_rows(table, batch_size=EXPORT_BATCH_SIZE)
+    for part, chunk in enumerate(iter_chunks(rows, chunk_rows), 1):
+        path = os.path.join(out_dir, f"{table}_{stamp}_part{part}.{ext}")
+        with _open_chunk(path, compress) as f:
+            count = _write_chunk(f, columns, chunk, fmt)
+        files.append((path, count))
+    if not files:
+        # Пустая таблица — отдаём файл только с заголовком
+        path = os.path.join(out_dir, f"{table}_{stamp}_part1.{ext}")
+        with _open_chunk(path, compress) as f:
+            _write_chunk(f, columns, iter(()), fmt)
+        files.append((path, 0))
+    logger.info(f"Выгрузка {table} в {fmt}: {sum(c for _, c in files)} строк, {len(files)} файлов")
+    return files
+
+async def export_table(db: Database, table: str, fmt: str, compress: bool, out_dir: str) -> List[Tuple[str, int]]:
+    """Выполняет выгрузку в отдельном потоке, чтобы не блокировать цикл событий."""
+    return await asyncio.to_thread(write_export, db, table, fmt, compress, out_dir)
@@ -1,11 +1,18 @@
+import logging
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from typing import Optional, Tuple
-import sqlite3
 from config import Config
+from database import Database
 from utils import escape_html
 
+logger = logging.getLogger(__name__)
+
 class Keyboards:
     """Класс для создания клавиатур бота."""
+    def __init__(self, db: Database):
+        """Клавиатуры со списками читают данные через общий слой Database."""
+        self.db = db
+
     def get_main_menu(self) -> InlineKeyboardMarkup:
         """Создание главного меню."""
         return InlineKeyboardMarkup(inline_keyboard=[
@@ -36,35 +43,44 @@ class Keyboards:
             [InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main")]
         ])
 
+    def get_product_card_kb(self, product_id: int, item_type: str, photos_count: int = 0) -> InlineKeyboardMarkup:
+        """Создание клавиатуры карточки товара/услуги."""
+        kb_rows = [[InlineKeyboardButton(text="💰 Купить", callback_data=f"buy_{product_id}")]]
+        if photos_count:
+            kb_rows.append([InlineKeyboardButton(text=f"🔍 Фото ({photos_count})", callback_data=f"photos_{product_id}")])
+        kb_rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=f"buy_type_{item_type}")])
+        return InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+    def get_admin_page_kb(self, kind: str, first_id: Optional[int], last_id: Optional[int],
+                          has_prev: bool, has_next: bool, item_rows: Optional[list] = None) -> InlineKeyboardMarkup:
+        """Создание клавиатуры навигации по админскому списку с курсорами."""
+        kb_rows = list(item_rows or [])
+        nav_buttons = []
+        if has_prev and first_id is not None:
+            nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"adm_page:{kind}:p:{first_id}"))
+        if has_next and last_id is not None:
+            nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"adm_page:{kind}:n:{last_id}"))
+        if nav_buttons:
+            kb_rows.append(nav_buttons)
+        return InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
     def get_products(self, page: int = 0, item_type: Optional[str] = None) -> Tuple[InlineKeyboardMarkup, int]:
         """Получение списка товаров/услуг с пагинацией."""
         try:
-            with sqlite3.connect("db.sqlite3") as conn:
-                cur = conn.cursor()
-                query = "SELECT id, name FROM products WHERE status = 'approved'"
-                params = []
-                if item_type:
-                    query += " AND type = ?"
-                    params.append(item_type)
-                query += " ORDER BY id DESC"
-                cur.execute(query, params)
-                rows = cur.fetchall()
-                total = len(rows)
-                start = page * Config.PAGE_SIZE
-                end = start + Config.PAGE_SIZE
-                page_rows = rows[start:end]
-                kb_rows = [
-                    [InlineKeyboardButton(text=f"{r[0]}. {escape_html(r[1])}", callback_data=f"product_{r[0]}")]
-                    for r in page_rows
-                ]
-                nav_buttons = []
-                if page > 0:
-                    nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"page_{page-1}_{item_type or 'all'}"))
-                if end < total:
-                    nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"page_{page+1}_{item_type or 'all'}"))
-                nav_buttons.append(InlineKeyboardButton(text="🔙 Назад", callback_data="buy_select_type"))
-                kb_rows.append(nav_buttons)
-                return InlineKeyboardMarkup(inline_keyboard=kb_rows), total
+            page_rows, total = self.db.get_products(page, item_type, Config.PAGE_SIZE)
+            end = (page + 1) * Config.PAGE_SIZE
+            kb_rows = [
+                [InlineKeyboardButton(text=f"{product_id}. {escape_html(name)}", callback_data=f"product_{product_id}")]
+                for product_id, name, _, _ in page_rows
+            ]
+            nav_buttons = []
+            if page > 0:
+                nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"page_{page-1}_{item_type or 'all'}"))
+            if end < total:
+                nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"page_{page+1}_{item_type or 'all'}"))
+            nav_buttons.append(InlineKeyboardButton(text="🔙 Назад", callback_data="buy_select_type"))
+            kb_rows.append(nav_buttons)
+            return InlineKeyboardMarkup(inline_keyboard=kb_rows), total
         except Exception as e:
             logger.error(f"Ошибка в get_products: {e}")
             return InlineKeyboardMarkup(inline_keyboard=[]), 0
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать завершения обрабатываемых обновлений и фоновых задач при остановке
+DRAIN_TIMEOUT_SECONDS = 20.0
+
+class Lifecycle:
+    """Учёт обрабатываемых обновлений: после остановки приёма новые не берутся, текущие дорабатывают."""
+    def __init__(self):
+        self.accepting = True
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке."""
+        return self._in_flight
+
+    def begin(self):
+        """Отмечает начало обработки обновления."""
+        self._in_flight += 1
+        self._idle.clear()
+
+    def end(self):
+        """Отмечает окончание обработки обновления."""
+        self._in_flight -= 1
+        if self._in_flight == 0:
+            self._idle.set()
+
+    def stop_intake(self):
+        """Перестаёт принимать новые обновления."""
+        self.accepting = False
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждёт окончания обработки текущих обновлений; False — не успели за timeout."""
+        if self._in_flight:
+            logger.info(f"Ожидание завершения {self._in_flight} обновлений")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались завершения {self._in_flight} обновлений за {timeout:.0f} с")
+            return False
+
+class InFlightMiddleware(BaseMiddleware):
+    """Считает обрабатываемые обновления и отбрасывает новые после начала остановки."""
+    def __init__(self, lifecycle: Lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self.lifecycle.accepting:
+            return None
+        self.lifecycle.begin()
+        try:
+            return await handler(event, data)
+        finally:
+            self.lifecycle.end()
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from database import Database
+from reservations import OFFER_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Сделки без брони (созданные до появления броней) отменяются после недели без завершения
+ORDER_IDLE_SECONDS = 7 * 86400
+# Сколько дней объявление висит в каталоге и канале
+LISTING_TTL_DAYS = 30
+MAINTENANCE_BATCH_SIZE = 200
+# Закрытые объявления и сделки переносятся в архив через ARCHIVE_AFTER_DAYS дней
+ARCHIVE_AFTER_DAYS = 14
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_MAX_BATCHES = 20
+# Интервалы запуска задач обслуживания
+EXPIRE_ORDERS_INTERVAL = 3600
+EXPIRE_LISTINGS_INTERVAL = 3600
+ARCHIVE_INTERVAL = 6 * 3600
+COMPACT_INTERVAL = 24 * 3600
+
+class Maintenance:
+    """Задачи обслуживания: отмена зависших сделок, снятие старых объявлений, архив и чистка базы."""
+    def __init__(self, db: Database, on_order_expired: Callable[[int, tuple], Awaitable[None]]):
+        self.db = db
+        self.on_order_expired = on_order_expired
+
+    async def expire_orders(self) -> int:
+        """Отменяет зависшие сделки без брони."""
+        cutoff = int(time.time()) - ORDER_IDLE_SECONDS
+        canceled = 0
+        for order_id in self.db.get_idle_orders(cutoff, MAINTENANCE_BATCH_SIZE):
+            try:
+                result = self.db.cancel_order(order_id, offer_ttl=OFFER_TTL_SECONDS)
+                if result:
+                    canceled += 1
+                    await self.on_order_expired(order_id, result)
+            except Exception as e:
+                logger.error(f"Ошибка при отмене зависшей сделки {order_id}: {e}")
+        if canceled:
+            logger.info(f"Отменено зависших сделок: {canceled}")
+        return canceled
+
+    async def expire_listings(self) -> int:
+        """Снимает с публикации объявления старше LISTING_TTL_DAYS."""
+        cutoff = int(time.time()) - LISTING_TTL_DAYS * 86400
+        expired = await asyncio.to_thread(self.db.expire_listings, cutoff, MAINTENANCE_BATCH_SIZE)
+        if expired:
+            logger.info(f"Снято с публикации устаревших объявлений: {expired}")
+        return expired
+
+    async def archive(self) -> int:
+        """Переносит закрытые объявления и сделки в архивные таблицы пачками."""
+        cutoff = int(time.time()) - ARCHIVE_AFTER_DAYS * 86400
+        moved_products = moved_orders = 0
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            products, orders = await asyncio.to_thread(self.db.archive_cold_rows, cutoff, ARCHIVE_BATCH_SIZE)
+            moved_products += products
+            moved_orders += orders
+            if products < ARCHIVE_BATCH_SIZE and orders < ARCHIVE_BATCH_SIZE:
+                break
+        if moved_products or moved_orders:
+            logger.info(f"В архив перенесено объявлений: {moved_products}, сделок: {moved_orders}")
+        return moved_products + moved_orders
+
+    async def compact(self):
+        """Чистит служебные таблицы и обновляет статистику SQLite."""
+        await asyncio.to_thread(self.db.compact)
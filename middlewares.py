@@ -0,0 +1,100 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from admins import AdminRegistry
+from throttling import Throttler
+from users import PermissionCache, UserWriter
+
+logger = logging.getLogger(__name__)
+
+class AdminMiddleware(BaseMiddleware):
+    """Пропускает к хендлерам с флагом admin только администраторов."""
+    def __init__(self, registry: AdminRegistry):
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "admin"):
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        if user and self.registry.is_admin(user.id):
+            return await handler(event, data)
+        handler_obj = data.get("handler")
+        handler_name = handler_obj.callback.__name__ if handler_obj else "unknown"
+        logger.warning(f"Несанкционированный доступ к {handler_name} от user_id={user.id if user else None}")
+        if isinstance(event, CallbackQuery):
+            await event.answer("🚫 У вас нет прав для этого действия.", show_alert=True)
+        return None
+
+class SellPermissionMiddleware(BaseMiddleware):
+    """Один раз за обновление определяет право пользователя на продажу для хендлеров с флагом sell."""
+    def __init__(self, permissions: PermissionCache):
+        self.permissions = permissions
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if get_flag(data, "sell"):
+            user = data.get("event_from_user")
+            data["can_sell"] = bool(user) and self.permissions.can_sell(user.id)
+        return await handler(event, data)
+
+class ActivityMiddleware(BaseMiddleware):
+    """Отмечает активность пользователя в буфере на каждом обновлении, без записи в базу."""
+    def __init__(self, writer: UserWriter):
+        self.writer = writer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user and not user.is_bot:
+            self.writer.touch(user.id)
+        return await handler(event, data)
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Отбрасывает обновления пользователя сверх лимита его класса действий (флаг throttle или action)."""
+    def __init__(self, throttler: Throttler, registry: AdminRegistry, action: str):
+        self.throttler = throttler
+        self.registry = registry
+        self.action = action
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if not user or self.registry.is_admin(user.id):
+            return await handler(event, data)
+        # На уровне Update хендлер ещё не выбран и флагов нет: действует класс action
+        action = get_flag(data, "throttle") or self.action
+        retry_after = self.throttler.hit(user.id, action)
+        if not retry_after:
+            return await handler(event, data)
+        # Предупреждение и запись в лог — один раз за период превышения, остальное молча отбрасывается
+        if self.throttler.should_warn(user.id, action):
+            logger.warning(f"Превышен лимит {action} для user_id={user.id}")
+            text = f"⏳ Слишком часто. Попробуйте через {retry_after:.0f} с."
+            if isinstance(event, Update):
+                event = event.event
+            if isinstance(event, CallbackQuery):
+                await event.answer(text, show_alert=True)
+            elif isinstance(event, Message):
+                await event.answer(text)
+        return None
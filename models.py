@@ -0,0 +1,45 @@
+import sqlite3
+from typing import NamedTuple, Optional
+
+class Product(NamedTuple):
+    """Строка таблицы products."""
+    id: int
+    seller_id: int
+    name: str
+    description: str
+    price: str
+    contact: str
+    photo: Optional[str]
+    status: str
+    type: str
+    channel_message_id: Optional[int]
+    approved_at: Optional[int]
+    closed_at: Optional[int]
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> "Product":
+        """Фабрика строк для cursor.row_factory: колонки выбираются в порядке PRODUCT_COLUMNS."""
+        return cls._make(row)
+
+class Order(NamedTuple):
+    """Строка таблицы orders."""
+    id: int
+    product_id: int
+    seller_id: int
+    buyer_id: int
+    status: str
+    seller_message_id: Optional[int]
+    buyer_message_id: Optional[int]
+    seller_confirmed: int
+    buyer_confirmed: int
+    created_at: Optional[int]
+    closed_at: Optional[int]
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> "Order":
+        """Фабрика строк для cursor.row_factory: колонки выбираются в порядке ORDER_COLUMNS."""
+        return cls._make(row)
+
+# Списки колонок для SELECT, совпадающие с порядком полей моделей
+PRODUCT_COLUMNS = ", ".join(Product._fields)
+ORDER_COLUMNS = ", ".join(Order._fields)
@@ -0,0 +1,82 @@
+import logging
+import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from database import Database
+from dedup import DUPLICATE_MATCH_LABELS, normalize_price
+
+logger = logging.getLogger(__name__)
+
+# Слова, с которыми объявление отклоняется без модератора (сравниваются основы, без учёта регистра)
+BANNED_WORDS = (
+    "казино", "ставки на спорт", "букмекер", "наркот", "мефедрон", "спайс",
+    "поддельн", "фальшив", "обнал", "взлом аккаунт", "порно",
+    "заработок без вложений", "финансов пирамид",
+)
+# Цена за пределами диапазона отправляется модератору
+MIN_PRICE = 1
+MAX_PRICE = 10_000_000
+# Продавец с таким числом одобренных объявлений и без отказов публикуется без модератора
+TRUSTED_MIN_APPROVED = 3
+# Ссылок в тексте, начиная с которых объявление считается спамом
+SPAM_MIN_LINKS = 2
+
+# Вердикты проверки
+APPROVE = "approve"
+REJECT = "reject"
+REVIEW = "review"
+
+_LINK_RE = re.compile(r"(?:https?://|www\.|\bt\.me/|\b[\w-]+\.(?:ru|com|net|org|su|io|me)\b)", re.IGNORECASE)
+_CONTACT_RE = re.compile(r"(?:@[A-Za-z]\w{3,}|(?:\+7|\b8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}\b)")
+
+def compile_banned_words(words: Iterable[str]) -> re.Pattern:
+    """Собирает все запрещённые слова в одно регулярное выражение: текст просматривается за один проход."""
+    alternatives = sorted({re.escape(w.lower()).replace(r"\ ", r"\w*\s+") for w in words if w.strip()}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")", re.IGNORECASE)
+
+class Verdict(NamedTuple):
+    """Решение автомодерации и причины, показываемые модератору или продавцу."""
+    action: str
+    reasons: Tuple[str, ...]
+
+class AutoModerator:
+    """Локальные правила перед ручной модерацией: спам отклоняется, доверенные продавцы публикуются сразу."""
+    def __init__(self, db: Database, banned_words: Iterable[str] = BANNED_WORDS):
+        self.db = db
+        self._banned = compile_banned_words(banned_words)
+
+    def check_text(self, name: str, description: str, price: str) -> Tuple[List[str], List[str]]:
+        """Проверяет текст объявления без обращения к базе: (причины отказа, причины проверки модератором)."""
+        text = f"{name}\n{description}"
+        reject, review = [], []
+        banned = self._banned.search(text)
+        if banned:
+            reject.append(f"запрещённое слово «{banned.group(0)}»")
+        links = len(_LINK_RE.findall(text))
+        if links >= SPAM_MIN_LINKS:
+            reject.append(f"ссылки в тексте ({links})")
+        elif links:
+            review.append("ссылка в тексте")
+        if _CONTACT_RE.search(text):
+            review.append("контакт в тексте")
+        digits = normalize_price(price)
+        if not digits:
+            review.append("цена без числа")
+        elif not MIN_PRICE <= int(digits) <= MAX_PRICE:
+            review.append(f"подозрительная цена {digits}")
+        return reject, review
+
+    def check(self, seller_id: int, data: dict, duplicate: Optional[tuple] = None) -> Verdict:
+        """Проверяет новое объявление и историю продавца."""
+        reject, review = self.check_text(data["name"], data["description"], data["price"])
+        if reject:
+            return Verdict(REJECT, tuple(reject))
+        if duplicate:
+            dup_id, dup_status, match = duplicate
+            review.append(f"возможный повтор №{dup_id} ({dup_status}): {DUPLICATE_MATCH_LABELS.get(match, match)}")
+        if review:
+            return Verdict(REVIEW, tuple(review))
+        approved, rejected = self.db.get_seller_history(seller_id)
+        if approved >= TRUSTED_MIN_APPROVED and not rejected:
+            return Verdict(APPROVE, (f"доверенный продавец: {approved} одобренных",))
+        return Verdict(REVIEW, ())
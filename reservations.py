@@ -0,0 +1,48 @@
+import logging
+import time
+from typing import Awaitable, Callable
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Сколько бронь товара держится за покупателем без активности в сделке; каждое сообщение и подтверждение продлевает её
+HOLD_TTL_SECONDS = 48 * 3600
+# Бронь переписывается не чаще, чем продлевается на это время: переписка не пишет в базу на каждое сообщение
+HOLD_TOUCH_INTERVAL = 10 * 60
+# Сколько у покупателя из очереди времени, чтобы начать сделку
+OFFER_TTL_SECONDS = 30 * 60
+SWEEP_INTERVAL_SECONDS = 60
+SWEEP_BATCH_SIZE = 100
+
+def extend_hold(db: Database, order_id: int) -> bool:
+    """Отодвигает истечение брони сделки после активности покупателя или продавца."""
+    return db.touch_hold(order_id, int(time.time()) + HOLD_TTL_SECONDS, HOLD_TOUCH_INTERVAL)
+
+class ReservationSweeper:
+    """Снятие истёкших броней по расписанию: отмена зависших сделок и передача товара следующему в очереди."""
+    def __init__(self, db: Database,
+                 on_order_expired: Callable[[int, tuple], Awaitable[None]],
+                 on_offer: Callable[[int, int], Awaitable[None]]):
+        self.db = db
+        self.on_order_expired = on_order_expired
+        self.on_offer = on_offer
+
+    async def sweep(self) -> int:
+        """Обрабатывает одну пачку истёкших броней, возвращает их количество."""
+        expired = self.db.get_expired_holds(int(time.time()), SWEEP_BATCH_SIZE)
+        for product_id, buyer_id, order_id in expired:
+            try:
+                if order_id:
+                    result = self.db.cancel_order(order_id, offer_ttl=OFFER_TTL_SECONDS)
+                    if result:
+                        logger.info(f"Сделка {order_id} по product_id={product_id} отменена по истечении брони")
+                        await self.on_order_expired(order_id, result)
+                        continue
+                # Истекло предложение из очереди или сделка уже закрыта — передаём товар дальше
+                next_buyer = self.db.release_hold(product_id, buyer_id, order_id, OFFER_TTL_SECONDS)
+                if next_buyer:
+                    await self.on_offer(next_buyer, product_id)
+            except Exception as e:
+                logger.error(f"Ошибка при снятии брони product_id={product_id}: {e}")
+        return len(expired)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from typing import FrozenSet, Mapping, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from admins import AdminRegistry
+from database import Database
+from telegram_api import api_priority, NOTIFY
+from utils import escape_html
+
+logger = logging.getLogger(__name__)
+
+# Сколько объявление закреплено за администратором, прежде чем перейти к другому
+REVIEW_LEASE_SECONDS = 30 * 60
+REVIEW_REASSIGN_INTERVAL = 60
+REVIEW_REASSIGN_BATCH = 50
+
+def review_keyboard(product_id: int, photos_count: int) -> InlineKeyboardMarkup:
+    """Кнопки карточки объявления на модерации."""
+    rows = [
+        [
+            InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{product_id}"),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{product_id}")
+        ]
+    ]
+    if photos_count > 1:
+        rows.append([InlineKeyboardButton(text=f"🔍 Все фото ({photos_count})", callback_data=f"photos_{product_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def review_caption(product_id: int, seller_id: int, data: Mapping, reasons: Tuple[str, ...] = ()) -> str:
+    """Текст карточки объявления для модератора (data — форма продажи или строка products)."""
+    type_label = "Товар" if data["type"] == "product" else "Услуга"
+    caption = (
+        f"🆕 {type_label} №{product_id} от пользователя {seller_id}\n\n"
+        f"{'📦' if data['type'] == 'product' else '🛠'} <b>{escape_html(data['name'])}</b>\n"
+        f"✏️ {escape_html(data['description'])}\n"
+        f"💸 Цена: {escape_html(data['price'])}₽\n"
+        f"📱 Контакт: {escape_html(data['contact'])}"
+    )
+    if reasons:
+        caption += "\n\n⚠️ " + escape_html("; ".join(reasons))
+    return caption
+
+class ReviewDispatcher:
+    """Очередь модерации: каждое объявление у одного администратора с арендой, решение — ровно одно."""
+    def __init__(self, db: Database, bot: Bot, registry: AdminRegistry, lease: int = REVIEW_LEASE_SECONDS):
+        self.db = db
+        self.bot = bot
+        self.registry = registry
+        self.lease = lease
+        self._admins = registry.admins
+        registry.subscribe(self._on_admins_changed)
+
+    def _on_admins_changed(self, admins: FrozenSet[int]):
+        """Объявления удалённых администраторов сразу становятся доступны для переназначения."""
+        removed = self._admins - admins
+        self._admins = admins
+        if removed:
+            released = self.db.expire_reviews_of(sorted(removed))
+            if released:
+                logger.info(f"Освобождено объявлений на модерации у удалённых администраторов: {released}")
+
+    async def _send(self, admin_id: int, product_id: int, caption: str, photo: Optional[str],
+                    kb: InlineKeyboardMarkup) -> int:
+        """Отправляет карточку администратору и возвращает ID сообщения."""
+        if photo:
+            sent = await self.bot.send_photo(chat_id=admin_id, photo=photo, caption=caption, parse_mode="HTML", reply_markup=kb)
+        else:
+            sent = await self.bot.send_message(chat_id=admin_id, text=caption, parse_mode="HTML", reply_markup=kb)
+        return sent.message_id
+
+    async def submit(self, product_id: int, caption: str, photo: Optional[str], photos_count: int) -> Optional[int]:
+        """Назначает новое объявление администратору и отправляет ему карточку; возвращает admin_id."""
+        admins = sorted(self.registry.admins)
+        kb = review_keyboard(product_id, photos_count)
+        failed = set()
+        with api_priority(NOTIFY):
+            # Недоступный администратор (заблокировал бота) пропускается, объявление уходит следующему
+            while len(failed) < len(admins):
+                admin_id = self.db.assign_moderator(product_id, admins, int(time.time()) + self.lease, exclude=failed)
+                if admin_id is None or admin_id in failed:
+                    break
+                try:
+                    message_id = await self._send(admin_id, product_id, caption, photo, kb)
+                    self.db.add_moderation_copy(product_id, admin_id, message_id)
+                    return admin_id
+                except Exception as e:
+                    logger.warning(f"Не удалось отправить админу {admin_id} product_id={product_id}: {e}")
+                    failed.add(admin_id)
+        logger.error(f"Объявление product_id={product_id} не назначено ни одному администратору")
+        return None
+
+    async def reassign_expired(self) -> int:
+        """Передаёт другим администраторам объявления, по которым не принято решение за время аренды."""
+        expired = self.db.get_expired_reviews(int(time.time()), REVIEW_REASSIGN_BATCH)
+        admins = sorted(self.registry.admins)
+        moved = 0
+        with api_priority(NOTIFY):
+            for product_id, previous_id in expired:
+                try:
+                    copies = dict(self.db.get_moderation_copies(product_id))
+                    if not copies:
+                        # Карточку не удалось доставить ни одному администратору — отправляем заново
+                        if await self._resubmit(product_id):
+                            moved += 1
+                        continue
+                    admin_id = self.db.assign_moderator(product_id, admins, int(time.time()) + self.lease, exclude=[previous_id])
+                    # Единственный администратор или у нового уже есть карточка: аренда просто продлена
+                    if admin_id is None or admin_id in copies:
+                        continue
+                    source_admin, source_message = next(iter(copies.items()))
+                    _, photos_count = self.db.get_product_preview(product_id)
+                    sent = await self.bot.copy_message(
+                        chat_id=admin_id, from_chat_id=source_admin, message_id=source_message,
+                        reply_markup=review_keyboard(product_id, photos_count)
+                    )
+                    self.db.add_moderation_copy(product_id, admin_id, sent.message_id)
+                    moved += 1
+                except Exception as e:
+                    logger.warning(f"Ошибка при переназначении product_id={product_id}: {e}")
+        if moved:
+            logger.info(f"Переназначено объявлений на модерации: {moved}")
+        return moved
+
+    async def _resubmit(self, product_id: int) -> bool:
+        """Заново отправляет карточку объявления, у которого нет ни одной копии у администраторов."""
+        product = self.db.get_product_any_status(product_id)
+        if product is None or product.status != "pending":
+            return False
+        _, photos_count = self.db.get_product_preview(product_id)
+        caption = review_caption(product_id, product.seller_id, product._asdict())
+        return await self.submit(product_id, caption, product.photo, photos_count) is not None
+
+    def begin(self, product_id: int, admin_id: int) -> bool:
+        """Закрепляет решение по объявлению за администратором; False — его уже принимает или принял другой."""
+        return self.db.begin_decision(product_id, admin_id)
+
+    def abort(self, product_id: int):
+        """Возвращает объявление в очередь после неудачного решения."""
+        self.db.abort_decision(product_id)
+
+    async def finish(self, product_id: int, label: str, skip: Optional[Tuple[int, int]] = None):
+        """Закрывает модерацию и одной пачкой помечает карточки объявления у остальных администраторов."""
+        copies = [c for c in self.db.finish_decision(product_id) if c != skip]
+        if not copies:
+            return
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=label, callback_data=f"reviewed_{product_id}")]
+        ])
+        with api_priority(NOTIFY):
+            results = await asyncio.gather(
+                *(self.bot.edit_message_reply_markup(chat_id=admin_id, message_id=message_id, reply_markup=kb)
+                  for admin_id, message_id in copies),
+                return_exceptions=True
+            )
+        for (admin_id, _), result in zip(copies, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось обновить карточку product_id={product_id} у админа {admin_id}: {result}")
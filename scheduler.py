@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять таймеры, если ближайший запуск далеко
+SCHEDULER_MAX_SLEEP_SECONDS = 30.0
+
+class Scheduler:
+    """Периодические задачи с таймерами в SQLite: после перезапуска расписание продолжается, а не начинается заново."""
+    def __init__(self, db: Database, max_sleep: float = SCHEDULER_MAX_SLEEP_SECONDS):
+        self.db = db
+        self.max_sleep = max_sleep
+        self._jobs: Dict[str, Tuple[int, Callable[[], Awaitable[object]]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def add(self, name: str, interval: int, func: Callable[[], Awaitable[object]], delay: int = 0):
+        """Регистрирует задачу; первый запуск — через delay секунд, если таймер ещё не сохранён в базе."""
+        self._jobs[name] = (interval, func)
+        self.db.ensure_job(name, int(time.time()) + delay)
+
+    async def run_due(self) -> int:
+        """Запускает задачи, время которых наступило, и возвращает их количество."""
+        now = int(time.time())
+        started = 0
+        for name in self.db.get_due_jobs(now):
+            if self._stopping:
+                break
+            job = self._jobs.get(name)
+            # Таймер переносится до запуска, чтобы задачу не взял параллельный процесс
+            if not job or not self.db.claim_job(name, now, job[0]):
+                continue
+            started += 1
+            error = None
+            self._idle.clear()
+            try:
+                await job[1]()
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Ошибка в задаче планировщика {name}: {e}")
+            finally:
+                self._idle.set()
+            self.db.finish_job(name, int(time.time()), error)
+        return started
+
+    async def _run(self):
+        """Цикл планировщика: спит до ближайшего таймера."""
+        while True:
+            try:
+                await self.run_due()
+                next_run = self.db.get_next_job_time()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле планировщика: {e}")
+                next_run = None
+            delay = self.max_sleep if next_run is None else next_run - time.time()
+            await asyncio.sleep(min(max(delay, 1.0), self.max_sleep))
+
+    def start(self):
+        """Запускает планировщик."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 0):
+        """Останавливает планировщик, дав выполняющейся задаче до timeout секунд на завершение."""
+        if self._task is not None:
+            self._stopping = True
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Задача планировщика не завершилась за {timeout:.0f} с и будет прервана")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
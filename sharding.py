@@ -0,0 +1,108 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов-обработчиков; 1 — обычный запуск в одном процессе
+WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+POLL_TIMEOUT = 30
+
+# Номер текущего процесса-обработчика (None — однопроцессный режим или front-процесс)
+current_shard: Optional[int] = None
+
+def is_primary_shard() -> bool:
+    """Фоновые задачи запускаются только в одном процессе: без шардов или в шарде 0."""
+    return current_shard in (None, 0)
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Номер процесса-обработчика для пользователя."""
+    return user_id % workers
+
+def extract_user_id(update: dict) -> int:
+    """Достаёт ID пользователя (или чата) из сырого обновления Telegram."""
+    for field, payload in update.items():
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = payload.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+async def run_front(bot: Bot, dp: Dispatcher, queues: List[multiprocessing.Queue]) -> None:
+    """Получает обновления и раздаёт их процессам-обработчикам по хэшу user_id."""
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    logger.info(f"Front-процесс запущен, обработчиков: {len(queues)}")
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            payload = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+            queues[shard_for(extract_user_id(payload), len(queues))].put(payload)
+            offset = update.update_id + 1
+
+async def _worker_loop(dp: Dispatcher, bot: Bot, queue: multiprocessing.Queue) -> None:
+    """Обрабатывает обновления из очереди своего шарда."""
+    await dp.emit_startup(bot=bot)
+    tasks = set()
+    try:
+        while True:
+            update = await asyncio.to_thread(queue.get)
+            if update is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        # Обработчики shutdown дожидаются начатых обновлений с ограничением по времени
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+def worker_main(index: int, queue: multiprocessing.Queue, app_module: str) -> None:
+    """Точка входа процесса-обработчика."""
+    global current_shard
+    current_shard = index
+    # Остановкой управляет front-процесс: обработчик доделывает очередь и завершается по метке None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bot, dp = importlib.import_module(app_module).create_app()
+    logger.info(f"Обработчик {index} запущен (pid={os.getpid()})")
+    try:
+        asyncio.run(_worker_loop(dp, bot, queue))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(bot: Bot, dp: Dispatcher, workers: int, app_module: str) -> None:
+    """Запускает front-процесс и workers процессов-обработчиков."""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(target=worker_main, args=(index, queue, app_module), name=f"bot-worker-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    # SIGTERM (systemd, docker stop) останавливает так же, как Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run_front(bot, dp, queues))
+    except KeyboardInterrupt:
+        logger.info("Остановка front-процесса")
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
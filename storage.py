@@ -0,0 +1,103 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+# Сколько ждать блокировку записи другого процесса
+LOCK_TIMEOUT_SECONDS = 10
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite, общее для нескольких процессов бота."""
+    def __init__(self, db_path: str):
+        """Инициализация хранилища с указанным путем к файлу SQLite."""
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Долгоживущее соединение текущего потока с ожиданием блокировки других процессов."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False только для закрытия из close(); запросы идут в потоке-владельце
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=LOCK_TIMEOUT_SECONDS, check_same_thread=False)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _init_db(self):
+        """Создание таблицы состояний и включение WAL для параллельного доступа."""
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT
+            )
+        """)
+        conn.commit()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        """Строковый ключ записи по ключу хранилища aiogram."""
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            getattr(key, "business_connection_id", None), key.destiny
+        ))
+
+    # Запросы идут через asyncio.to_thread: ожидание блокировки другого процесса не останавливает цикл событий
+    def _write(self, sql: str, params: tuple):
+        """Выполняет запись в потоке исполнителя."""
+        with self._connect() as conn:
+            conn.execute(sql, params)
+
+    def _read(self, sql: str, params: tuple) -> Optional[tuple]:
+        """Выполняет чтение одной строки в потоке исполнителя."""
+        return self._connect().execute(sql, params).fetchone()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """Сохраняет состояние пользователя."""
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(
+            self._write,
+            """
+            INSERT INTO fsm_storage (key, state) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET state=excluded.state
+            """,
+            (self._key(key), value)
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """Получает состояние пользователя."""
+        row = await asyncio.to_thread(self._read, "SELECT state FROM fsm_storage WHERE key=?", (self._key(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """Сохраняет данные пользователя."""
+        await asyncio.to_thread(
+            self._write,
+            """
+            INSERT INTO fsm_storage (key, data) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET data=excluded.data
+            """,
+            (self._key(key), json.dumps(data, ensure_ascii=False))
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """Получает данные пользователя."""
+        row = await asyncio.to_thread(self._read, "SELECT data FROM fsm_storage WHERE key=?", (self._key(key),))
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        """Закрывает соединения всех потоков."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
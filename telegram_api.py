@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета запросов к API: чем меньше число, тем выше приоритет
+INTERACTIVE = 0
+NOTIFY = 1
+BULK = 2
+# Доля ёмкости общего ведра, которую полоса не может занять (резерв для более приоритетных)
+LANE_RESERVE = {INTERACTIVE: 0.0, NOTIFY: 0.25, BULK: 0.5}
+
+# Общий лимит Bot API и лимиты на один чат (личный чат и группа/канал)
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+CHAT_BUCKETS_SIZE = 10_000
+# Методы, на которые распространяется лимит на чат
+CHAT_LIMITED_PREFIXES = ("Send", "Copy", "Forward")
+# Длинный опрос getUpdates не рассылает сообщения и не расходует общий лимит
+UNLIMITED_METHODS = ("GetUpdates",)
+RETRY_AFTER_ATTEMPTS = 2
+SESSION_CONNECTIONS = 100
+
+_priority: ContextVar[int] = ContextVar("api_priority", default=INTERACTIVE)
+
+@contextmanager
+def api_priority(lane: int) -> Iterator[None]:
+    """Выполняет запросы к API внутри блока в указанной полосе приоритета."""
+    token = _priority.set(lane)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """Ведро токенов с пополнением по времени и блокировкой после RetryAfter."""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self, reserve: float = 0.0) -> float:
+        """Берёт токен, если после этого в ведре останется резерв; иначе возвращает время ожидания."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens - 1 >= reserve:
+            self.tokens -= 1
+            return 0.0
+        return (reserve + 1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        """Запрещает запросы на seconds секунд (ответ RetryAfter от Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Ограничивает запросы бота общим лимитом и лимитом на чат с учётом полосы приоритета."""
+    def __init__(self, rate: float = GLOBAL_RATE, burst: int = GLOBAL_BURST, group_rate: float = GROUP_CHAT_RATE):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.group_rate = group_rate
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Ведро чата; редко используемые чаты вытесняются."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(self.group_rate, GROUP_CHAT_BURST)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > CHAT_BUCKETS_SIZE:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_bucket: Optional[TokenBucket], lane: int):
+        """Ждёт токены в ведре чата и в общем ведре."""
+        if chat_bucket is not None:
+            while (wait := chat_bucket.take()) > 0:
+                await asyncio.sleep(wait)
+        reserve = self.global_bucket.capacity * LANE_RESERVE.get(lane, 0.0)
+        while (wait := self.global_bucket.take(reserve)) > 0:
+            await asyncio.sleep(wait)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if type(method).__name__ in UNLIMITED_METHODS:
+            return await make_request(bot, method)
+        lane = _priority.get()
+        chat_id = getattr(method, "chat_id", None)
+        chat_bucket = None
+        if isinstance(chat_id, int) and type(method).__name__.startswith(CHAT_LIMITED_PREFIXES):
+            chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(RETRY_AFTER_ATTEMPTS + 1):
+            await self._acquire(chat_bucket, lane)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                logger.warning(f"RetryAfter {e.retry_after} с для {type(method).__name__} (chat_id={chat_id})")
+                (chat_bucket or self.global_bucket).block(e.retry_after)
+                # Массовые рассылки сами сохраняют курсор и продолжат позже, не занимая очередь ожиданием
+                if lane == BULK or attempt == RETRY_AFTER_ATTEMPTS:
+                    raise
+
+def create_bot(token: str, processes: int = 1) -> Bot:
+    """Создаёт бота с общим пулом соединений и ограничением скорости запросов.
+
+    Лимиты Telegram действуют на бота целиком, поэтому при запуске в processes процессах
+    каждый получает свою долю общего лимита и лимита групп/канала. Личные чаты не делятся:
+    чат пользователя обслуживает один процесс-обработчик.
+    """
+    processes = max(processes, 1)
+    session = AiohttpSession(limit=SESSION_CONNECTIONS)
+    session.middleware(RateLimitMiddleware(
+        GLOBAL_RATE / processes, max(GLOBAL_BURST // processes, 1), GROUP_CHAT_RATE / processes
+    ))
+    return Bot(token=token, session=session)
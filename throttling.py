@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Tuple
+
+# Лимиты по классам действий: (сколько обновлений, за сколько секунд)
+THROTTLE_LIMITS: Dict[str, Tuple[int, float]] = {
+    # Любые обновления пользователя, до проверки состояния и записи активности
+    "update": (60, 60.0),
+    "message": (30, 60.0),
+    "callback": (40, 60.0),
+    # Пересылка в сделке: чтение базы, запись лога и отправка собеседнику на каждое сообщение
+    "relay": (20, 60.0),
+    # Новые объявления: каждое уходит всем администраторам
+    "sell": (10, 3600.0),
+}
+THROTTLE_USERS_SIZE = 20_000
+
+class _Window:
+    """Времена последних обновлений пользователя в классе действий."""
+    __slots__ = ("hits", "warned")
+
+    def __init__(self, limit: int):
+        self.hits = deque(maxlen=limit)
+        self.warned = False
+
+class Throttler:
+    """Скользящие окна по пользователю и классу действий; давно неактивные окна вытесняются."""
+    def __init__(self, limits: Dict[str, Tuple[int, float]] = THROTTLE_LIMITS, max_size: int = THROTTLE_USERS_SIZE):
+        self.limits = limits
+        self.max_size = max_size
+        self._windows: "OrderedDict[Tuple[int, str], _Window]" = OrderedDict()
+
+    def hit(self, user_id: int, action: str) -> float:
+        """Учитывает обновление; 0 — пропустить, иначе через сколько секунд лимит освободится."""
+        limit, period = self.limits.get(action, self.limits["update"])
+        key = (user_id, action)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window(limit)
+            if len(self._windows) > self.max_size:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        now = time.monotonic()
+        if len(window.hits) == limit and now - window.hits[0] < period:
+            return period - (now - window.hits[0])
+        window.hits.append(now)
+        window.warned = False
+        return 0.0
+
+    def should_warn(self, user_id: int, action: str) -> bool:
+        """Предупреждать о лимите только один раз, пока он не освободится."""
+        window = self._windows.get((user_id, action))
+        if window is None or window.warned:
+            return False
+        window.warned = True
+        return True
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд перепроверять право на продажу (баны из других процессов)
+PERMISSION_TTL_SECONDS = 60.0
+PERMISSION_CACHE_SIZE = 10_000
+USER_FLUSH_SECONDS = 5.0
+
+class UserWriter:
+    """Буфер регистраций и активности пользователей, который записывается в базу одной пачкой."""
+    def __init__(self, db: Database, flush_interval: float = USER_FLUSH_SECONDS):
+        self.db = db
+        self.flush_interval = flush_interval
+        # Последнее время активности по пользователю; повторные касания схлопываются
+        self._pending: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: int, ts: Optional[int] = None):
+        """Отмечает активность пользователя (и регистрирует нового)."""
+        self._pending[user_id] = int(ts if ts is not None else time.time())
+
+    def register(self, user_id: int):
+        """Ставит пользователя в очередь на регистрацию."""
+        self._pending.setdefault(user_id, int(time.time()))
+
+    def flush(self):
+        """Записывает накопленных пользователей в базу."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            self.db.touch_users(list(pending.items()))
+        except Exception as e:
+            logger.error(f"Ошибка при записи активности {len(pending)} пользователей: {e}")
+            for user_id, ts in pending.items():
+                self._pending[user_id] = max(ts, self._pending.get(user_id, 0))
+
+    async def _run(self):
+        """Периодический сброс буфера."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def start(self):
+        """Запускает фоновый сброс буфера."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+class PermissionCache:
+    """Кэш права пользователей на продажу с записью бана/разбана сквозь кэш."""
+    def __init__(self, db: Database, writer: UserWriter, ttl: float = PERMISSION_TTL_SECONDS,
+                 max_size: int = PERMISSION_CACHE_SIZE):
+        self.db = db
+        self.writer = writer
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+
+    def _store(self, user_id: int, can_sell: bool):
+        """Сохраняет значение в кэш, вытесняя самые старые записи."""
+        self._cache[user_id] = (can_sell, time.monotonic())
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def can_sell(self, user_id: int) -> bool:
+        """Проверяет, может ли пользователь продавать."""
+        hit = self._cache.get(user_id)
+        if hit and time.monotonic() - hit[1] < self.ttl:
+            return hit[0]
+        try:
+            value = self.db.get_can_sell(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке права на продажу для user_id={user_id}: {e}")
+            return False
+        if value is None:
+            # Новый пользователь: по умолчанию может продавать, запись в базу — пачкой
+            self.writer.register(user_id)
+            value = True
+        self._store(user_id, value)
+        return value
+
+    def ban(self, user_id: int):
+        """Запрещает пользователю продавать."""
+        self.ban_many([user_id])
+
+    def ban_many(self, user_ids: List[int]):
+        """Запрещает продавать нескольким пользователям одной записью в базу."""
+        self.db.ban_users(user_ids)
+        for user_id in user_ids:
+            self._store(user_id, False)
+
+    def unban(self, user_id: int):
+        """Разрешает пользователю продавать."""
+        self.db.unban_user(user_id)
+        self._store(user_id, True)